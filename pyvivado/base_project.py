@@ -5,7 +5,7 @@ import shutil
 import time
 
 from pyvivado import utils
-from pyvivado import hash_helper, params_helper
+from pyvivado import hash_helper, params_helper, locks
 
 
 logger = logging.getLogger(__name__)
@@ -46,28 +46,6 @@ def get_hash(files_and_ip):
     return h.digest()
 
 
-def try_make_hash_directory(directory):
-    try:
-        os.mkdir(directory)
-        success = True
-    except FileExistsError:
-        success = False
-    return success
-
-
-def make_hash_directory(directory):
-    if not try_make_hash_directory(directory):
-        logger.warning('Temp directory for hash already exists. Waiting to see if it is deleted.')
-        max_waits = 10
-        n_waits = 0
-        while ((not try_make_hash_directory(directory)) and
-               (n_waits < max_waits)):
-            time.sleep(1)
-            n_waits += 1
-        if n_waits >= max_waits:
-            raise Exception('temp directory for hash already exists. {}'.format(directory))
-
-
 class BaseProjectException(Exception):
     pass
 
@@ -90,41 +68,51 @@ class BaseProject(object):
            `directory`: Location of the project.
         '''
         self.directory = os.path.abspath(directory)
-        if not os.path.exists(directory):
-            os.mkdir(directory)
+        os.makedirs(self.directory, exist_ok=True)
         self.hash_helper = hash_helper.HashHelper(
             self.directory, self.get_hash)
         self.file_helper = params_helper.FilesHelper(self.directory)
-        if files_and_ip is not None:
-            old_files_and_ip = self.file_helper.read()
-            if old_files_and_ip is not None:
-                if self.file_helper.has_changed(files_and_ip):
-                    if not overwrite_ok:
-                        raise OverwriteForbiddenException()
-                    else:
-                        self.file_helper.write(self.files_and_ip, overwrite_ok=True)
+        if files_and_ip is None:
+            self.wait_for_files_and_ip()
+        # Hold the project lock while reading and writing the project
+        # files so that we never see another process's partial writes.
+        with locks.FileLock(self.lock_fn()):
+            if files_and_ip is not None:
+                old_files_and_ip = self.file_helper.read()
+                if old_files_and_ip is not None:
+                    if self.file_helper.has_changed(files_and_ip):
+                        if not overwrite_ok:
+                            raise OverwriteForbiddenException()
+                        else:
+                            self.file_helper.write(files_and_ip, overwrite_ok=True)
+                else:
+                    self.file_helper.write(files_and_ip)
             else:
-                self.file_helper.write(files_and_ip)
-        else:
-            max_waits =5 
-            n_waits = 0
-            files_and_ip = self.file_helper.read()
-            # Sometimes the project has just been created and there hasn't been
-            # time for this info to be written.
-            # This waits to see if that is the case.
-            if files_and_ip is None:
-                logger.warning('Files and IP not available.  Waiting in the hope that they will be written soon.')
-            while (files_and_ip is None) and (n_waits < max_waits):
-                time.sleep(1)
-                n_waits += 1
                 files_and_ip = self.file_helper.read()
-        self.files_and_ip = files_and_ip
-        if self.hash_helper.is_changed():
-            if not overwrite_ok:
-                raise OverwriteForbiddenException()
-        if self.files_and_ip is None:
-            raise BaseProjectException('No Files and IP specified')
-        self.hash_helper.write()
+            self.files_and_ip = files_and_ip
+            if self.files_and_ip is None:
+                raise BaseProjectException('No Files and IP specified')
+            if self.hash_helper.is_changed():
+                if not overwrite_ok:
+                    raise OverwriteForbiddenException()
+            self.hash_helper.write()
+
+    def lock_fn(self):
+        return os.path.join(self.directory, 'project.lock')
+
+    def creation_lock_fn(self):
+        '''
+        The lock that `VivadoProject` holds while it creates the Vivado
+        project.  The files and IP are written before it is taken.
+        '''
+        return os.path.join(self.directory, 'vivado.lock')
+
+    def wait_for_files_and_ip(self):
+        '''
+        Block until any process creating the project has finished.
+        '''
+        with locks.FileLock(self.creation_lock_fn(), shared=True):
+            pass
 
     def get_hash(self):
         h = get_hash(self.files_and_ip)
@@ -9,6 +9,34 @@ hdldir = os.path.join(basedir, 'hdl')
 synopsys_libdir = os.path.join(basedir, '..', '..', 'libs')
 
 vivado = 'vivado'
+# Standalone simulator executables used by `xsim_project`.
+xvhdl = 'xvhdl'
+xvlog = 'xvlog'
+xelab = 'xelab'
+xsim = 'xsim'
+
+# Compiled simulation snapshots are shared between projects in this
+# directory.  Least recently used snapshots are deleted when it grows
+# larger than `sim_cache_max_bytes`.
+sim_cache_directory = os.path.join(
+    os.path.expanduser('~'), '.pyvivado', 'sim_cache')
+sim_cache_max_bytes = 10 * 2**30
+
+# Simulation results can be memoized in this directory
+# (see `result_cache.ResultCache`).
+result_cache_directory = os.path.join(
+    os.path.expanduser('~'), '.pyvivado', 'result_cache')
+result_cache_max_bytes = 2**30
+
+# If set, simulation models of IP are compiled once per Vivado version and
+# IP configuration into this directory (see `sim_library`) rather than in
+# every simset.
+sim_library_directory = None
+sim_library_max_bytes = 10 * 2**30
+
+# If set, generated and synthesized IP is shared between all projects
+# through this directory rather than being regenerated for each project.
+ip_cache_directory = None
 
 default_board = 'dummy'
 
@@ -30,6 +58,34 @@ hwtargets = {
     '0000137658c701': ('*/xilinx_tcf/Xilinx/0000137658c701', 6e6),
 }
 
+# The redis server used to keep track of the FPGAs and their monitors.
+redis_host = 'localhost'
+redis_port = 6379
+redis_db = 0
+# Seconds for which a status of all the FPGAs read from redis is reused.
+redis_status_ttl = 0.5
+
+# Milliseconds until a python process's mark that it is using an FPGA
+# expires unless renewed.  The monitors' heartbeats expire after
+# `::pyvivado::heartbeat_ttl` milliseconds.
+heartbeat_ttl = 3000
+# Milliseconds until a lease on an FPGA expires unless renewed.
+lease_ttl = 30000
+
+# Whether to start long-lived hardware sessions (see `hw_session`) that
+# keep FPGAs connected between deployments.
+hw_sessions = False
+
+# How python talks to the Vivado processes monitoring FPGAs.
+# Either 'redis' or 'socket'.
+monitor_transport = 'redis'
+
+# The ports that the monitors listen on when using the 'socket' transport.
+monitor_ports = {
+    '210203826421A': 7301,
+    '0000137658c701': 7302,
+}
+
 def setup_logging(level):
     '''
     Utility function for setting up logging.
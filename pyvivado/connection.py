@@ -17,12 +17,53 @@ that vivado process.
 '''
 import logging
 
-from pyvivado import redis_connection, redis_utils
+from pyvivado import config, redis_connection, redis_utils, socket_connection
 
 logger = logging.getLogger(__name__)
 
+TRANSPORTS = {
+    'redis': redis_connection.Connection,
+    'socket': socket_connection.Connection,
+}
+
+
+def get_connection(hwcode, transport=None, **kwargs):
+    '''
+    Create a connection to the monitor of an FPGA.
+
+    Args:
+        `hwcode`: The hardware code of the FPGA.
+        `transport`: 'redis' or 'socket'.  Defaults to
+            `config.monitor_transport`.
+    '''
+    if transport is None:
+        transport = config.monitor_transport
+    if transport not in TRANSPORTS:
+        raise ValueError('Unknown transport {}'.format(transport))
+    return TRANSPORTS[transport](hwcode, **kwargs)
+
 Connection = redis_connection.Connection
 
+
+def get_monitor_transport(hwcode, transport=None):
+    '''
+    The (transport, port) a monitor serves.  The port is '' for redis.
+    '''
+    if transport is None:
+        transport = config.monitor_transport
+    if transport == 'socket':
+        port = config.monitor_ports[hwcode]
+    else:
+        port = ''
+    return transport, port
+
+
+def get_monitor_args(hwcode, transport=None):
+    '''
+    The TCL arguments telling a monitor which transport to serve.
+    '''
+    return '{} {{{}}}'.format(*get_monitor_transport(hwcode, transport))
+
 # Find unused monitored hardware running a specific project.
 get_projdir_hwcode = redis_utils.get_projdir_hwcode
 
@@ -36,6 +77,76 @@ get_free_hwcode = redis_utils.get_free_hwcode
 # it is used or monitored.
 get_hardware_usage = redis_utils.get_hardware_usage
 
+class BatchingConnection(object):
+    '''
+    Wraps a connection and coalesces its commands into scripts that the
+    monitor runs in a single round trip.
+
+    Writes are queued rather than sent.  The queue is sent as one script
+    together with the next read, when `flush` is called, or when it holds
+    `max_queued` commands.  A sequence of writes followed by a read
+    therefore costs one round trip rather than one per command.
+
+    Since queued writes have not happened yet, `write` returns a `Response`
+    with zeros for data.  Errors from queued writes are raised by the call
+    that sends them.  Any other method (e.g. `poll`) is passed through to
+    the wrapped connection after the queue is sent.
+    '''
+
+    def __init__(self, conn, max_queued=256):
+        self.conn = conn
+        self.max_queued = max_queued
+        self.queued = []
+
+    def __getattr__(self, name):
+        attr = getattr(self.conn, name)
+        if callable(attr):
+            def after_flush(*args, **kwargs):
+                self.flush()
+                return attr(*args, **kwargs)
+            return after_flush
+        return attr
+
+    def queue(self, typ, address, length, data=(), timeout=None):
+        self.queued.append((typ, address, length, list(data)))
+        if len(self.queued) >= self.max_queued:
+            self.flush(timeout=timeout)
+
+    def flush(self, timeout=None):
+        '''
+        Send the queued commands and return their responses.
+        '''
+        queued = self.queued
+        self.queued = []
+        if queued:
+            responses = self.conn.run_script(queued, timeout=timeout)
+        else:
+            responses = []
+        return responses
+
+    def write(self, address, data, timeout=None):
+        self.queue('W', address, len(data), data, timeout=timeout)
+        return redis_connection.Response(
+            length=len(data), resp=0, data=[0]*len(data))
+
+    def write_repeat(self, address, data, timeout=None):
+        self.queue('WW', address, len(data), data, timeout=timeout)
+        return redis_connection.Response(
+            length=len(data), resp=0, data=[0]*len(data))
+
+    def read(self, address, length, timeout=None):
+        self.queued.append(('R', address, length, []))
+        return self.flush(timeout=timeout)[-1]
+
+    def read_repeat(self, address, length, timeout=None):
+        self.queued.append(('RR', address, length, []))
+        return self.flush(timeout=timeout)[-1]
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
 def kill_free_monitors(directory):
     '''
     Kill any monitors processes that are not being used.
@@ -44,5 +155,5 @@ def kill_free_monitors(directory):
     while hwcode:
         hwcode = get_projdir_hwcode(directory)
         if hwcode:
-            conn = Connection(hwcode)
+            conn = get_connection(hwcode)
             conn.kill_monitor()
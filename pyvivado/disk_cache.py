@@ -0,0 +1,195 @@
+'''
+A size-bounded cache of directories on disk that can be shared between
+processes and projects.
+
+Each entry is a directory named by its key.  Entries are built in a
+temporary directory and then renamed into place, so other processes never
+see a partially written entry.  When the cache grows past its budget the
+least recently used entries are deleted.
+
+A process using an entry holds a shared lock on it (see `DiskCache.lock`)
+and entries that are locked are never evicted.  An entry being evicted is
+first renamed out of the way so nobody finds it half deleted.
+'''
+import os
+import uuid
+import logging
+import shutil
+import tempfile
+import time
+
+from pyvivado import locks
+
+logger = logging.getLogger(__name__)
+
+
+def directory_size(directory):
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for fn in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, fn)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+class DiskCache(object):
+
+    # Name of the file in each entry recording the entry's size.
+    SIZE_FN = '.size'
+    # Prefix of the temporary directories in which entries are built.
+    TEMP_PREFIX = '.tmp_'
+    # Prefix of the lock file of each entry.
+    LOCK_PREFIX = '.lock_'
+
+    def __init__(self, directory, max_bytes=None, min_age=600):
+        '''
+        Args:
+            `directory`: The directory in which the entries are stored.
+            `max_bytes`: The disk budget for the cache.  If None the cache
+                is never evicted.
+            `min_age`: Entries used more recently than this many seconds
+                ago are not evicted even if nobody holds a lock on them.
+        '''
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        os.makedirs(self.directory, exist_ok=True)
+
+    def entry_directory(self, key):
+        return os.path.join(self.directory, key)
+
+    def lock_filename(self, key):
+        # The lock file is outside the entry so it stays put when the entry
+        # is renamed.
+        return os.path.join(self.directory, self.LOCK_PREFIX + key)
+
+    def lock(self, key):
+        '''
+        Take a shared lock on an entry, which keeps it from being evicted
+        until the lock is released.  The entry need not exist yet, so the
+        lock can be taken before the entry is looked up or committed.
+
+        Returns the acquired `locks.FileLock`.
+        '''
+        lock = locks.FileLock(self.lock_filename(key), shared=True)
+        lock.acquire()
+        return lock
+
+    def touch(self, key):
+        try:
+            os.utime(self.entry_directory(key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        '''
+        Get the directory of an entry, or None if it is not in the cache.
+        Marks the entry as recently used.
+        '''
+        directory = self.entry_directory(key)
+        if os.path.isdir(directory):
+            self.touch(key)
+        else:
+            directory = None
+        return directory
+
+    def make_temp_directory(self, key):
+        '''
+        Make a directory in which a new entry can be built before it is
+        committed.
+        '''
+        return tempfile.mkdtemp(
+            prefix='{}{}_'.format(self.TEMP_PREFIX, key), dir=self.directory)
+
+    def commit(self, key, temp_directory):
+        '''
+        Move a fully built entry into place.  If another process committed
+        the same entry first, its entry is kept and ours is discarded.
+
+        Returns the directory of the entry.
+        '''
+        with open(os.path.join(temp_directory, self.SIZE_FN), 'w') as f:
+            f.write(str(directory_size(temp_directory)))
+        directory = self.entry_directory(key)
+        try:
+            os.rename(temp_directory, directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+            logger.debug('Cache entry {} was already committed.'.format(key))
+            shutil.rmtree(temp_directory, ignore_errors=True)
+        self.touch(key)
+        self.evict()
+        return directory
+
+    def discard(self, temp_directory):
+        shutil.rmtree(temp_directory, ignore_errors=True)
+
+    def entry_size(self, key):
+        size_fn = os.path.join(self.entry_directory(key), self.SIZE_FN)
+        try:
+            with open(size_fn, 'r') as f:
+                size = int(f.read())
+        except (FileNotFoundError, ValueError):
+            size = directory_size(self.entry_directory(key))
+        return size
+
+    def entries(self):
+        '''
+        Get a list of (last_used, size, key) tuples for the committed
+        entries, least recently used first.
+        '''
+        entries = []
+        for key in os.listdir(self.directory):
+            if key.startswith(self.TEMP_PREFIX) or key.startswith('.'):
+                continue
+            try:
+                last_used = os.stat(self.entry_directory(key)).st_mtime
+            except FileNotFoundError:
+                continue
+            entries.append((last_used, self.entry_size(key), key))
+        entries.sort()
+        return entries
+
+    def remove(self, key):
+        '''
+        Delete an entry unless someone holds a lock on it.  Returns False
+        if the entry is locked.
+        '''
+        lock = locks.FileLock(self.lock_filename(key))
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            doomed = os.path.join(self.directory, '{}evicted_{}_{}'.format(
+                self.TEMP_PREFIX, key, uuid.uuid4().hex))
+            try:
+                os.rename(self.entry_directory(key), doomed)
+            except FileNotFoundError:
+                return True
+        finally:
+            lock.release()
+        shutil.rmtree(doomed, ignore_errors=True)
+        return True
+
+    def evict(self):
+        '''
+        Delete least recently used entries until the cache is within its
+        budget.  Entries that are locked are skipped.
+        '''
+        if self.max_bytes is None:
+            return
+        entries = self.entries()
+        total = sum(size for last_used, size, key in entries)
+        cutoff = time.time() - self.min_age
+        for last_used, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if last_used > cutoff:
+                break
+            if self.remove(key):
+                logger.debug('Evicted cache entry {}.'.format(key))
+                total -= size
+            else:
+                logger.debug('Not evicting cache entry {} which is in use.'.format(key))
@@ -0,0 +1,65 @@
+-- -*- vhdl -*- 
+
+-- Reading and writing of the fixed-width packed data files generated by
+-- `pyvivado.packed_data`.
+-- Each line of a packed file holds one record as a fixed number of hex
+-- digits.  The record is the concatenation of its fields, with the first
+-- field in the most significant bits.
+
+library ieee;
+use ieee.std_logic_1164.all;
+use ieee.std_logic_textio.all;
+
+use std.textio.all;
+
+package pyvivado_packed_io is
+
+  -- Read the next record from a packed file.
+  -- `done` is set to true if there are no more records.
+  procedure read_packed(file f: text;
+                        variable data: out std_logic_vector;
+                        variable done: out boolean);
+
+  -- Write a record to a packed file.
+  procedure write_packed(file f: text;
+                         constant data: in std_logic_vector);
+
+end package;
+
+package body pyvivado_packed_io is
+
+  -- Records are padded to a whole number of hex digits.
+  function padded_width(width: natural) return natural is
+  begin
+    return 4*((width+3)/4);
+  end function;
+
+  procedure read_packed(file f: text;
+                        variable data: out std_logic_vector;
+                        variable done: out boolean) is
+    variable l: line;
+    variable padded: std_logic_vector(padded_width(data'length)-1 downto 0);
+  begin
+    if endfile(f) then
+      done := true;
+    else
+      readline(f, l);
+      hread(l, padded);
+      deallocate(l);
+      data := padded(data'length-1 downto 0);
+      done := false;
+    end if;
+  end procedure;
+
+  procedure write_packed(file f: text;
+                         constant data: in std_logic_vector) is
+    variable l: line;
+    variable padded: std_logic_vector(padded_width(data'length)-1 downto 0);
+  begin
+    padded := (others => '0');
+    padded(data'length-1 downto 0) := data;
+    hwrite(l, padded);
+    writeline(f, l);
+  end procedure;
+
+end package body;
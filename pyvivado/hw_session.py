@@ -0,0 +1,119 @@
+'''
+Long-lived hardware sessions.
+
+Starting Vivado and connecting to the hardware server and an FPGA takes
+longer than most deployments.  A hardware session is a Vivado process
+running `::pyvivado::hw_session` that keeps the connection to one FPGA
+open and serves requests to program and monitor it.  When a monitor
+started by a session is killed the session waits for the next request.
+
+Requests are pushed onto `<hwcode>_session_requests` and the session
+keeps `<hwcode>_session` alive while it is running.
+'''
+import math
+import logging
+
+from pyvivado import redis_utils
+
+logger = logging.getLogger(__name__)
+
+
+def format_list(*items):
+    '''
+    Format items as a TCL list.  Every item is braced so that paths with
+    spaces survive.
+    '''
+    return ' '.join('{{{}}}'.format(item) for item in items)
+
+
+class SessionRequest(object):
+    '''
+    A request made to a session.
+
+    It has the parts of the `Task` interface used to wait for a monitor,
+    so a request that deploys or monitors stands in for the task that
+    would otherwise run the monitor.
+    '''
+
+    def __init__(self, session, sequence_id):
+        self.session = session
+        self.sequence_id = sequence_id
+        self.reply_key = '{}_session_reply_{}'.format(session.hwcode, sequence_id)
+
+    def reply(self):
+        '''
+        The reply to the request or None if it has not finished.
+        '''
+        reply = self.session.r.lindex(self.reply_key, 0)
+        if reply is not None:
+            reply = reply.decode('ascii')
+        return reply
+
+    def is_finished(self):
+        return self.reply() is not None
+
+    def get_errors(self):
+        reply = self.reply()
+        if (reply is not None) and reply.startswith('ERROR'):
+            errors = [reply[len('ERROR '):]]
+        else:
+            errors = []
+        return errors
+
+    def get_messages(self):
+        return [('ERROR', error) for error in self.get_errors()]
+
+    def log_messages(self, messages):
+        for message_type, message in messages:
+            logger.error('Session for {}: {}'.format(self.session.hwcode, message))
+
+    def wait(self, timeout=None):
+        '''
+        Block until the request is finished and raise an exception if it
+        failed.
+        '''
+        if timeout is None:
+            blocking = 0
+        else:
+            blocking = max(1, int(math.ceil(timeout)))
+        popped = self.session.r.brpop(self.reply_key, timeout=blocking)
+        if popped is None:
+            raise TimeoutError('No reply from the session for {}.'.format(
+                self.session.hwcode))
+        reply = popped[1].decode('ascii')
+        if reply.startswith('ERROR'):
+            raise Exception('Session for {} failed: {}'.format(
+                self.session.hwcode, reply))
+
+
+class HardwareSession(object):
+
+    def __init__(self, hwcode, redis_client=None):
+        if redis_client is None:
+            redis_client = redis_utils.get_redis()
+        self.hwcode = hwcode
+        self.r = redis_client
+        self.requests = '{}_session_requests'.format(hwcode)
+        self.sequence = '{}_session_sequence'.format(hwcode)
+        self.alive = '{}_session'.format(hwcode)
+
+    def is_alive(self):
+        return self.r.get(self.alive) is not None
+
+    def request(self, *command):
+        sequence_id = self.r.incr(self.sequence)
+        self.r.lpush(self.requests, '{} {}'.format(
+            sequence_id, format_list(*command)))
+        return SessionRequest(self, sequence_id)
+
+    def program(self, proj_dir, bitstream_hash=''):
+        return self.request('P', proj_dir, bitstream_hash)
+
+    def monitor(self, transport, port=''):
+        return self.request('M', transport, port)
+
+    def deploy(self, proj_dir, bitstream_hash, transport, port=''):
+        return self.request('D', proj_dir, bitstream_hash, transport, port)
+
+    def stop(self):
+        return self.request('Q')
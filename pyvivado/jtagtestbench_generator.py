@@ -2,12 +2,11 @@ import logging
 import os
 import collections
 
-import jinja2
-
 logger = logging.getLogger(__name__)
 
 
 def make_jtagtestbench(top_entity, generics, clk_b=False, use_reset=True):
+    import jinja2
     # Make records for inputs and outputs.
     template_fn = os.path.join(os.path.dirname(__file__), 'templates', 'jtag_testbench.vhd')
     with open(template_fn, 'r') as f:
@@ -0,0 +1,214 @@
+'''
+Leases on FPGAs.
+
+Finding a free FPGA by looking at its heartbeats is not enough to use it:
+two jobs that look within the same heartbeat window both see the FPGA as
+free.  Instead a job takes a lease on the FPGA, which is the
+`<hwcode>_lease` key set with `SET NX PX`.  Only one job can set it and it
+expires unless it is renewed, so the FPGA is freed if the job dies.
+
+Jobs waiting for an FPGA of a board type wait in the `<board>_queue`
+sorted set, ordered by priority then by arrival.  Only the job at the head
+of the queue takes a lease so FPGAs are handed out fairly.  Each waiter
+keeps a `<token>_waiting` key alive while it waits and waiters whose key
+has expired are dropped from the queue.
+'''
+import time
+import uuid
+import logging
+import threading
+
+from pyvivado import config, redis_utils
+
+logger = logging.getLogger(__name__)
+
+# Renew the expiry of a lease only if we still hold it.
+RENEW_SCRIPT = '''
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+else
+    return 0
+end
+'''
+
+# Delete a lease only if we still hold it.
+RELEASE_SCRIPT = '''
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+else
+    return 0
+end
+'''
+
+
+def lease_key(hwcode):
+    return '{}_lease'.format(hwcode)
+
+
+def queue_key(board_type):
+    return '{}_queue'.format(board_type)
+
+
+def waiting_key(token):
+    return '{}_waiting'.format(token)
+
+
+def make_token():
+    return uuid.uuid4().hex
+
+
+class Lease(object):
+    '''
+    A lease on an FPGA.
+    '''
+
+    def __init__(self, hwcode, token=None, ttl=None, redis_client=None):
+        '''
+        Args:
+            `hwcode`: The hardware code of the FPGA.
+            `token`: Identifies the holder of the lease.  Defaults to a
+                random token.
+            `ttl`: Milliseconds until the lease expires unless renewed.
+                Defaults to `config.lease_ttl`.
+            `redis_client`: The redis client to use.
+        '''
+        if token is None:
+            token = make_token()
+        if ttl is None:
+            ttl = config.lease_ttl
+        if redis_client is None:
+            redis_client = redis_utils.get_redis()
+        self.hwcode = hwcode
+        self.key = lease_key(hwcode)
+        self.token = token
+        self.ttl = int(ttl)
+        self.r = redis_client
+        self.stopped = None
+        self.keeper = None
+
+    def acquire(self):
+        '''
+        Take the lease.  Returns False if someone else holds it.
+        '''
+        return bool(self.r.set(self.key, self.token, nx=True, px=self.ttl))
+
+    def renew(self):
+        '''
+        Push back the expiry of the lease.  Returns False if we no longer
+        hold it.
+        '''
+        return bool(self.r.eval(RENEW_SCRIPT, 1, self.key, self.token, self.ttl))
+
+    def keep_alive(self):
+        '''
+        Renew the lease from a background thread until it is released.
+        '''
+        if self.keeper is None:
+            self.stopped = threading.Event()
+            self.keeper = threading.Thread(
+                target=self._keep_alive, args=(self.stopped,), daemon=True)
+            self.keeper.start()
+
+    def _keep_alive(self, stopped):
+        while not stopped.wait(self.ttl / 3000):
+            if not self.renew():
+                logger.warning('Lost the lease on {}.'.format(self.hwcode))
+                break
+
+    def release(self):
+        if self.keeper is not None:
+            self.stopped.set()
+            self.keeper.join()
+            self.keeper = None
+        self.r.eval(RELEASE_SCRIPT, 1, self.key, self.token)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def try_lease(hwcodes, token, ttl=None, redis_client=None, bitstream=None):
+    '''
+    Take a lease on the first free FPGA in `hwcodes`, preferring FPGAs
+    already programmed with the bitstream with hash `bitstream`.
+    Returns the `Lease` or None if none is free.
+    '''
+    statuses = redis_utils.read_status(hwcodes, redis_client=redis_client)
+    if bitstream is not None:
+        hwcodes = sorted(
+            hwcodes, key=lambda hwcode: statuses[hwcode].bitstream != bitstream)
+    for hwcode in hwcodes:
+        if redis_utils.is_free(statuses[hwcode]):
+            lease = Lease(hwcode, token=token, ttl=ttl, redis_client=redis_client)
+            if lease.acquire():
+                return lease
+    return None
+
+
+def queue_head(board_type, redis_client):
+    '''
+    Get the token of the first live waiter for a board type, dropping
+    waiters that have gone away.
+    '''
+    queue = queue_key(board_type)
+    while True:
+        head = redis_client.zrange(queue, 0, 0)
+        if not head:
+            return None
+        token = head[0].decode('ascii')
+        if redis_client.exists(waiting_key(token)):
+            return token
+        logger.debug('Dropping dead waiter {} for {}.'.format(token, board_type))
+        redis_client.zrem(queue, token)
+
+
+def acquire_board(board_type, timeout=None, priority=0, ttl=None,
+                  poll_interval=0.5, redis_client=None, bitstream=None):
+    '''
+    Wait for a free FPGA of a board type and take a lease on it.
+
+    Args:
+        `board_type`: A key of `config.hwcodes`.
+        `timeout`: Seconds to wait before raising a `TimeoutError`.
+            Defaults to waiting forever.
+        `priority`: Waiters with a higher priority get an FPGA first.
+            Waiters with the same priority are served in order of arrival.
+        `ttl`: Milliseconds until the lease expires unless renewed.
+        `poll_interval`: Seconds between checks for a free FPGA.
+        `bitstream`: The hash of a bitstream.  Free FPGAs already
+            programmed with it are preferred.
+    Returns the `Lease`.
+    '''
+    if redis_client is None:
+        redis_client = redis_utils.get_redis()
+    if ttl is None:
+        ttl = config.lease_ttl
+    hwcodes = config.hwcodes[board_type]
+    token = make_token()
+    queue = queue_key(board_type)
+    # Higher priorities sort first and then earlier tickets.
+    ticket = redis_client.incr('{}_ticket'.format(board_type))
+    score = ticket - priority * 2**40
+    # Waiters that have not checked in for a few intervals are dead.
+    waiting_ttl = int(max(5000, 4000 * poll_interval))
+    redis_client.set(waiting_key(token), 1, px=waiting_ttl)
+    redis_client.zadd(queue, {token: score})
+    start = time.time()
+    try:
+        while True:
+            redis_client.set(waiting_key(token), 1, px=waiting_ttl)
+            if queue_head(board_type, redis_client) == token:
+                lease = try_lease(hwcodes, token, ttl=ttl,
+                                  redis_client=redis_client, bitstream=bitstream)
+                if lease is not None:
+                    logger.info('Leased {}.'.format(lease.hwcode))
+                    return lease
+            if (timeout is not None) and (time.time() - start > timeout):
+                raise TimeoutError(
+                    'No free {} hardware after {}s.'.format(board_type, timeout))
+            time.sleep(poll_interval)
+    finally:
+        redis_client.zrem(queue, token)
+        redis_client.delete(waiting_key(token))
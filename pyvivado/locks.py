@@ -0,0 +1,90 @@
+'''
+Cross-process file locks.
+
+Several processes (e.g. pytest-xdist workers) may try to create or use the
+same project at once.  Rather than sleeping and hoping that the files
+they need appear, they take a lock on a file in the project directory.
+
+The locks are `flock` locks, which belong to the open file rather than to
+the process.  They are never passed to child processes: a Vivado process
+that inherited a lock would pass it on to the processes it spawns (e.g.
+`hw_server` or the runs started by `launch_runs`), which can outlive it
+and would hold the lock indefinitely.  Instead the parent holds the lock
+until the child exits (see `release_after`).
+
+On platforms without `fcntl` the locks do nothing.
+'''
+import os
+import logging
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class FileLock(object):
+
+    def __init__(self, fn, shared=False):
+        '''
+        Args:
+            `fn`: The file to lock.  It is created if it does not exist.
+            `shared`: Take a shared rather than an exclusive lock.
+        '''
+        self.fn = fn
+        self.shared = shared
+        self.fd = None
+
+    def acquire(self, blocking=True):
+        '''
+        Take the lock.  Returns False if `blocking` is False and the lock is
+        held by someone else.
+        '''
+        if self.fd is not None:
+            raise Exception('Lock {} is already acquired.'.format(self.fn))
+        fd = os.open(self.fn, os.O_RDWR | os.O_CREAT, 0o666)
+        if fcntl is not None:
+            operation = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+            if not blocking:
+                operation |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(fd, operation)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+        self.fd = fd
+        return True
+
+    def release(self):
+        '''
+        Release the lock.
+        '''
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def release_after(held_locks, wait):
+    '''
+    Release locks from a background thread once `wait()` returns, for
+    example the `wait` method of a spawned process.
+    '''
+    def release():
+        try:
+            wait()
+        finally:
+            for lock in held_locks:
+                lock.release()
+    thread = threading.Thread(target=release, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,103 @@
+'''
+One Vivado process monitoring several FPGAs.
+
+Every monitor is a Vivado process, which takes a lot of memory for what
+is just a bridge between redis and JTAG.  `::pyvivado::monitor_many`
+serves the requests for several FPGAs over one connection to the
+hardware server.  It keeps the requests, replies, heartbeats and kill
+flags of each FPGA separate, so the FPGAs are used and killed with the
+usual redis `connection.Connection`.  Like any other monitor it holds a
+lease on each FPGA (see `leases`), which is released when the FPGA's
+connection is closed.
+
+Only the redis transport is supported.
+'''
+import time
+import logging
+
+from pyvivado import config, connection, leases, redis_utils, vivado_task
+
+logger = logging.getLogger(__name__)
+
+
+def make_command(hwcodes, fake=False):
+    '''
+    The TCL command that monitors the FPGAs with the given hwcodes.
+    '''
+    hwtargets = [config.hwtargets[hwcode][0] for hwcode in hwcodes]
+    jtagfreqs = [int(config.hwtargets[hwcode][1]) for hwcode in hwcodes]
+    def tcl_list(items):
+        return '{' + ' '.join('{{{}}}'.format(item) for item in items) + '}'
+    return '::pyvivado::monitor_many {} {} {} {}'.format(
+        tcl_list(hwcodes), tcl_list(hwtargets), tcl_list(jtagfreqs),
+        1 if fake else 0)
+
+
+def acquire_leases(hwcodes, redis_client=None):
+    '''
+    Take a lease on each of the FPGAs.  If any of them is leased by
+    another job the leases already taken are released and an exception
+    is raised.
+
+    Returns a dictionary mapping the hwcodes to `leases.Lease`s.
+    '''
+    held = {}
+    for hwcode in hwcodes:
+        lease = leases.Lease(hwcode, redis_client=redis_client)
+        if not lease.acquire():
+            for other in held.values():
+                other.release()
+            raise Exception('Hardware {} is leased by another job.'.format(hwcode))
+        held[hwcode] = lease
+    return held
+
+
+def monitor_many(hwcodes, collection, fake=False, poll_interval=0.1,
+                 max_wait=120):
+    '''
+    Start one Vivado process monitoring several FPGAs that are already
+    programmed and wait until it is monitoring all of them.
+
+    The FPGAs are leased first, and the leases are released if the
+    monitor fails to start.
+
+    Args:
+        `hwcodes`: The hardware codes of the FPGAs.
+        `collection`: The `TasksCollection` to run the Vivado task in.
+        `fake`: Don't talk to the FPGAs.
+
+    Returns a (t, conns) tuple where:
+        `t`: is the `Task` wrapping the Vivado process, and
+        `conns`: is a dictionary mapping the hwcodes to `Connection`s.
+            Closing a connection releases the lease on its FPGA.
+    '''
+    held = acquire_leases(hwcodes)
+    for lease in held.values():
+        lease.keep_alive()
+    try:
+        t = vivado_task.VivadoTask.create(
+            collection=collection,
+            command_text=make_command(hwcodes, fake=fake),
+            description='Monitor {}.'.format(' '.join(hwcodes)),
+        )
+        t.run()
+        def all_active():
+            statuses = redis_utils.read_status(hwcodes)
+            return all(redis_utils.is_active(statuses[hwcode].last_A)
+                       for hwcode in hwcodes)
+        n_waits = 0
+        while ((not all_active()) and (n_waits < max_wait / poll_interval)
+               and (not t.is_finished())):
+            n_waits += 1
+            time.sleep(poll_interval)
+        if t.is_finished():
+            t.log_messages(t.get_messages())
+        if not all_active():
+            raise Exception('Failed to monitor {}.'.format(' '.join(hwcodes)))
+    except:
+        for lease in held.values():
+            lease.release()
+        raise
+    conns = dict((hwcode, connection.Connection(hwcode, lease=held[hwcode]))
+                 for hwcode in hwcodes)
+    return t, conns
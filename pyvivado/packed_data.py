@@ -0,0 +1,252 @@
+'''
+Fixed-width packed files for passing stimulus to and responses from
+file-based testbenches.
+
+Each line of a packed file holds one record as a fixed number of hex
+digits.  A record is the concatenation of its fields with the first field
+in the most significant bits.  Because every line has the same length a
+file can be memory-mapped and any record or column extracted without
+parsing the rest of the file.  The VHDL package in `hdl/packed_io.vhd`
+reads and writes the same format.
+
+NumPy is used when it is available, both to write structured arrays and
+to extract columns, but is not required.
+'''
+import os
+import mmap
+import logging
+
+from pyvivado import config
+
+logger = logging.getLogger(__name__)
+
+packed_io_filename = os.path.join(config.hdldir, 'packed_io.vhd')
+
+HEX_DIGITS = b'0123456789abcdef'
+
+
+def get_numpy():
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    return numpy
+
+
+class Layout(object):
+    '''
+    The fields making up the records of a packed file.
+
+    Args:
+        `fields`: A list of (name, width) tuples.  The first field is
+            in the most significant bits.
+    '''
+
+    def __init__(self, fields):
+        self.fields = [(name, int(width)) for name, width in fields]
+        self.width = sum(width for name, width in self.fields)
+        if self.width == 0:
+            raise ValueError('A layout must have a non-zero width.')
+        # The position of the least significant bit of each field.
+        self.offsets = {}
+        offset = self.width
+        for name, width in self.fields:
+            offset -= width
+            self.offsets[name] = offset
+        self.widths = dict(self.fields)
+        self.n_digits = (self.width + 3)//4
+        self.line_length = self.n_digits + 1
+
+    def pack(self, record):
+        '''
+        Convert a record to an integer.  A record is either a dictionary
+        of field values or already an integer.
+        '''
+        if isinstance(record, int):
+            value = record
+        else:
+            value = 0
+            for name, width in self.fields:
+                field = int(record[name])
+                if (field < 0) or (field >> width):
+                    raise ValueError('Value {} does not fit in field {}.'.format(
+                        field, name))
+                value = (value << width) | field
+        if value >> self.width:
+            raise ValueError('Record {} is too wide.'.format(value))
+        return value
+
+    def unpack(self, value):
+        '''
+        Convert an integer to a dictionary of field values.
+        '''
+        record = {}
+        for name, width in self.fields:
+            record[name] = (value >> self.offsets[name]) & ((1 << width) - 1)
+        return record
+
+    def encode(self, value):
+        return '{:0{}x}\n'.format(value, self.n_digits).encode('ascii')
+
+    def decode(self, line, index=None):
+        try:
+            value = int(line[:self.n_digits], 16)
+        except ValueError:
+            raise ValueError('Invalid packed record {!r} on line {}'.format(
+                line, index))
+        return value
+
+
+def write_packed_array(fn, layout, records, numpy):
+    '''
+    Write a NumPy structured array with a vectorized conversion to hex.
+    Each field must be at most 64 bits wide.
+    '''
+    n_records = len(records)
+    digits = numpy.empty((n_records, layout.line_length), dtype=numpy.uint8)
+    digits[:, -1] = ord('\n')
+    lookup = numpy.frombuffer(HEX_DIGITS, dtype=numpy.uint8)
+    columns = dict((name, records[name].astype(numpy.uint64))
+                   for name, width in layout.fields)
+    for digit in range(layout.n_digits):
+        low = 4 * digit
+        nibble = numpy.zeros(n_records, dtype=numpy.uint64)
+        for name, width in layout.fields:
+            offset = layout.offsets[name]
+            if (offset >= low + 4) or (offset + width <= low):
+                continue
+            if offset >= low:
+                part = columns[name] << numpy.uint64(offset - low)
+            else:
+                part = columns[name] >> numpy.uint64(low - offset)
+            nibble |= part & numpy.uint64(0xf)
+        digits[:, layout.n_digits - 1 - digit] = lookup[nibble]
+    digits.tofile(fn)
+
+
+def write_packed(fn, layout, records):
+    '''
+    Write records to a packed file.
+
+    Args:
+        `fn`: The file to write.
+        `layout`: A `Layout` describing the records.
+        `records`: A NumPy structured array with a field for each field of
+            the layout, or any iterable (including a generator) of
+            dictionaries or integers.
+    '''
+    numpy = get_numpy()
+    if (numpy is not None) and isinstance(records, numpy.ndarray) and (
+            records.dtype.names is not None):
+        if max(width for name, width in layout.fields) > 64:
+            records = [dict((name, int(r[name])) for name, w in layout.fields)
+                       for r in records]
+        else:
+            write_packed_array(fn, layout, records, numpy)
+            return
+    with open(fn, 'wb') as f:
+        for record in records:
+            f.write(layout.encode(layout.pack(record)))
+
+
+class PackedData(object):
+    '''
+    A read-only, memory-mapped view of a packed file.
+
+    Records are only parsed when they are accessed.
+    '''
+
+    def __init__(self, fn, layout):
+        self.fn = fn
+        self.layout = layout
+        self.size = os.path.getsize(fn)
+        if self.size % layout.line_length:
+            raise ValueError('Size of {} does not match the layout.'.format(fn))
+        if self.size:
+            with open(fn, 'rb') as f:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.mm = b''
+
+    def close(self):
+        if self.size:
+            self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.size // self.layout.line_length
+
+    def value(self, index):
+        '''
+        Get a record as an integer.
+        '''
+        if index < 0:
+            index += len(self)
+        if not (0 <= index < len(self)):
+            raise IndexError('Record index out of range.')
+        start = index * self.layout.line_length
+        return self.layout.decode(
+            self.mm[start: start + self.layout.n_digits], index)
+
+    def __getitem__(self, index):
+        return self.layout.unpack(self.value(index))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def array(self):
+        '''
+        Get the memory-mapped file as a (records, digits) NumPy array of
+        ASCII codes.
+        '''
+        numpy = get_numpy()
+        if numpy is None:
+            raise ImportError('NumPy is required for PackedData.array')
+        return numpy.memmap(self.fn, dtype=numpy.uint8, mode='r').reshape(
+            len(self), self.layout.line_length)[:, :self.layout.n_digits]
+
+    def column(self, name):
+        '''
+        Get the values of a field for every record.
+
+        Returns a NumPy uint64 array if NumPy is available (the field must
+        then be at most 64 bits wide), otherwise a list.
+        '''
+        width = self.layout.widths[name]
+        offset = self.layout.offsets[name]
+        numpy = get_numpy()
+        if (numpy is None) or (width > 64):
+            return [(self.value(i) >> offset) & ((1 << width) - 1)
+                    for i in range(len(self))]
+        lookup = numpy.full(256, 255, dtype=numpy.uint8)
+        for value, digit in enumerate(HEX_DIGITS):
+            lookup[digit] = value
+            lookup[ord(chr(digit).upper())] = value
+        ascii = self.array()
+        column = numpy.zeros(len(self), dtype=numpy.uint64)
+        first = offset // 4
+        last = (offset + width - 1) // 4
+        for digit in range(first, last + 1):
+            nibble = lookup[ascii[:, self.layout.n_digits - 1 - digit]]
+            if (nibble == 255).any():
+                bad = int(numpy.argmax(nibble == 255))
+                raise ValueError('Invalid packed record on line {}'.format(bad))
+            nibble = nibble.astype(numpy.uint64)
+            low = 4 * digit
+            if low >= offset:
+                column |= nibble << numpy.uint64(low - offset)
+            else:
+                column |= nibble >> numpy.uint64(offset - low)
+        if width < 64:
+            column &= numpy.uint64((1 << width) - 1)
+        return column
+
+
+def read_packed(fn, layout):
+    return PackedData(fn, layout)
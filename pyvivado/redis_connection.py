@@ -1,86 +1,652 @@
 '''
 Communication with Vivado processes monitoring FPGAs over redis.
 Using redis was an awful idea.  It should be done over sockets.
+
+Requests are pushed onto the `<hwcode>_requests` list, which the monitor
+consumes with BRPOP.  Each request is prefixed by a sequence id and a
+deadline, and the monitor pushes the reply onto `<hwcode>_reply_<id>`,
+where we wait for it with BRPOP, so neither side polls.  The monitor
+drops requests whose deadline has passed, since we have stopped waiting
+for them, and replies 'E' to requests it cannot run.
+
+Commands are either text ('C <type> <address> <length> <data>...') or
+binary ('B <type> <address> <length>' followed by a newline and the data
+as packed little-endian 32 bit words).  Binary commands avoid formatting
+and parsing every word and are used by `read_buffer`, `read_array` and
+`write_buffer`.
 '''
 
 import os
+import sys
 import time
-import redis
+import array
 import random
 import math
 import datetime
 import logging
+import threading
+import queue
+import collections
+import concurrent.futures
 from collections import namedtuple
 
 logger = logging.getLogger(__name__)
 
-r = redis.StrictRedis(host='localhost', port=6379, db=0)
-
-from pyvivado import redis_utils
+from pyvivado import config, redis_utils, packed_data
 
 Response = namedtuple('Response', ['length', 'resp', 'data'])
 
+
+def make_command(typ, address, length, data=()):
+    '''
+    Format a command for a monitor.
+
+    `typ` is 'W' (write), 'R' (read), 'WW' (repeated write to one address),
+    'RR' (repeated read from one address) or 'V' (write and read back).
+    '''
+    command = 'C {} {} {}'.format(typ, int(address), int(length))
+    if data:
+        command += ' ' + ' '.join([str(int(d)) for d in data])
+    return command
+
+
+def parse_response(response):
+    '''
+    Parse a 'R <type> <address> <values>...' response from a monitor.
+    The values are hexadecimal.
+    '''
+    split_response = response.split()
+    rsp = Response(
+        length=len(split_response[3:]),
+        data=[int(v, 16) for v in split_response[3:]],
+        resp=0,
+        )
+    return rsp
+
+
+def parse_compound_response(response):
+    '''
+    Parse the response to a compound command ('P', 'M' or 'V').
+
+    Returns a (completed, values) tuple where `completed` is False if the
+    command timed out on the monitor.
+    '''
+    if isinstance(response, bytes):
+        response = response.decode('ascii')
+    split_response = response.split()
+    completed = (split_response[0] == 'R')
+    values = [int(v, 16) for v in split_response[3:]]
+    return completed, values
+
+
+def make_script_command(commands):
+    '''
+    Format a script of commands that the monitor runs in order in a single
+    round trip.
+
+    Args:
+        `commands`: A list of (typ, address, length, data) tuples where
+            `typ` is as in `make_command` and `data` are the values written
+            (empty for reads).
+    '''
+    if not commands:
+        raise ValueError('A script must have at least one command.')
+    parts = []
+    for typ, address, length, data in commands:
+        part = '{} {} {}'.format(typ, int(address), int(length))
+        if data:
+            part += ' ' + ' '.join([str(int(d)) for d in data])
+        parts.append(part)
+    return 'S ' + '|'.join(parts)
+
+
+def parse_script_response(response):
+    '''
+    Parse the 'S <response>|<response>|...' response to a script into a
+    list of `Response`s.
+    '''
+    if isinstance(response, bytes):
+        response = response.decode('ascii')
+    response = response.strip()
+    if not response.startswith('S '):
+        raise ValueError('Not a script response: {!r}'.format(response[:100]))
+    return [parse_response(part) for part in response[2:].split('|')]
+
+
+def to_words(data):
+    '''
+    Get the bytes of a buffer of 32 bit words as packed little-endian words.
+    `data` can be a bytes-like object already in that format, a NumPy array
+    or a sequence of integers.
+    '''
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        words = bytes(data)
+    elif hasattr(data, 'astype'):
+        words = data.astype('<u4', copy=False).tobytes()
+    else:
+        if not isinstance(data, array.array):
+            data = array.array('I', data)
+        if sys.byteorder == 'big':
+            data = array.array(data.typecode, data)
+            data.byteswap()
+        words = data.tobytes()
+    if len(words) % 4 != 0:
+        raise ValueError('Data is not a whole number of 32 bit words.')
+    return words
+
+
+def from_words(words):
+    '''
+    Get packed little-endian 32 bit words as a NumPy uint32 array, or as an
+    `array.array` if NumPy is not available.
+    '''
+    numpy = packed_data.get_numpy()
+    if numpy is not None:
+        values = numpy.frombuffer(words, dtype='<u4')
+    else:
+        values = array.array('I')
+        values.frombytes(words)
+        if sys.byteorder == 'big':
+            values.byteswap()
+    return values
+
+
+def make_binary_command(typ, address, length, words=b''):
+    '''
+    Format a binary command for a monitor.  `words` are the packed
+    little-endian words written by a 'W' or 'WW' command.
+    '''
+    header = 'B {} {} {}\n'.format(typ, int(address), int(length))
+    return header.encode('ascii') + words
+
+
+def parse_binary_response(response):
+    '''
+    Get the packed words from a 'B <type> <address> <length>' response.
+    '''
+    header, newline, words = bytes(response).partition(b'\n')
+    bits = header.split()
+    if (not newline) or (bits[0] != b'B'):
+        raise ValueError('Not a binary response: {!r}'.format(header))
+    length = int(bits[3])
+    if len(words) != 4 * length:
+        raise ValueError('Expected {} words in response but got {} bytes.'.format(
+            length, len(words)))
+    return words
+
+
+class MonitorError(Exception):
+    '''
+    The monitor could not run a command.
+    '''
+
+
+class StreamReadError(Exception):
+    '''
+    A streaming read failed.  `offset` is the number of words that were
+    read into the buffer, from which the read can be resumed.
+    '''
+
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+
 class Connection(object):
 
-    def __init__(self, hwcode):
+    # The longest we block on redis at a time.
+    BLOCK_SECONDS = 1
+
+    def __init__(self, hwcode, redis_client=None, lease=None):
+        '''
+        Args:
+            `hwcode`: The hardware code of the monitored FPGA.
+            `redis_client`: The redis client to use.  Defaults to the
+                shared client from `redis_utils.get_redis`.
+            `lease`: The `leases.Lease` on the FPGA, which is released
+                when the connection is closed.
+        '''
         if hwcode is None:
             raise ValueError('Hardware code is None')
         logger.info('Creating connection with hwcode: {}'.format(hwcode))
-        self.name = '{}_comm'.format(hwcode)
+        self.requests = '{}_requests'.format(hwcode)
+        self.sequence = '{}_sequence'.format(hwcode)
         self.listened = '{}_last_B'.format(hwcode)
         self.kill = '{}_kill'.format(hwcode)
+        self.killed = '{}_killed'.format(hwcode)
         self.hwcode = hwcode
+        if redis_client is None:
+            redis_client = redis_utils.get_redis()
+        self.r = redis_client
+        self.lease = lease
+        # Whether we have marked the FPGA as in use.
+        self.listening = False
+        # Outstanding requests from `submit_command` and the thread that
+        # collects their responses.  Created when first needed.
+        self.lock = threading.Lock()
+        self.pending = None
+        self.collector = None
+        # The thread that keeps `_last_B` alive while we are listening.
+        self.listened_stopped = None
+        self.listened_keeper = None
 
     def is_monitor_alive(self):
-        return redis_utils.hwcode_A_active(self.hwcode)
+        return redis_utils.hwcode_A_active(self.hwcode, redis_client=self.r)
+
+    def request_kill(self):
+        '''
+        Ask the monitor to stop.  The request wakes it up straight away
+        rather than when it next checks the kill flag.
+        '''
+        self.r.lpush(self.requests, '0 0 K')
 
     def kill_monitor(self, time_limit=10):
-        r.set(self.kill, 1)
-        counter = 0
-        while counter < time_limit and self.is_monitor_alive():
-            time.sleep(1)
-            counter += 1
-        if self.is_monitor_alive():
+        '''
+        Stop the monitor and wait for it to acknowledge that it has
+        stopped.
+        '''
+        if not self.is_monitor_alive():
+            return
+        self.r.delete(self.killed)
+        self.r.set(self.kill, 1)
+        self.request_kill()
+        acknowledged = self.r.brpop(
+            self.killed, timeout=max(1, int(math.ceil(time_limit))))
+        if (acknowledged is None) and self.is_monitor_alive():
             raise Exception('Failed to kill monitor.')
-        
-        
-    def wait_for_response(self, timeout=None):
-        waittime = 0.1
-        got_response = False
-        waiting_time = 0
-        while (not got_response) and ((timeout is None) or (waiting_time < timeout)):
-            response = r.get(self.name)
-            if response[0] == ord('R'):
-                got_response=True
-            r.set(self.listened, datetime.datetime.now().strftime('%Y%m%d%H%M%S'))
-            time.sleep(waittime)
-            waiting_time += waittime
-        split_response = response.split()
-        rsp = Response(
-                length=len(split_response[3:]),
-                data=[int(v.decode('ascii'), 16) for v in split_response[3:]],
-                resp=0,
-                )
-        return rsp
 
-    def write(self, address, data, timeout=None):
-        r.set(self.name, 'C W {} {} {}'.format(
-            int(address), len(data), ' '.join([str(int(d)) for d in data])))
-        response = self.wait_for_response(timeout=timeout)
+    def set_listened(self):
+        self.r.set(self.listened, datetime.datetime.now().strftime('%Y%m%d%H%M%S'),
+                   px=config.heartbeat_ttl)
+
+    def mark_listened(self):
+        '''
+        Let the monitor and other processes know that this FPGA is in use.
+        The mark expires unless it is renewed, so it is renewed from a
+        background thread until the connection is closed.  Even a
+        long-running command therefore never lets it expire.
+        '''
+        if not self.listening:
+            self.set_listened()
+            self.listening = True
+        if self.listened_keeper is None:
+            self.listened_stopped = threading.Event()
+            self.listened_keeper = threading.Thread(
+                target=self._keep_listened, args=(self.listened_stopped,),
+                daemon=True)
+            self.listened_keeper.start()
+
+    def _keep_listened(self, stopped):
+        while not stopped.wait(config.heartbeat_ttl / 3000):
+            self.set_listened()
+
+    def stop_listening(self):
+        '''
+        Stop renewing `_last_B` and mark the FPGA as no longer in use.
+        '''
+        if self.listened_keeper is not None:
+            self.listened_stopped.set()
+            self.listened_keeper.join()
+            self.listened_keeper = None
+        if self.listening:
+            self.r.delete(self.listened)
+            self.listening = False
+
+    def reply_key(self, sequence_id):
+        return '{}_reply_{}'.format(self.hwcode, sequence_id)
+
+    def wait_for_reply(self, sequence_id, timeout=None):
+        '''
+        Block until the monitor pushes the reply to a request and return it.
+
+        Raises a `TimeoutError` if there is no reply within `timeout`
+        seconds.
+        '''
+        reply_key = self.reply_key(sequence_id)
+        start = time.time()
+        self.mark_listened()
+        while True:
+            if timeout is None:
+                wait = self.BLOCK_SECONDS
+            else:
+                remaining = timeout - (time.time() - start)
+                if remaining <= 0:
+                    raise TimeoutError(
+                        'No reply from monitor for {} to request {}.'.format(
+                            self.hwcode, sequence_id))
+                wait = max(1, min(self.BLOCK_SECONDS, int(math.ceil(remaining))))
+            popped = self.r.brpop(reply_key, timeout=wait)
+            if popped is None:
+                continue
+            reply_id, space, response = popped[1].partition(b' ')
+            if int(reply_id) == sequence_id:
+                break
+            logger.warning('Ignoring stale reply {} from monitor for {}.'.format(
+                int(reply_id), self.hwcode))
         return response
 
-    def write_repeat(self, address, data, timeout=None):
-        r.set(self.name, 'C WW {} {} {}'.format(
-            int(address), len(data), ' '.join([str(int(d)) for d in data])))
-        response = self.wait_for_response(timeout=timeout)
+    def wait_for_response(self, sequence_id, timeout=None,
+                          parser=parse_response):
+        response = self.wait_for_reply(sequence_id, timeout=timeout)
+        if response.rstrip() == b'E':
+            raise MonitorError('Monitor for {} could not run request {}.'.format(
+                self.hwcode, sequence_id))
+        return parser(response)
+
+    def push_request(self, command, timeout=None):
+        '''
+        Send a request to the monitor.
+
+        Each request gets a new sequence id from the monitor's counter.  The
+        monitor pushes the reply, prefixed by the same id, to a reply list
+        for that id.  If `timeout` is given the monitor drops the request
+        if it has not started it within `timeout` seconds.
+
+        Returns the sequence id.
+        '''
+        if isinstance(command, str):
+            command = command.encode('ascii')
+        if timeout is None:
+            deadline = 0
+        else:
+            deadline = int((time.time() + timeout) * 1000)
+        sequence_id = self.r.incr(self.sequence)
+        self.r.lpush(self.requests, '{} {} '.format(
+            sequence_id, deadline).encode('ascii') + command)
+        return sequence_id
+
+    def send_command(self, command, timeout=None, parser=parse_response):
+        '''
+        Send a command (see `make_command` and `make_binary_command`) to
+        the monitor and wait for the response.  The response is parsed
+        with `parser`.
+        '''
+        sequence_id = self.push_request(command, timeout=timeout)
+        response = self.wait_for_response(
+            sequence_id, timeout=timeout, parser=parser)
         return response
 
+    def submit_command(self, command, timeout=None, parser=parse_response):
+        '''
+        Send a command to the monitor without waiting for the response.
+        The monitor queues the commands so many can be outstanding.
+
+        Returns a `concurrent.futures.Future` of the response parsed with
+        `parser`.  If there is no response within `timeout` seconds of the
+        previous outstanding command completing, the future raises a
+        `TimeoutError`.  The request itself has no deadline since it may
+        wait behind the outstanding ones.
+        '''
+        future = concurrent.futures.Future()
+        with self.lock:
+            if self.collector is None:
+                self.pending = queue.Queue()
+                self.collector = threading.Thread(
+                    target=self.collect_responses, daemon=True)
+                self.collector.start()
+            sequence_id = self.push_request(command)
+            self.pending.put((sequence_id, future, timeout, parser))
+        return future
+
+    def collect_responses(self):
+        '''
+        Wait for the responses to submitted commands in the order they were
+        submitted.  Runs in a background thread until `close` is called.
+        '''
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            sequence_id, future, timeout, parser = item
+            try:
+                response = self.wait_for_response(
+                    sequence_id, timeout=timeout, parser=parser)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(response)
+
+    def stop_collecting(self):
+        '''
+        Wait for all submitted commands to complete and stop collecting
+        responses.
+        '''
+        with self.lock:
+            collector = self.collector
+            if collector is not None:
+                self.pending.put(None)
+                self.collector = None
+        if collector is not None:
+            collector.join()
+
+    def close(self):
+        '''
+        Wait for all submitted commands to complete and stop collecting
+        responses.  Marks the FPGA as no longer in use and releases the
+        lease on it if we hold one.
+        '''
+        self.stop_collecting()
+        self.stop_listening()
+        if self.lease is not None:
+            self.lease.release()
+            self.lease = None
+
+    def write(self, address, data, timeout=None):
+        return self.send_command(
+            make_command('W', address, len(data), data), timeout=timeout)
+
+    def write_repeat(self, address, data, timeout=None):
+        return self.send_command(
+            make_command('WW', address, len(data), data), timeout=timeout)
+
     def read(self, address, length, timeout=None):
-        r.set(self.name, 'C R {} {}'.format(int(address), int(length)))
-        response = self.wait_for_response(timeout=timeout)
-        return response
+        return self.send_command(
+            make_command('R', address, length), timeout=timeout)
 
     def read_repeat(self, address, length, timeout=None):
-        r.set(self.name, 'C RR {} {}'.format(int(address), int(length)))
-        response = self.wait_for_response(timeout=timeout)
-        return response
+        return self.send_command(
+            make_command('RR', address, length), timeout=timeout)
+
+    def submit_write(self, address, data, timeout=None):
+        return self.submit_command(
+            make_command('W', address, len(data), data), timeout=timeout)
+
+    def submit_write_repeat(self, address, data, timeout=None):
+        return self.submit_command(
+            make_command('WW', address, len(data), data), timeout=timeout)
+
+    def submit_read(self, address, length, timeout=None):
+        return self.submit_command(
+            make_command('R', address, length), timeout=timeout)
+
+    def submit_read_repeat(self, address, length, timeout=None):
+        return self.submit_command(
+            make_command('RR', address, length), timeout=timeout)
+
+    def poll(self, address, mask, expected, poll_timeout=1, timeout=None):
+        '''
+        Have the monitor read an address until
+        (value & mask) == expected.  This happens entirely in the monitor
+        so it reacts as fast as the JTAG connection allows.
+
+        Args:
+            `poll_timeout`: Seconds the monitor keeps polling for.
+            `timeout`: Seconds to wait for the response.
+
+        Returns the last value read.  Raises a `TimeoutError` if the
+        monitor gave up polling.
+        '''
+        command = 'C P {} {} {} {}'.format(
+            int(address), int(mask), int(expected), int(poll_timeout * 1000))
+        completed, values = self.send_command(
+            command, timeout=timeout, parser=parse_compound_response)
+        if not completed:
+            raise TimeoutError(
+                'Polling address {} timed out.  Last value was {}.'.format(
+                    address, values[0]))
+        return values[0]
+
+    def read_modify_write(self, address, mask, value, timeout=None):
+        '''
+        Have the monitor replace the bits of a word selected by `mask` with
+        those of `value`.
+
+        Returns a (old_value, new_value) tuple.
+        '''
+        command = 'C M {} {} {}'.format(int(address), int(mask), int(value))
+        completed, values = self.send_command(
+            command, timeout=timeout, parser=parse_compound_response)
+        return values[0], values[1]
+
+    def write_and_read_back(self, address, data, timeout=None):
+        '''
+        Write words to consecutive addresses and read them back in a
+        single command.  Returns the `Response` of the reads.
+        '''
+        command = make_command('V', address, len(data), data)
+        return self.send_command(command, timeout=timeout)
+
+    def run_script(self, commands, timeout=None):
+        '''
+        Run a list of commands (see `make_script_command`) in a single round
+        trip.  Returns a list of `Response`s.
+        '''
+        return self.send_command(
+            make_script_command(commands), timeout=timeout,
+            parser=parse_script_response)
+
+    def submit_script(self, commands, timeout=None):
+        return self.submit_command(
+            make_script_command(commands), timeout=timeout,
+            parser=parse_script_response)
+
+    def submit_read_buffer(self, address, length, repeat=False, timeout=None):
+        typ = 'RR' if repeat else 'R'
+        return self.submit_command(
+            make_binary_command(typ, address, length), timeout=timeout,
+            parser=parse_binary_response)
+
+    def submit_write_buffer(self, address, data, repeat=False, timeout=None):
+        typ = 'WW' if repeat else 'W'
+        words = to_words(data)
+        return self.submit_command(
+            make_binary_command(typ, address, len(words)//4, words),
+            timeout=timeout, parser=parse_binary_response)
+
+    def read_buffer(self, address, length, repeat=False, timeout=None):
+        '''
+        Read `length` words and return them as packed little-endian 32 bit
+        words.  If `repeat` all the words are read from `address`.
+        '''
+        typ = 'RR' if repeat else 'R'
+        return self.send_command(
+            make_binary_command(typ, address, length), timeout=timeout,
+            parser=parse_binary_response)
+
+    def read_array(self, address, length, repeat=False, timeout=None):
+        '''
+        Read `length` words into a NumPy uint32 array (or an `array.array`
+        if NumPy is not available).
+        '''
+        return from_words(self.read_buffer(
+            address, length, repeat=repeat, timeout=timeout))
+
+    def write_buffer(self, address, data, repeat=False, timeout=None):
+        '''
+        Write a buffer of 32 bit words (see `to_words`) without converting
+        each word to text.  If `repeat` all the words are written to
+        `address`.
+
+        Returns the words reported by the monitor.
+        '''
+        typ = 'WW' if repeat else 'W'
+        words = to_words(data)
+        return self.send_command(
+            make_binary_command(typ, address, len(words)//4, words),
+            timeout=timeout, parser=parse_binary_response)
+
+    def iter_read_into(self, address, buffer, length=None, offset=0,
+                       chunk_length=4096, window=2, repeat=False, retries=2,
+                       timeout=None):
+        '''
+        Read words into a preallocated buffer in chunks, yielding the number
+        of words read so far after each chunk.
+
+        Each chunk is a separate binary command so the monitor never holds
+        more than one chunk.  Up to `window` chunks are outstanding at once.
+        A failed chunk is retried from the first unread word up to
+        `retries` times.
+
+        Args:
+            `address`: The address of the first word of the region.
+            `buffer`: A writable buffer such as a `bytearray` or a NumPy
+                uint32 array.  It is filled with little-endian 32 bit words.
+            `length`: The number of words to read.  Defaults to the size of
+                the buffer.
+            `offset`: The first word to read.  Pass the `offset` of a
+                `StreamReadError` to resume an interrupted read.
+            `chunk_length`: The number of words in each command.
+            `window`: The number of commands outstanding at once.
+            `repeat`: Read every word from `address`.
+
+        Raises a `StreamReadError` if a chunk still fails after `retries`
+        retries.
+        '''
+        view = memoryview(buffer).cast('B')
+        if length is None:
+            length = len(view) // 4
+        if 4 * length > len(view):
+            raise ValueError('Buffer holds {} words but {} were requested.'.format(
+                len(view) // 4, length))
+        pending = collections.deque()
+        next_offset = offset
+        done = offset
+        failures = 0
+        while done < length:
+            try:
+                while (next_offset < length) and (len(pending) < window):
+                    n_words = min(chunk_length, length - next_offset)
+                    chunk_address = address if repeat else address + next_offset
+                    future = self.submit_read_buffer(
+                        chunk_address, n_words, repeat=repeat, timeout=timeout)
+                    pending.append((next_offset, n_words, future))
+                    next_offset += n_words
+                chunk_offset, n_words, future = pending.popleft()
+                words = future.result()
+            except Exception as e:
+                for chunk_offset, n_words, future in pending:
+                    future.cancel()
+                pending.clear()
+                next_offset = done
+                failures += 1
+                if failures > retries:
+                    raise StreamReadError(
+                        'Streaming read from {} failed at word {}.'.format(
+                            self.hwcode, done), offset=done) from e
+                logger.warning('Retrying streaming read at word {}: {}'.format(
+                    done, e))
+                continue
+            view[4*chunk_offset: 4*(chunk_offset+n_words)] = words
+            done = chunk_offset + n_words
+            failures = 0
+            yield done
+
+    def read_into(self, address, buffer, length=None, offset=0, progress=None,
+                  **kwargs):
+        '''
+        Read words into a preallocated buffer (see `iter_read_into`).
+        `progress` is called with (words_read, length) after each chunk.
+
+        Returns the number of words read.
+        '''
+        view = memoryview(buffer).cast('B')
+        if length is None:
+            length = len(view) // 4
+        done = offset
+        for done in self.iter_read_into(
+                address, buffer, length=length, offset=offset, **kwargs):
+            if progress is not None:
+                progress(done, length)
+        return done
@@ -3,105 +3,197 @@ Communication with Vivado processes monitoring FPGAs over redis.
 Using redis was an awful idea.  It should be done over sockets.
 '''
 
-import redis
+import time
 import datetime
+import functools
 import logging
+from collections import namedtuple
 
 from pyvivado import config
 
 logger = logging.getLogger(__name__)
 
-r = redis.StrictRedis(host='localhost', port=6379, db=0)
+# The redis client is created when it is first used so that importing
+# this module does not need redis.  All connections share its pool.
+_redis = None
 
 
-def get_hardware_usage():
+def get_redis():
+    global _redis
+    if _redis is None:
+        import redis
+        pool = redis.ConnectionPool(
+            host=config.redis_host, port=config.redis_port, db=config.redis_db)
+        _redis = redis.StrictRedis(connection_pool=pool)
+    return _redis
+
+
+def set_redis(redis_client):
+    '''
+    Replace the shared redis client (e.g. with a fake one for testing).
+    '''
+    global _redis, _snapshot
+    _redis = redis_client
+    _snapshot = None
+
+
+# The state of a board as recorded in redis.
+# `leased` is whether a job holds a lease on it (see `leases`) and
+# `bitstream` is the hash of the bitstream it was last programmed with.
+HardwareStatus = namedtuple(
+    'HardwareStatus', ['projdir', 'last_A', 'last_B', 'leased', 'bitstream'])
+
+STATUS_SUFFIXES = ('_projdir', '_last_A', '_last_B', '_lease', '_bitstream')
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_timestamp(timestamp):
+    return datetime.datetime.strptime(timestamp.decode('ascii'), '%Y%m%d%H%M%S')
+
+
+def all_hwcodes():
+    return [hwcode for board_type in config.hwcodes
+            for hwcode in config.hwcodes[board_type]]
+
+
+def read_status(hwcodes, redis_client=None):
+    '''
+    Read the status of several boards with a single MGET.
+    Returns a dictionary mapping hwcodes to `HardwareStatus`s.
+    '''
+    if redis_client is None:
+        redis_client = get_redis()
+    keys = [hwcode + suffix for hwcode in hwcodes for suffix in STATUS_SUFFIXES]
+    if keys:
+        values = redis_client.mget(keys)
+    else:
+        values = []
+    statuses = {}
+    n = len(STATUS_SUFFIXES)
+    for index, hwcode in enumerate(hwcodes):
+        projdir, last_A, last_B, lease, bitstream = values[n*index: n*(index+1)]
+        statuses[hwcode] = HardwareStatus(
+            projdir=projdir.decode('ascii') if projdir else None,
+            last_A=parse_timestamp(last_A) if last_A else None,
+            last_B=parse_timestamp(last_B) if last_B else None,
+            leased=lease is not None,
+            bitstream=bitstream.decode('ascii') if bitstream else None,
+        )
+    return statuses
+
+
+# A (time, statuses) tuple of the last status read for the whole farm.
+_snapshot = None
+
+
+def get_status(max_age=None):
+    '''
+    Get the status of every board in `config.hwcodes`.
+
+    The status is read in one round trip and kept for `max_age` seconds
+    (defaults to `config.redis_status_ttl`) so that dashboards polling
+    the farm do not each hit redis.  Pass `max_age=0` to get a fresh
+    status.
+    '''
+    global _snapshot
+    if max_age is None:
+        max_age = config.redis_status_ttl
+    now = time.time()
+    if (_snapshot is None) or (now - _snapshot[0] > max_age) or (max_age <= 0):
+        _snapshot = (now, read_status(all_hwcodes()))
+    return _snapshot[1]
+
+
+def hwcode_status(hwcode, redis_client=None):
+    return read_status([hwcode], redis_client=redis_client)[hwcode]
+
+
+def get_hardware_usage(max_age=None):
     usage = {}
-    for board_type in config.hwcodes:
-        for hwcode in config.hwcodes[board_type]:
-            projdir = hwcode_projdir(hwcode)
-            activeA = hwcode_A_active(hwcode)
-            activeB = hwcode_B_active(hwcode)
-            usage[hwcode] = {
-                'projdir': projdir,
-                'active': activeA and activeB,
-                'monitored': activeA,
-            }
+    for hwcode, status in get_status(max_age=max_age).items():
+        activeA = is_active(status.last_A)
+        activeB = is_active(status.last_B)
+        usage[hwcode] = {
+            'projdir': status.projdir,
+            'active': activeA and activeB,
+            'monitored': activeA,
+            'leased': status.leased,
+            'bitstream': status.bitstream,
+        }
     return usage
 
-def summary():
-    for board_type in config.hwcodes:
-        for hwcode in config.hwcodes[board_type]:
-            projdir = hwcode_projdir(hwcode)
-            last_A = hwcode_last_A(hwcode)
-            last_B = hwcode_last_B(hwcode)
-            print('{} {} {} {}'.format(hwcode, last_A, last_B, projdir))
+def summary(max_age=None):
+    for hwcode, status in get_status(max_age=max_age).items():
+        print('{} {} {} {} {}'.format(
+            hwcode, status.last_A, status.last_B, status.projdir,
+            'leased' if status.leased else ''))
 
 def hwcode_projdir(hwcode):
-    projdir = r.get('{}_projdir'.format(hwcode))
-    if projdir:
-        projdir = projdir.decode('ascii')
-    return projdir
+    return hwcode_status(hwcode).projdir
+
+def set_hwcode_projdir(hwcode, projdir):
+    '''
+    Record that an FPGA is running a project.
+    '''
+    get_redis().set('{}_projdir'.format(hwcode), projdir)
 
 def hwcode_last_A(hwcode):
-    last_A = r.get('{}_last_A'.format(hwcode))
-    if last_A:
-        last_A = last_A.decode('ascii')
-        as_time = datetime.datetime.strptime(last_A, '%Y%m%d%H%M%S')
-    else:
-        as_time = None
-    return as_time
+    return hwcode_status(hwcode).last_A
 
 def hwcode_last_B(hwcode):
-    last_B = r.get('{}_last_B'.format(hwcode))
-    if last_B:
-        last_B = last_B.decode('ascii')
-        as_time = datetime.datetime.strptime(last_B, '%Y%m%d%H%M%S')
-    else:
-        as_time = None
-    return as_time
+    return hwcode_status(hwcode).last_B
 
+# The heartbeat keys expire (after `config.heartbeat_ttl` for python and
+# `::pyvivado::heartbeat_ttl` for monitors) so a heartbeat that is present
+# is alive.  The cutoff only guards against keys written without an
+# expiry.
 cutoff_time = datetime.timedelta(seconds=10)
 
-def hwcode_A_active(hwcode):
-    last_A = hwcode_last_A(hwcode)
-    if last_A:
-        difference = datetime.datetime.now() - last_A
+def is_active(last):
+    if last:
+        difference = datetime.datetime.now() - last
         active = (difference < cutoff_time)
     else:
         active = False
     return active
 
-def hwcode_B_active(hwcode):
-    last_B = hwcode_last_B(hwcode)
-    if last_B:
-        difference = datetime.datetime.now() - last_B
-        active = (difference < cutoff_time)
-    else:
-        active = False
-    return active
+def hwcode_A_active(hwcode, redis_client=None):
+    return is_active(hwcode_status(hwcode, redis_client=redis_client).last_A)
+
+def hwcode_B_active(hwcode, redis_client=None):
+    return is_active(hwcode_status(hwcode, redis_client=redis_client).last_B)
+
+def is_free(status):
+    '''
+    Whether nothing is monitoring, using or leasing an FPGA.
+    '''
+    return ((not status.leased) and (not is_active(status.last_A)) and
+            (not is_active(status.last_B)))
 
-def get_free_hwcode(board_type):
+def get_free_hwcode(board_type, redis_client=None):
+    '''
+    Find an FPGA that looks free.  Use `leases.acquire_board` to reserve
+    one.
+    '''
     free = None
+    statuses = read_status(config.hwcodes[board_type], redis_client=redis_client)
     for hwcode in config.hwcodes[board_type]:
-        if (not hwcode_A_active(hwcode)) and (not hwcode_B_active(hwcode)):
+        if is_free(statuses[hwcode]):
             free = hwcode
     return free
 
 def get_unmonitored_projdir_hwcode(projdir):
     projdir_hwcode = None
-    for board_type in config.hwcodes:
-        for hwcode in config.hwcodes[board_type]:
-            if hwcode_projdir(hwcode) == projdir:
-                if (not hwcode_A_active(hwcode)):
-                    projdir_hwcode = hwcode
-    return projdir_hwcode    
+    for hwcode, status in get_status(max_age=0).items():
+        if status.projdir == projdir:
+            if (not is_active(status.last_A)):
+                projdir_hwcode = hwcode
+    return projdir_hwcode
 
 def get_projdir_hwcode(projdir):
     projdir_hwcode = None
-    for board_type in config.hwcodes:
-        for hwcode in config.hwcodes[board_type]:
-            if hwcode_projdir(hwcode) == projdir:
-                if hwcode_A_active(hwcode) and (not hwcode_B_active(hwcode)):
-                    projdir_hwcode = hwcode
+    for hwcode, status in get_status(max_age=0).items():
+        if status.projdir == projdir:
+            if is_active(status.last_A) and (not is_active(status.last_B)):
+                projdir_hwcode = hwcode
     return projdir_hwcode
-
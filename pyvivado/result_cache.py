@@ -0,0 +1,75 @@
+'''
+Memoization of simulation results.
+
+A simulation of the same design with the same input data always produces
+the same output, so the output can be stored on disk and reused.  Results
+are keyed by the project hash, the simulation type, the runtime and a hash
+of the input data.
+'''
+import os
+import json
+import pickle
+import hashlib
+import logging
+
+from pyvivado import config, disk_cache
+
+logger = logging.getLogger(__name__)
+
+
+def data_hash(data):
+    '''
+    Hash a list of input dictionaries without building one large string.
+    '''
+    h = hashlib.sha1()
+    for d in data:
+        h.update(json.dumps(d, sort_keys=True, default=str).encode('ascii'))
+        h.update(b'\n')
+    return h.hexdigest()
+
+
+class ResultCache(disk_cache.DiskCache):
+    '''
+    A `DiskCache` of simulation outputs.
+
+    Entries are written to a temporary directory and renamed into place so
+    any number of test processes can share a cache.
+    '''
+
+    OUTPUT_FN = 'output.pickle'
+
+    def __init__(self, directory=None, max_bytes=None, min_age=60):
+        if directory is None:
+            directory = config.result_cache_directory
+        if max_bytes is None:
+            max_bytes = config.result_cache_max_bytes
+        super().__init__(directory, max_bytes=max_bytes, min_age=min_age)
+
+    @staticmethod
+    def make_key(project_hash, sim_type, runtime, data):
+        h = hashlib.sha1()
+        h.update(project_hash)
+        h.update('{} {}'.format(sim_type, runtime).encode('ascii'))
+        h.update(data_hash(data).encode('ascii'))
+        return h.hexdigest()
+
+    def get_output(self, key):
+        '''
+        Get the stored output data or None if there is none.
+        '''
+        directory = self.get(key)
+        output_data = None
+        if directory is not None:
+            try:
+                with open(os.path.join(directory, self.OUTPUT_FN), 'rb') as f:
+                    output_data = pickle.load(f)
+            except FileNotFoundError:
+                # Evicted by another process.
+                output_data = None
+        return output_data
+
+    def put_output(self, key, output_data):
+        temp_directory = self.make_temp_directory(key)
+        with open(os.path.join(temp_directory, self.OUTPUT_FN), 'wb') as f:
+            pickle.dump(output_data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.commit(key, temp_directory)
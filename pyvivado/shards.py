@@ -0,0 +1,93 @@
+'''
+Splitting a list of tests into shards that can be simulated in parallel.
+'''
+import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def partition(weights, n_shards):
+    '''
+    Split items into `n_shards` groups with roughly equal total weight.
+
+    Items are assigned heaviest first to the currently lightest shard.
+    Within a shard the items keep their original order.  Empty shards are
+    dropped.
+
+    Args:
+        `weights`: A list of the weight of each item.
+        `n_shards`: The maximum number of shards.
+
+    Returns a list of lists of item indices.
+    '''
+    if n_shards < 1:
+        raise ValueError('Number of shards must be at least 1.')
+    shards = [[] for i in range(n_shards)]
+    totals = [0] * n_shards
+    order = sorted(range(len(weights)), key=lambda i: weights[i],
+                   reverse=True)
+    for index in order:
+        lightest = totals.index(min(totals))
+        shards[lightest].append(index)
+        totals[lightest] += weights[index]
+    return [sorted(shard) for shard in shards if shard]
+
+
+def get_test_key(test, index):
+    '''
+    The name under which a test's runtime is recorded.  Tests without a
+    `name` are identified by their class and their index in the list of
+    tests so that unnamed tests of the same class do not collide.
+    '''
+    name = getattr(test, 'name', None)
+    if name is None:
+        name = '{}_{}'.format(type(test).__name__, index)
+    return name
+
+
+class RuntimeHistory(object):
+    '''
+    Records how long tests took to simulate so that later regressions can
+    balance their shards by runtime rather than by input length.
+    '''
+
+    def __init__(self, fn):
+        self.fn = fn
+        if os.path.exists(fn):
+            with open(fn, 'r') as f:
+                self.runtimes = json.load(f)
+        else:
+            self.runtimes = {}
+
+    def get(self, key, default=None):
+        return self.runtimes.get(key, default)
+
+    def update(self, key, runtime):
+        self.runtimes[key] = runtime
+
+    def write(self):
+        temp_fn = '{}.{}'.format(self.fn, os.getpid())
+        with open(temp_fn, 'w') as f:
+            json.dump(self.runtimes, f, sort_keys=True, indent=2)
+        os.replace(temp_fn, self.fn)
+
+    def weights(self, tests, input_lengths):
+        '''
+        Estimate the cost of each test.  Tests with a recorded runtime use
+        it.  Others are estimated from their input length and the average
+        runtime per input line of the recorded tests.
+        '''
+        keys = [get_test_key(test, index) for index, test in enumerate(tests)]
+        known = [(self.runtimes[key], length)
+                 for key, length in zip(keys, input_lengths)
+                 if key in self.runtimes]
+        known_lines = sum(length for runtime, length in known)
+        if known_lines:
+            per_line = sum(runtime for runtime, length in known)/known_lines
+        else:
+            per_line = 1
+        weights = [self.runtimes.get(key, length * per_line)
+                   for key, length in zip(keys, input_lengths)]
+        return weights
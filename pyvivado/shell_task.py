@@ -49,15 +49,13 @@ class ShellTask(task.Task):
         '''
         Spawn the process.
         '''
-        cwd = os.getcwd()
-        os.chdir(self.directory)
-        stdout_fn = 'stdout.txt'
-        stderr_fn = 'stderr.txt'
+        stdout_fn = os.path.join(self.directory, 'stdout.txt')
+        stderr_fn = os.path.join(self.directory, 'stderr.txt')
+        command_fn = os.path.join(self.directory, 'command.sh')
         with warnings.catch_warnings():
             warnings.simplefilter('ignore')
             if os.name == 'nt':
                 raise ValueError('Shell Tasks not implemented for Windows')
             else:
                 self.launch_unix_subprocess(
-                    ['bash', './command.sh'], stdout_fn=stdout_fn, stderr_fn=stderr_fn)
-        os.chdir(cwd)
+                    ['bash', command_fn], stdout_fn=stdout_fn, stderr_fn=stderr_fn)
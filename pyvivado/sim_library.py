@@ -0,0 +1,108 @@
+'''
+Precompiled simulation libraries for IP.
+
+Every simset that uses IP normally compiles the IP's simulation models
+into its own directory.  Instead the models are compiled once into a
+library directory that is shared between simulations and projects.  The
+directory contains an `xsim.ini` file mapping library names to compiled
+libraries which is passed to the simulator with `--initfile`.  The paths
+in it are relative to the directory because the directory is built under
+a temporary name and renamed when it is committed to the cache.
+
+Libraries depend on the Vivado version and on the configuration of the
+IP, so they are stored in a `disk_cache.DiskCache` keyed by both.
+'''
+import os
+import hashlib
+import logging
+import subprocess
+
+from pyvivado import config, disk_cache
+
+logger = logging.getLogger(__name__)
+
+INI_FN = 'xsim.ini'
+
+# Vivado versions by executable.  Getting the version means running a
+# process so we only do it once.
+_vivado_versions = {}
+
+
+def parse_version(output):
+    '''
+    Get the version from the output of `xelab --version`.
+    '''
+    for line in output.splitlines():
+        line = line.strip()
+        if line:
+            return line
+    raise ValueError('Could not find a version in {!r}.'.format(output))
+
+
+def get_vivado_version(executable=None):
+    if executable is None:
+        executable = config.xelab
+    if executable not in _vivado_versions:
+        output = subprocess.check_output(
+            [executable, '--version'], universal_newlines=True)
+        _vivado_versions[executable] = parse_version(output)
+    return _vivado_versions[executable]
+
+
+def get_library_key(vivado_version, ip_keys):
+    '''
+    A key identifying a library compiled by a Vivado version for a set of
+    IP (identified by `vivado_project.get_ip_key`).  The order of the
+    IP does not matter.
+    '''
+    h = hashlib.sha1(vivado_version.encode('ascii'))
+    for ip_key in sorted(set(ip_keys)):
+        h.update(ip_key.encode('ascii'))
+    return h.hexdigest()
+
+
+def read_ini(directory):
+    '''
+    Read the `xsim.ini` file of a library directory.
+
+    Returns a dictionary mapping library names to absolute paths.
+    '''
+    libraries = {}
+    with open(os.path.join(directory, INI_FN), 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('--'):
+                name, path = line.split('=', 1)
+                libraries[name.strip()] = os.path.join(directory, path.strip())
+    return libraries
+
+
+class SimLibraryCache(disk_cache.DiskCache):
+    '''
+    A `DiskCache` of compiled simulation libraries.
+    '''
+
+    def __init__(self, directory=None, max_bytes=None, min_age=600):
+        if directory is None:
+            directory = config.sim_library_directory
+        if max_bytes is None:
+            max_bytes = config.sim_library_max_bytes
+        super().__init__(directory, max_bytes=max_bytes, min_age=min_age)
+
+    def get_library(self, key):
+        '''
+        Get the directory of a compiled library or None if it is not in
+        the cache or any of the libraries in its `xsim.ini` are missing.
+        '''
+        directory = self.get(key)
+        if (directory is not None) and (
+                not os.path.exists(os.path.join(directory, INI_FN))):
+            directory = None
+        if directory is not None:
+            missing = [path for path in read_ini(directory).values()
+                       if not os.path.isdir(path)]
+            if missing:
+                logger.warning('Simulation library {} is missing {}.'.format(
+                    key, ', '.join(missing)))
+                directory = None
+        return directory
@@ -0,0 +1,148 @@
+'''
+Communication with Vivado processes monitoring FPGAs over TCP sockets.
+
+The monitor runs a Tcl `socket -server` on the port given for its hwcode
+in `config.monitor_ports`.  Commands and responses are the same as in
+`redis_connection`.  Text ones are one per line.  Binary ones are a
+header line followed by the number of words given in the header.  Rather
+than polling for the response we block on reading it, so a command costs
+one round trip to the monitor.
+
+Redis is still used for the bookkeeping of which FPGAs are monitored and
+used (see `redis_utils`) and to kill the monitor.
+'''
+import socket
+import logging
+
+from pyvivado import config, redis_connection
+
+logger = logging.getLogger(__name__)
+
+
+class Connection(redis_connection.Connection):
+
+    def __init__(self, hwcode, host='localhost', port=None, redis_client=None,
+                 connect_timeout=10, lease=None):
+        '''
+        Args:
+            `hwcode`: The hardware code of the monitored FPGA.
+            `host`: The host where the monitor is running.
+            `port`: The port the monitor listens on.  Defaults to the port
+                for `hwcode` in `config.monitor_ports`.
+            `redis_client`: The redis client used for bookkeeping.
+            `connect_timeout`: Seconds to wait for the connection.
+            `lease`: The `leases.Lease` on the FPGA.
+        '''
+        super().__init__(hwcode, redis_client=redis_client, lease=lease)
+        if port is None:
+            port = config.monitor_ports[hwcode]
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.sock = None
+        self.sockfile = None
+        # Counts connections so that requests sent on a connection that has
+        # since been closed do not read responses from a new one.
+        self.generation = 0
+
+    def connect(self):
+        if self.sock is None:
+            self.generation += 1
+            self.sock = socket.create_connection(
+                (self.host, self.port), timeout=self.connect_timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sockfile = self.sock.makefile('rwb')
+
+    def disconnect(self):
+        if self.sock is not None:
+            self.sockfile.close()
+            self.sock.close()
+            self.sock = None
+            self.sockfile = None
+
+    def close(self):
+        super().close()
+        self.disconnect()
+
+    def kill_monitor(self, time_limit=10):
+        '''
+        Stop the monitor once all submitted commands have completed.  The
+        lease is kept until `close` so that nobody else can start a monitor
+        on the FPGA before this one has stopped.
+        '''
+        self.stop_collecting()
+        self.disconnect()
+        super().kill_monitor(time_limit=time_limit)
+
+    def request_kill(self):
+        '''
+        Send a 'K' command, which stops the monitor serving.  If we cannot
+        connect the monitor still stops when it sees the kill flag.
+        '''
+        try:
+            self.connect()
+            self.sockfile.write(b'K\n')
+            self.sockfile.flush()
+        except OSError as e:
+            logger.warning('Could not send kill to {}: {}'.format(self.hwcode, e))
+        self.disconnect()
+
+    def push_request(self, command, timeout=None):
+        '''
+        Write a command to the socket.  Responses come back in the order
+        the commands were written so the only id needed is that of the
+        connection.  Requests have no deadline since the connection is
+        closed if we stop waiting for a response.
+        '''
+        if isinstance(command, str):
+            command = command.encode('ascii')
+        if not command.startswith(b'B '):
+            # Binary commands end with their data rather than a newline.
+            command += b'\n'
+        self.connect()
+        self.mark_listened()
+        self.sockfile.write(command)
+        self.sockfile.flush()
+        return self.generation
+
+    def wait_for_reply(self, sequence_id, timeout=None):
+        '''
+        Block until the next response arrives and return it.
+
+        Raises `socket.timeout` if there is no response within `timeout`
+        seconds.  The connection is then closed since a late response
+        would be mistaken for the response to the next command.
+        '''
+        if (self.sock is None) or (sequence_id != self.generation):
+            raise ConnectionError(
+                'Connection to the monitor for {} is closed.'.format(
+                    self.hwcode))
+        self.sock.settimeout(timeout)
+        try:
+            response = self.sockfile.readline()
+            if response.startswith(b'B '):
+                # A binary response is followed by its words.
+                n_bytes = 4 * int(response.split()[3])
+                words = self.sockfile.read(n_bytes)
+                if len(words) != n_bytes:
+                    response = b''
+                else:
+                    response += words
+        except socket.timeout:
+            self.disconnect()
+            raise
+        if not response:
+            self.disconnect()
+            raise ConnectionError(
+                'Monitor for {} closed the connection.'.format(self.hwcode))
+        return response
+
+    def send_command(self, command, timeout=None,
+                     parser=redis_connection.parse_response):
+        '''
+        Send a command to the monitor and block until the response
+        arrives.  It goes through the same queue as submitted commands
+        so that the responses are matched up in order.
+        '''
+        return self.submit_command(
+            command, timeout=timeout, parser=parser).result()
@@ -203,6 +203,10 @@ class Task:
         if not finished:
             description = '' if self.description is None else self.description
             logger.debug("Waiting for task to finish: {}".format(description))
+            # If we spawned the process we can wait on it directly.
+            if self.process is not None:
+                self.process.wait()
+                finished = self.is_finished()
         while not finished:
             time.sleep(sleep_time)
             finished = self.is_finished()
@@ -259,6 +263,11 @@ class Task:
             time.sleep(1)
 
     def launch_unix_subprocess(self, commands, stdout_fn, stderr_fn):
+        '''
+        Start the process in the task's directory.  The working directory
+        of this python process is left alone since other threads may be
+        launching tasks at the same time.
+        '''
         self.stdout = open(stdout_fn, 'w')
         self.stderr = open(stderr_fn, 'w')
         logger.debug(commands)
@@ -266,4 +275,5 @@ class Task:
             commands,
             stdout=self.stdout,
             stderr=self.stderr,
+            cwd=self.directory,
         )
@@ -76,7 +76,14 @@ class TasksCollection(object):
         return fn
 
     def get_next_directory(self):
-        last_index = self.get_last_index()
-        fn = self.id_to_directory(last_index+1)
-        os.mkdir(fn)
+        # Several tasks may be created at once, so keep trying until we
+        # create a directory that nobody else has.
+        index = self.get_last_index() + 1
+        while True:
+            fn = self.id_to_directory(index)
+            try:
+                os.mkdir(fn)
+                break
+            except FileExistsError:
+                index += 1
         return fn
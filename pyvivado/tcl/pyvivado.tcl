@@ -3,6 +3,54 @@ package provide pyvivado 0.1
 namespace eval ::pyvivado {
 }
 
+# Create an IP block and set its properties.
+# Args:
+#     `ip_name`: The name of the IP.
+#     `ip_version`: The version of the IP (can be "").
+#     `module_name`: The module name of the created IP.
+#     `properties`: A list of (name, value) CONFIG properties.
+#     `ip_dir`: The directory in which to create the IP (can be "").
+proc ::pyvivado::make_ip {ip_name ip_version module_name properties {ip_dir ""}} {
+    puts "DEBUG: ip_name = $ip_name"
+    puts "DEBUG: ip_version = $ip_version"
+    puts "DEBUG: module_name = $module_name"
+    set args [list -name $ip_name -vendor xilinx.com -library ip -module_name $module_name]
+    if {$ip_version != ""} {
+        lappend args -version $ip_version
+    }
+    if {$ip_dir != ""} {
+        lappend args -dir $ip_dir
+    }
+    create_ip {*}$args
+    foreach property $properties {
+        lassign $property property_name property_value
+        puts "DEBUG: Setting $property_name = $property_value"
+        set_property -name CONFIG.$property_name -value $property_value -objects [get_ips $module_name]
+    }
+}
+
+# Generate and synthesize an IP block into an entry of the shared IP cache.
+# The entry directory depends on the Vivado version, the part and a hash of
+# the IP configuration.  It is written once and then only copied from.
+# The caller must hold the exclusive lock on the entry.
+# Args:
+#     `entry_dir`: The directory of the cache entry.
+#     `part`: The part the IP is generated for.
+#     `board`: The board the IP is generated for (can be "").
+proc ::pyvivado::generate_cached_ip {entry_dir part board ip_name ip_version module_name properties} {
+    create_project -in_memory -part $part
+    if {$board != ""} {
+        set_property board_part $board [current_project]
+    }
+    ::pyvivado::make_ip $ip_name $ip_version $module_name $properties $entry_dir
+    set ip [get_ips $module_name]
+    generate_target all $ip
+    synth_ip $ip
+    set f [open [file join $entry_dir done.txt] w]
+    puts $f $module_name
+    close $f
+}
+
 # Create a new Vivado project.
 # Args:
 #     `project_dir`: The directory in which the project will be created.
@@ -10,8 +58,10 @@ namespace eval ::pyvivado {
 #     `simulation_files`: The wrapper files for simulation (can be "  ").
 #     `part`: The part for which we will implement (can be "").
 #     `board`: The board for which we will implement (can be "").
-#     `ips`: A list of (ip_name, ip_version, module_name, properties) used
-#         define the IP blocks that are required.
+#     `ips`: A list of (ip_name, ip_version, module_name, properties, xci)
+#         used define the IP blocks that are required.  If `xci` is not ""
+#         it is a copy of the IP from the shared IP cache which is added
+#         rather than generating the IP.
 #     `top_module`: The top module of the design (can be "").
 #     `out_of_context`: Whether it the project is out of context (i.e. not wired to IO)
 proc ::pyvivado::create_vivado_project {project_dir design_files simulation_files part board ips top_module out_of_context} {
@@ -32,19 +82,12 @@ proc ::pyvivado::create_vivado_project {project_dir design_files simulation_file
         add_files -fileset sim_1 -norecurse $simulation_files
     }
     foreach ip $ips {
-        lassign $ip ip_name ip_version module_name properties
-        puts "DEBUG: ip_name = $ip_name"
-        puts "DEBUG: ip_version = $ip_version"
-        puts "DEBUG: module_name = $module_name"
-        if {$ip_version != ""} {
-            create_ip -name $ip_name -version $ip_version -vendor xilinx.com -library ip -module_name $module_name
+        lassign $ip ip_name ip_version module_name properties xci
+        if {$xci != ""} {
+            puts "DEBUG: Using cached IP $module_name from $xci"
+            add_files -norecurse $xci
         } else {
-            create_ip -name $ip_name -vendor xilinx.com -library ip -module_name $module_name
-        }
-        foreach property $properties {
-            lassign $property property_name property_value
-            puts "DEBUG: Setting $property_name = $property_value"
-            set_property -name CONFIG.$property_name -value $property_value -objects [get_ips $module_name]
+            ::pyvivado::make_ip $ip_name $ip_version $module_name $properties
         }
     }
     set_property SOURCE_SET sources_1 [get_filesets sim_1]
@@ -156,8 +199,94 @@ proc ::pyvivado::create_simset {proj_dir test_name sim_type simulation_files} {
     }
 }
     
+# Set whether a simset should skip compilation.
+# Compilation is only skipped if the simulation directory exists and was
+# compiled from sources with the same hash.
+proc ::pyvivado::set_skip_compilation {simname sim_dir sources_hash} {
+    set hash_fn "${sim_dir}/pyvivado_sources_hash.txt"
+    set skip 0
+    if {[file isfile $hash_fn]} {
+        set fileId [open $hash_fn "r"]
+        set old_hash [string trim [read $fileId]]
+        close $fileId
+        if {$old_hash == $sources_hash} {
+            set skip 1
+        }
+    }
+    if {$skip == 1} {
+        set_property skip_compilation 1 [get_filesets $simname]
+        puts "DEBUG: Skipping test compilation."
+    } else {
+        set_property skip_compilation 0 [get_filesets $simname]
+        puts "DEBUG: Not skipping test compilation."
+    }
+}
+
+# Record the hash of the sources that a simulation directory was compiled from.
+proc ::pyvivado::record_sources_hash {sim_dir sources_hash} {
+    if {[file isdirectory $sim_dir]} {
+        set fileId [open "${sim_dir}/pyvivado_sources_hash.txt" "w"]
+        puts -nonewline $fileId $sources_hash
+        close $fileId
+    }
+}
+
+# Compile the simulation models of the project's IP into `lib_dir` and
+# write an xsim.ini file there mapping the library names to the compiled
+# libraries.  The IP wrappers in xil_defaultlib are left to the simsets.
+# The paths in xsim.ini are relative to `lib_dir` since it is renamed when
+# it is committed to the library cache.
+proc ::pyvivado::compile_sim_library {lib_dir} {
+    set ips [get_ips]
+    if {[llength $ips] > 0} {
+        export_ip_user_files -of_objects $ips -no_script -force
+        export_simulation -of_objects $ips -simulator xsim -directory $lib_dir -absolute_path -force
+        set cwd [pwd]
+        foreach script [glob -nocomplain [file join $lib_dir * xsim compile.sh]] {
+            puts "DEBUG: Running $script"
+            cd [file dirname $script]
+            exec bash compile.sh >@ stdout 2>@ stderr
+        }
+        cd $cwd
+    }
+    set fileId [open [file join $lib_dir xsim.ini] "w"]
+    set cwd [pwd]
+    cd $lib_dir
+    foreach lib_path [lsort [glob -nocomplain -type d [file join * xsim xsim.dir *]]] {
+        set lib_name [file tail $lib_path]
+        if {$lib_name != "xil_defaultlib" && ![info exists seen($lib_name)]} {
+            set seen($lib_name) 1
+            puts $fileId "${lib_name}=${lib_path}"
+        }
+    }
+    cd $cwd
+    close $fileId
+}
+
+# Open a project and compile its simulation library.
+proc ::pyvivado::open_and_compile_sim_library {proj_dir lib_dir} {
+    open_project "${proj_dir}/TheProject.xpr"
+    ::pyvivado::compile_sim_library $lib_dir
+}
+
+# Make a simset use precompiled simulation libraries rather than compiling
+# the IP simulation models itself.
+# Does nothing if `sim_library_dir` is "".
+proc ::pyvivado::use_sim_library {simname sim_library_dir} {
+    if {$sim_library_dir != ""} {
+        set ini_fn [file join $sim_library_dir xsim.ini]
+        puts "DEBUG: Using simulation libraries from $ini_fn"
+        set_property SIM.USE_IP_COMPILED_LIBS 1 [current_project]
+        set_property COMPXLIB.XSIM_COMPILED_LIBRARY_DIR $sim_library_dir [current_project]
+        set fileset [get_filesets $simname]
+        set_property -name {xsim.compile.xvhdl.more_options} -value "--initfile $ini_fn" -objects $fileset
+        set_property -name {xsim.compile.xvlog.more_options} -value "--initfile $ini_fn" -objects $fileset
+        set_property -name {xsim.elaborate.xelab.more_options} -value "--initfile $ini_fn" -objects $fileset
+    }
+}
+
 # Run a behavioral HDL simulation.
-proc ::pyvivado::run_hdl_simulation {proj_dir test_name test_bench_name runtime simulation_files} {
+proc ::pyvivado::run_hdl_simulation {proj_dir test_name test_bench_name runtime simulation_files sources_hash {sim_library_dir ""}} {
     set simname "${test_name}_hdl"
     set fileset_exists [::pyvivado::does_fileset_exist $simname]
     if {! $fileset_exists} {
@@ -165,69 +294,52 @@ proc ::pyvivado::run_hdl_simulation {proj_dir test_name test_bench_name runtime
     }
     puts "DEBUG: Made simset"
     set sim_dir "${proj_dir}/TheProject.sim/${simname}/behav"
-    set sim_dir_exists [file isdirectory $sim_dir]
-    if {$sim_dir_exists == 1} {
-        set_property skip_compilation 1 [get_filesets $simname]
-        puts "DEBUG: Skipping test compilation."
-    } else {
-        set_property skip_compilation 0 [get_filesets $simname]
-        puts "DEBUG: Not skipping test compilation."
-    }
+    ::pyvivado::set_skip_compilation $simname $sim_dir $sources_hash
+    ::pyvivado::use_sim_library $simname $sim_library_dir
     set_property top $test_bench_name [get_filesets $simname]
     set_property xsim.simulate.runtime $runtime [get_filesets $simname]
     puts "DEBUG: About to run_hdl_simulation and pwd is [pwd]"
     launch_simulation -simset $simname -mode behavioral
+    ::pyvivado::record_sources_hash $sim_dir $sources_hash
 }
 
 # Run a post-synthesis behavioral simulation.
-proc ::pyvivado::run_post_synthesis_simulation {proj_dir test_name test_bench_name runtime simulation_files} {
+proc ::pyvivado::run_post_synthesis_simulation {proj_dir test_name test_bench_name runtime simulation_files sources_hash {sim_library_dir ""}} {
     set simname "${test_name}_post_synthesis"
     set fileset_exists [::pyvivado::does_fileset_exist $simname]
     if {! $fileset_exists} {
         ::pyvivado::create_simset ${proj_dir}/.. $test_name post_synthesis $simulation_files
     }
     puts "DEBUG: Created simset"
-    set sim_dir "${proj_dir}/TheProject.sim/${simname}/synth"
-    set sim_dir_exists [file isdirectory $sim_dir]
     set_property STEPS.SYNTH_DESIGN.ARGS.FLATTEN_HIERARCHY none [get_runs synth_1]
     puts "DEBUG: About to synthesize"
     ::pyvivado::synthesize {} "out_of_context"
     set sim_dir "${proj_dir}/TheProject.sim/${simname}/synth"
-    set sim_dir_exists [file isdirectory $sim_dir]
-    if {$sim_dir_exists == 1} {
-        set_property skip_compilation 1 [get_filesets ${simname}]
-        puts "DEBUG: Skipping test compilation."
-    } else {
-        set_property skip_compilation 0 [get_filesets ${simname}]
-        puts "DEBUG: Not skipping test compilation."
-    }
+    ::pyvivado::set_skip_compilation $simname $sim_dir $sources_hash
+    ::pyvivado::use_sim_library $simname $sim_library_dir
     set_property top $test_bench_name [get_filesets $simname]
     set_property xsim.simulate.runtime $runtime [get_filesets ${simname}]
     puts "DEBUG: About to run_post_synthesis_simulation and pwd is [pwd]"
     launch_simulation -simset ${simname} -mode post-synthesis -type functional
+    ::pyvivado::record_sources_hash $sim_dir $sources_hash
 }
 
 # Run a post-implementation timing simulation.
-proc ::pyvivado::run_timing_simulation {proj_dir test_name test_bench_name runtime simulation_files} {
+proc ::pyvivado::run_timing_simulation {proj_dir test_name test_bench_name runtime simulation_files sources_hash {sim_library_dir ""}} {
     set simname "${test_name}_timing"
     set fileset_exists [::pyvivado::does_fileset_exist $simname]
     if {! $fileset_exists} {
         ::pyvivado::create_simset ${proj_dir}/.. $test_name timing $simulation_files
     }
     set sim_dir "${proj_dir}/TheProject.sim/${simname}/synth"
-    set sim_dir_exists [file isdirectory $sim_dir]
 
     ::pyvivado::implement_without_bitstream {} "out_of_context"
-    if {$sim_dir_exists == 1} {
-        set_property skip_compilation 1 [get_filesets $simname]
-        puts "DEBUG: Skipping test compilation."
-    } else {
-        set_property skip_compilation 0 [get_filesets $simname]
-        puts "DEBUG: Not skipping test compilation."
-    }
+    ::pyvivado::set_skip_compilation $simname $sim_dir $sources_hash
+    ::pyvivado::use_sim_library $simname $sim_library_dir
     set_property xsim.simulate.runtime $runtime [get_filesets $simname]
     puts "DEBUG: About to run_timing_simulation and pwd is [pwd]"
     launch_simulation -simset $simname -mode post-implementation -type timing
+    ::pyvivado::record_sources_hash $sim_dir $sources_hash
 }
 
 # Deploy the bitstream to an FPGA and start monitoring it.
@@ -236,7 +348,9 @@ proc ::pyvivado::run_timing_simulation {proj_dir test_name test_bench_name runti
 #     `hwcode`: The hardware code of the FPGA we want to deploy it to.
 #     `fake`: If fake == 1 that we don't deploy it we just pretend we 
 #          did any just return 0 for all AXI read commands.
-proc ::pyvivado::send_to_fpga_and_monitor {proj_dir hwcode hwtarget jtagfreq fake} {
+#     `transport`: How commands are received.  "redis" or "socket".
+#     `port`: The port to listen on for the "socket" transport.
+proc ::pyvivado::send_to_fpga_and_monitor {proj_dir hwcode hwtarget jtagfreq fake {transport redis} {port ""} {bitstream_hash ""}} {
     if {$fake == 0} {
   open_hw
 	connect_hw_server -url localhost:3121
@@ -244,26 +358,150 @@ proc ::pyvivado::send_to_fpga_and_monitor {proj_dir hwcode hwtarget jtagfreq fak
 	set_property PARAM.FREQUENCY $jtagfreq [get_hw_targets $hwtarget]
 	open_hw_target
     }
-    ::pyvivado::send_bitstream_to_fpga $proj_dir $hwcode $fake
-    ::pyvivado::monitor_redis_inner $hwcode $fake
+    ::pyvivado::send_bitstream_to_fpga $proj_dir $hwcode $fake $bitstream_hash
+    ::pyvivado::monitor_inner $hwcode $fake $transport $port
+}
+
+# Monitor for AXI commands using the given transport.
+# `r` is a redis connection to use.  If it is "" the monitor opens its own
+# and closes it when it stops.
+proc ::pyvivado::monitor_inner {hwcode fake transport port {r ""}} {
+    if {$transport == "socket"} {
+        ::pyvivado::monitor_socket_inner $hwcode $port $fake $r
+    } elseif {$transport == "redis"} {
+        ::pyvivado::monitor_redis_inner $hwcode $fake $r
+    } else {
+        puts "ERROR: Unknown transport $transport"
+    }
 }
 
 # Monitor REDIS for AXI commands to send to the FPGA.
 # Assumes connection with hardware server is already setup.x
-proc ::pyvivado::monitor_redis_inner {hwcode fake} {
-    package require redis
-    set r [redis 127.0.0.1 6379]
+proc ::pyvivado::monitor_redis_inner {hwcode fake {r ""}} {
+    set own_r [expr {$r == ""}]
+    if {$own_r} {
+        package require redis
+        set r [redis 127.0.0.1 6379]
+    }
     set finish 0
-    $r set ${hwcode}_kill 0
+    ::pyvivado::clear_kill $r $hwcode
+    # Requests left over from a previous monitor (e.g. a kill request for
+    # a monitor that had already died) are not for us.
+    $r del ${hwcode}_requests
     while {$finish == 0} {
-        ::pyvivado::check_redis $r $hwcode $fake
-        after 100
-	set finish [$r get ${hwcode}_kill]
+        set finish [::pyvivado::check_redis $r $hwcode $fake]
+        if {[$r get ${hwcode}_kill] == 1} {
+            set finish 1
+        }
+    }
+    ::pyvivado::acknowledge_kill $r $hwcode
+    if {$own_r} {
+        $r close
+    }
+}
+
+# Listen on a TCP socket for AXI commands to send to the FPGA.
+# Redis is still used for the heartbeat and the kill flag.
+# Assumes connection with hardware server is already setup.
+proc ::pyvivado::monitor_socket_inner {hwcode port fake {r ""}} {
+    set own_r [expr {$r == ""}]
+    if {$own_r} {
+        package require redis
+        set r [redis 127.0.0.1 6379]
+    }
+    ::pyvivado::clear_kill $r $hwcode
+    ::pyvivado::serve_socket $r $hwcode $port $fake
+    ::pyvivado::acknowledge_kill $r $hwcode
+    if {$own_r} {
+        $r close
+    }
+}
+
+# Forget any kill flag or acknowledgement left by a previous monitor.
+proc ::pyvivado::clear_kill {r hwcode} {
+    $r set ${hwcode}_kill 0
+    $r del ${hwcode}_killed
+}
+
+# Let python know that the monitor has stopped.  Removing the heartbeat
+# frees the FPGA straight away rather than when the heartbeat expires.
+# The FPGA is still programmed so its bitstream no longer expires.
+proc ::pyvivado::acknowledge_kill {r hwcode} {
+    $r del ${hwcode}_last_A
+    $r persist ${hwcode}_bitstream
+    $r set ${hwcode}_kill 0
+    $r lpush ${hwcode}_killed 1
+    $r pexpire ${hwcode}_killed 60000
+}
+
+# Serve AXI commands from a TCP socket until a 'K' command is received or
+# the kill flag is set.
+# Each line received is a command and the response is sent back as a line.
+# Args:
+#     `r`: The redis client used for the heartbeat and the kill flag.
+#     `port`: The port to listen on.  If 0 a free port is chosen.
+proc ::pyvivado::serve_socket {r hwcode port fake} {
+    set ::pyvivado::socket_finished 0
+    set server [socket -server [list ::pyvivado::accept_socket $r $hwcode $fake] -myaddr 127.0.0.1 $port]
+    puts "DEBUG: Listening on port [lindex [fconfigure $server -sockname] 2]"
+    flush stdout
+    ::pyvivado::socket_heartbeat $r $hwcode
+    vwait ::pyvivado::socket_finished
+    after cancel $::pyvivado::socket_heartbeat_id
+    close $server
+}
+
+# Update the heartbeat once a second and stop serving when killed.
+proc ::pyvivado::socket_heartbeat {r hwcode} {
+    ::pyvivado::heartbeat $r $hwcode
+    if {[$r get ${hwcode}_kill] == 1} {
+        set ::pyvivado::socket_finished 1
+    } else {
+        set ::pyvivado::socket_heartbeat_id [after 1000 [list ::pyvivado::socket_heartbeat $r $hwcode]]
     }
 }
 
+proc ::pyvivado::accept_socket {r hwcode fake channel address port} {
+    puts "DEBUG: Accepted connection from $address"
+    fconfigure $channel -buffering full -translation binary
+    fileevent $channel readable [list ::pyvivado::handle_socket $r $hwcode $fake $channel]
+}
+
+proc ::pyvivado::handle_socket {r hwcode fake channel} {
+    if {[gets $channel command] < 0} {
+        if {[eof $channel]} {
+            close $channel
+        }
+        return
+    }
+    if {$command == "K"} {
+        close $channel
+        set ::pyvivado::socket_finished 1
+        return
+    }
+    set bits [split $command]
+    if {[lindex $bits 0] == "B"} {
+        # Binary writes are followed by their data.
+        set payload ""
+        if {[lindex $bits 1] == "W" || [lindex $bits 1] == "WW"} {
+            set payload [read $channel [expr {4*[lindex $bits 3]}]]
+        }
+        set command "$command\n$payload"
+    }
+    set response [::pyvivado::run_command $command $fake [list ::pyvivado::heartbeat $r $hwcode]]
+    if {$response == ""} {
+        set response E
+    }
+    if {[string index $response 0] == "B"} {
+        puts -nonewline $channel $response
+    } else {
+        puts $channel $response
+    }
+    flush $channel
+}
+
 # Monitor REDIS for AXI commands to send to the FPGA.
-proc ::pyvivado::monitor_redis {hwcode hwtarget jtagfreq fake} {
+proc ::pyvivado::monitor_redis {hwcode hwtarget jtagfreq fake {transport redis} {port ""}} {
     if {$fake == 0} {
 	connect_hw_server -host localhost -port 60001 -url localhost:3121
 	current_hw_target [get_hw_targets $hwtarget]
@@ -272,107 +510,547 @@ proc ::pyvivado::monitor_redis {hwcode hwtarget jtagfreq fake} {
 	current_hw_device [lindex [get_hw_devices] 0]
 	refresh_hw_device [lindex [get_hw_devices] 0]
     }
-    monitor_redis_inner $hwcode $fake
+    ::pyvivado::monitor_inner $hwcode $fake $transport $port
  }
 
 # Send the projects bitstream to the FPGA.
-proc ::pyvivado::send_bitstream_to_fpga {proj_dir hwcode fake} {
+# `bitstream_hash` identifies the bitstream's contents.  It is recorded in
+# ${hwcode}_bitstream so that python can reuse an FPGA that is already
+# running it without programming it again.  The key expires with the
+# heartbeat, so it only outlives the Vivado process if that process stops
+# cleanly (see acknowledge_kill).  After a crash we no longer trust it.
+# `r` is a redis connection to use.  If it is "" one is opened and closed
+# again before returning.
+proc ::pyvivado::send_bitstream_to_fpga {proj_dir hwcode fake {bitstream_hash ""} {r ""}} {
     set bitstreams [glob "${proj_dir}/TheProject.runs/impl_1/*.bit"]
     set bitstream [lindex $bitstreams 0]
+    set own_r [expr {$r == ""}]
+    if {$own_r} {
+        package require redis
+        set r [redis 127.0.0.1 6379]
+    }
+    set failed [catch {
+        # Until programming succeeds we don't know what the FPGA is running.
+        $r del ${hwcode}_bitstream
+        if {$fake == 0} {
+            set_property PROGRAM.FILE $bitstream [lindex [get_hw_devices] 0]
+            set_property PROBES.FILE "${proj_dir}/TheProject.runs/impl_1/debug_nets.ltx" [lindex [get_hw_devices] 0]
+            current_hw_device [lindex [get_hw_devices] 0]
+            refresh_hw_device [lindex [get_hw_devices] 0]
+            program_hw_devices [lindex [get_hw_devices] 0]
+            refresh_hw_device [lindex [get_hw_devices] 0]
+        }
+        # Make a note that this hardware is now running this project.
+        $r set ${hwcode}_projdir $proj_dir
+        if {$fake == 0 && $bitstream_hash != ""} {
+            $r set ${hwcode}_bitstream $bitstream_hash PX $::pyvivado::heartbeat_ttl
+        }
+    } message options]
+    if {$own_r} {
+        $r close
+    }
+    if {$failed} {
+        return -options $options $message
+    }
+}
+
+# Milliseconds until a heartbeat expires.  A monitor that dies is seen
+# as dead this long after its last heartbeat.
+set ::pyvivado::heartbeat_ttl 3000
+
+# Let python know that the monitor is alive.
+proc ::pyvivado::heartbeat {r hwcode} {
+    $r set ${hwcode}_last_A [clock format [clock seconds] -format %Y%m%d%H%M%S] PX $::pyvivado::heartbeat_ttl
+    $r pexpire ${hwcode}_bitstream $::pyvivado::heartbeat_ttl
+    if {$::pyvivado::in_session} {
+        # The session is alive while it is monitoring.
+        ::pyvivado::session_heartbeat $r $hwcode
+    }
+}
+
+# Whether we are running in a hardware session (see hw_session).
+set ::pyvivado::in_session 0
+
+# Keep a connection to the hardware server and an FPGA open and serve
+# requests to program and monitor it, so that consecutive deployments do
+# not each start Vivado and connect to the FPGA.
+# Requests are "<id> <command>" popped from ${hwcode}_session_requests
+# where the command is a list of:
+#     P <proj_dir> <bitstream_hash>: Program the FPGA.
+#     M <transport> <port>: Monitor the FPGA until the monitor is killed.
+#     D <proj_dir> <bitstream_hash> <transport> <port>: Program then monitor.
+#     Q: End the session.
+# When a request is finished "OK" or "ERROR <message>" is pushed onto
+# ${hwcode}_session_reply_<id>.
+proc ::pyvivado::hw_session {hwcode hwtarget jtagfreq fake} {
     if {$fake == 0} {
-	set_property PROGRAM.FILE $bitstream [lindex [get_hw_devices] 0]
-	set_property PROBES.FILE "${proj_dir}/TheProject.runs/impl_1/debug_nets.ltx" [lindex [get_hw_devices] 0]
-	current_hw_device [lindex [get_hw_devices] 0]
-	refresh_hw_device [lindex [get_hw_devices] 0]
-	program_hw_devices [lindex [get_hw_devices] 0]
-	refresh_hw_device [lindex [get_hw_devices] 0]
+        open_hw
+        connect_hw_server -url localhost:3121
+        current_hw_target [get_hw_targets $hwtarget]
+        set_property PARAM.FREQUENCY $jtagfreq [get_hw_targets $hwtarget]
+        open_hw_target
+        current_hw_device [lindex [get_hw_devices] 0]
+        refresh_hw_device [lindex [get_hw_devices] 0]
     }
-    # Make a note that this hardware is now running this project.
     package require redis
     set r [redis 127.0.0.1 6379]
-    $r set ${hwcode}_projdir $proj_dir
+    set ::pyvivado::in_session 1
+    set finish 0
+    while {$finish == 0} {
+        set finish [::pyvivado::check_session $r $hwcode $fake]
+    }
+    set ::pyvivado::in_session 0
+    $r persist ${hwcode}_bitstream
+    $r del ${hwcode}_session
+    $r close
+}
+
+# Let python know that the hardware session is alive.
+proc ::pyvivado::session_heartbeat {r hwcode} {
+    $r set ${hwcode}_session [pid] PX $::pyvivado::heartbeat_ttl
+    $r pexpire ${hwcode}_bitstream $::pyvivado::heartbeat_ttl
+}
+
+# Wait up to a second for a session request and run it.  Monitors started
+# by the session share its redis connection.
+# Returns 1 if the session should end and otherwise 0.
+proc ::pyvivado::check_session {r hwcode fake} {
+    ::pyvivado::session_heartbeat $r $hwcode
+    set popped [$r brpop ${hwcode}_session_requests 1]
+    if {$popped == ""} {
+        return 0
+    }
+    if {![regexp {^(\d+) (.*)$} [lindex $popped 1] -> sequence_id command]} {
+        puts "ERROR: Badly formatted session request [lindex $popped 1]"
+        return 0
+    }
+    set finish 0
+    if {[catch {
+        switch -- [lindex $command 0] {
+            P {
+                ::pyvivado::send_bitstream_to_fpga [lindex $command 1] $hwcode $fake [lindex $command 2] $r
+            }
+            M {
+                ::pyvivado::monitor_inner $hwcode $fake [lindex $command 1] [lindex $command 2] $r
+            }
+            D {
+                ::pyvivado::send_bitstream_to_fpga [lindex $command 1] $hwcode $fake [lindex $command 2] $r
+                ::pyvivado::monitor_inner $hwcode $fake [lindex $command 3] [lindex $command 4] $r
+            }
+            Q {
+                set finish 1
+            }
+            default {
+                error "Unknown session request $command"
+            }
+        }
+    } message]} {
+        puts "ERROR: $message"
+        set response "ERROR $message"
+    } else {
+        set response "OK"
+    }
+    set reply_key ${hwcode}_session_reply_${sequence_id}
+    $r lpush $reply_key $response
+    $r expire $reply_key 600
+    return $finish
+}
+
+# Get the AXI transactions for a command.
+# Args:
+#     `typ`: W (write), R (read), WW (repeated write to one address) or
+#         RR (repeated read from one address).
+#     `address`: The first address.
+#     `data_length`: The number of words.
+#     `values`: The values to write (ignored for reads).
+# Returns a list of {axi_type address value} transactions.
+proc ::pyvivado::command_txns {typ address data_length values} {
+    set txns {}
+    for {set i 0} {$i < $data_length} {incr i} {
+        if {$typ == "W" || $typ == "R"} {
+            set this_address [expr {$address+$i}]
+        } else {
+            set this_address $address
+        }
+        if {$typ == "W" || $typ == "WW"} {
+            lappend txns [list WRITE $this_address [lindex $values $i]]
+        } else {
+            lappend txns [list READ $this_address 0]
+        }
+    }
+    return $txns
 }
 
-# Check redis for any AXI commands to send to the FPGA.
-# Writes responses back to redis.
+# Run AXI transactions and return the data reported by each.
+# If fake == 1 don't talk to the FPGA and return 0 for everything.
+proc ::pyvivado::run_txns {txns fake heartbeat} {
+    if {$fake == 0} {
+        set results [::pyvivado::run_axi_batch $txns $heartbeat]
+    } else {
+        # Don't think the response really matter for write.
+        set results {}
+        foreach txn $txns {
+            lappend results 0
+        }
+    }
+    return $results
+}
+
+# Run an AXI command on the FPGA and return the response.
+# Args:
+#     `command`: A command of the form "C <type> <address> <length> <data>..."
+#         where the type is W (write), R (read), WW (repeated write to one
+#         address) or RR (repeated read from one address).
+#         Binary commands are "B <type> <address> <length>", a newline and
+#         then the data as little-endian 32 bit words.
+#         Scripts are "S <type> <address> <length> <data>...|<type> ..." and
+#         run several commands in order (see `run_script`).
+#         The compound commands "C P <address> <mask> <expected> <timeout_ms>",
+#         "C M <address> <mask> <value>" and "C V <address> <length> <data>..."
+#         are described in `run_poll`, `run_read_modify_write` and
+#         `run_write_read_back`.
+#     `fake`: If fake == 1 don't talk to the FPGA and return 0 for everything.
+#     `heartbeat`: A command run regularly during long commands (can be "").
+# Returns "R <type> <address> <values>..." with hexadecimal values, or for
+# binary commands "B <type> <address> <length>", a newline and the words.
+# Returns "" if `command` is not a command.
+proc ::pyvivado::run_command {command fake {heartbeat ""}} {
+    set binary_command [string equal [string range $command 0 1] "B "]
+    if {[string range $command 0 1] == "S "} {
+        return [::pyvivado::run_script [string range $command 2 end] $fake $heartbeat]
+    } elseif {$binary_command} {
+        set header_end [string first "\n" $command]
+        set payload [string range $command [expr {$header_end+1}] end]
+        set bits [split [string range $command 0 [expr {$header_end-1}]]]
+    } else {
+        set bits [split $command]
+        if {[lindex $bits 0] != "C"} {
+            return ""
+        }
+    }
+    set typ [lindex $bits 1]
+    set address [lindex $bits 2]
+    if {!$binary_command} {
+        if {$typ == "P"} {
+            lassign [lrange $bits 3 5] mask expected timeout_ms
+            return [::pyvivado::run_poll $address $mask $expected $timeout_ms $fake $heartbeat]
+        } elseif {$typ == "M"} {
+            lassign [lrange $bits 3 4] mask value
+            return [::pyvivado::run_read_modify_write $address $mask $value $fake $heartbeat]
+        } elseif {$typ == "V"} {
+            set data_length [lindex $bits 3]
+            set values [lrange $bits 4 [expr {3+$data_length}]]
+            return [::pyvivado::run_write_read_back $address $data_length $values $fake $heartbeat]
+        }
+    }
+    set data_length [lindex $bits 3]
+    if {[lsearch -exact {W R WW RR} $typ] < 0} {
+        puts "ERROR: Unknown command type $typ"
+        return ""
+    }
+    puts "running $typ command with length $data_length"
+    if {$binary_command && ($typ == "W" || $typ == "WW")} {
+        binary scan $payload iu$data_length values
+    } else {
+        set values [lrange $bits 4 [expr {3+$data_length}]]
+    }
+    set txns [::pyvivado::command_txns $typ $address $data_length $values]
+    set results [::pyvivado::run_txns $txns $fake $heartbeat]
+    if {$binary_command} {
+        set words {}
+        foreach result $results {
+            lappend words [scan $result %x]
+        }
+        return "B $typ $address $data_length\n[binary format i* $words]"
+    }
+    return [join [concat [list R $typ $address] $results]]
+}
+
+# Read a single word and return it as an integer.
+proc ::pyvivado::read_word {address fake} {
+    return [scan [lindex [::pyvivado::run_txns [list [list READ $address 0]] $fake ""] 0] %x]
+}
+
+# Read an address until (value & mask) == expected or until `timeout_ms`
+# milliseconds have passed.
+# Returns "R P <address> <value>" or "T P <address> <value>" if it timed out
+# where <value> is the last value read in hexadecimal.
+proc ::pyvivado::run_poll {address mask expected timeout_ms fake heartbeat} {
+    set deadline [expr {[clock milliseconds] + $timeout_ms}]
+    set n_reads 0
+    while {1} {
+        set value [::pyvivado::read_word $address $fake]
+        incr n_reads
+        if {($value & $mask) == $expected} {
+            return "R P $address [format %08x $value]"
+        }
+        if {[clock milliseconds] > $deadline} {
+            puts "Polling $address timed out after $n_reads reads."
+            return "T P $address [format %08x $value]"
+        }
+        if {($heartbeat != "") && ($n_reads % 100 == 0)} {
+            {*}$heartbeat
+        }
+    }
+}
+
+# Replace the bits of a word selected by `mask` with those of `value`.
+# Returns "R M <address> <old value> <new value>" with hexadecimal values.
+proc ::pyvivado::run_read_modify_write {address mask value fake heartbeat} {
+    set old_value [::pyvivado::read_word $address $fake]
+    set new_value [expr {($old_value & ~$mask) | ($value & $mask)}]
+    ::pyvivado::run_txns [list [list WRITE $address $new_value]] $fake $heartbeat
+    return "R M $address [format %08x $old_value] [format %08x $new_value]"
+}
+
+# Write words to consecutive addresses and then read them back.
+# Returns "R V <address> <values read>..." with hexadecimal values.
+proc ::pyvivado::run_write_read_back {address data_length values fake heartbeat} {
+    set txns [concat \
+                  [::pyvivado::command_txns W $address $data_length $values] \
+                  [::pyvivado::command_txns R $address $data_length {}]]
+    set results [::pyvivado::run_txns $txns $fake $heartbeat]
+    return [join [concat [list R V $address] [lrange $results $data_length end]]]
+}
+
+# Run a script of commands separated by "|".  Each command is
+# "<type> <address> <length> <data>...".  The transactions of all the
+# commands are run together, in order, so the whole script costs a single
+# round trip from python.
+# Returns "S <response>|<response>|..." where each response is the same as
+# the response to the command on its own.
+proc ::pyvivado::run_script {script fake heartbeat} {
+    set txns {}
+    set commands {}
+    foreach command [split $script "|"] {
+        set bits [split [string trim $command]]
+        set typ [lindex $bits 0]
+        set address [lindex $bits 1]
+        set data_length [lindex $bits 2]
+        if {[lsearch -exact {W R WW RR} $typ] < 0} {
+            puts "ERROR: Unknown command type $typ in script"
+            return ""
+        }
+        set values [lrange $bits 3 [expr {2+$data_length}]]
+        lappend commands [list $typ $address $data_length]
+        set txns [concat $txns [::pyvivado::command_txns $typ $address $data_length $values]]
+    }
+    puts "running script of [llength $commands] commands"
+    set results [::pyvivado::run_txns $txns $fake $heartbeat]
+    set responses {}
+    set start 0
+    foreach command $commands {
+        lassign $command typ address data_length
+        set end [expr {$start + $data_length}]
+        lappend responses [join [concat [list R $typ $address] [lrange $results $start [expr {$end-1}]]]]
+        set start $end
+    }
+    return "S [join $responses |]"
+}
+
+# Wait up to a second for an AXI command in redis and send it to the FPGA.
+# Requests are "<id> <deadline> <command>" popped from the ${hwcode}_requests
+# list, where the deadline is in milliseconds since the epoch (0 for none).
+# The response is pushed as "<id> <response>" onto ${hwcode}_reply_<id>.
+# Returns 1 if the request was to stop monitoring ("K") and otherwise 0.
 proc ::pyvivado::check_redis {r hwcode fake} {
-    puts "checking redis"
-    $r set ${hwcode}_last_A [clock format [clock seconds] -format %Y%m%d%H%M%S]
-    set output [$r get ${hwcode}_comm]
-    set bits [split $output]
-    if {[lindex $bits 0] == "C"} {
-        set typ [lindex $bits 1]
-        set address [lindex $bits 2]
-        set data_length [lindex $bits 3]
-        if {$typ == "W"} {
-            puts "writing to axi"
-            set response "R W $address"
-            for {set i 0} {$i < $data_length} {incr i} {
-                if {$fake == 0} {
-                    set results [::pyvivado::write_axi [format %08x [expr {$address+$i}]] [format %08x [lindex $bits [expr {4+$i}]]]]
-                    set response "$response [lindex $results 1]"
-                } else {
-                    # Don't think the response really matter for write.
-                    set response "$response 0"
-                }
-	             	$r set ${hwcode}_last_A [clock format [clock seconds] -format %Y%m%d%H%M%S]
+    ::pyvivado::heartbeat $r $hwcode
+    set popped [$r brpop ${hwcode}_requests 1]
+    if {$popped != ""} {
+        return [::pyvivado::serve_request $r $hwcode [lindex $popped 1] $fake [list ::pyvivado::heartbeat $r $hwcode]]
+    }
+    return 0
+}
+
+# Run a request popped from ${hwcode}_requests and push the response.
+# Requests whose deadline has passed are dropped since nobody is waiting
+# for them.  If the command cannot be run the response is "E".
+# Returns 1 if the request was to stop monitoring ("K") and otherwise 0.
+proc ::pyvivado::serve_request {r hwcode request fake heartbeat} {
+    if {[regexp {^(\d+) (\d+) (.*)$} $request -> sequence_id deadline command]} {
+        if {$command == "K"} {
+            return 1
+        }
+        if {$deadline != 0 && [clock milliseconds] > $deadline} {
+            puts "DEBUG: Dropping expired request $sequence_id"
+            return 0
+        }
+        set response [::pyvivado::run_command $command $fake $heartbeat]
+        if {$response == ""} {
+            set response E
+        }
+        set reply_key ${hwcode}_reply_${sequence_id}
+        $r lpush $reply_key "$sequence_id $response"
+        # Nobody reads the reply if python gave up waiting.
+        $r expire $reply_key 600
+    } else {
+        puts "ERROR: Badly formatted request $request"
+    }
+    return 0
+}
+
+# Monitor redis for AXI commands for several FPGAs from one Vivado process.
+# The FPGAs share one connection to the hardware server.  Each has its
+# own requests, replies, heartbeat and kill flag so to python it looks
+# the same as having a monitor for each.
+# Args:
+#     `hwcodes`: The hardware codes of the FPGAs.
+#     `hwtargets`: The hw_target of each FPGA.
+#     `jtagfreqs`: The JTAG frequency of each FPGA.
+proc ::pyvivado::monitor_many {hwcodes hwtargets jtagfreqs fake} {
+    if {$fake == 0} {
+        connect_hw_server -host localhost -port 60001 -url localhost:3121
+    }
+    package require redis
+    set r [redis 127.0.0.1 6379]
+    set targets [dict create]
+    foreach hwcode $hwcodes hwtarget $hwtargets jtagfreq $jtagfreqs {
+        dict set targets $hwcode [list $hwtarget $jtagfreq]
+        ::pyvivado::clear_kill $r $hwcode
+        $r del ${hwcode}_requests
+    }
+    set active $hwcodes
+    while {[llength $active] > 0} {
+        foreach hwcode [::pyvivado::check_redis_many $r $active $targets $fake] {
+            ::pyvivado::acknowledge_kill $r $hwcode
+            set active [lsearch -all -inline -exact -not $active $hwcode]
+        }
+    }
+    $r close
+}
+
+# Update the heartbeats of several FPGAs.
+proc ::pyvivado::heartbeat_many {r hwcodes} {
+    foreach hwcode $hwcodes {
+        ::pyvivado::heartbeat $r $hwcode
+    }
+}
+
+# The most requests served for one FPGA before the others get a turn.
+set ::pyvivado::max_target_batch 64
+
+# Wait up to a second for an AXI command for any of several FPGAs and send
+# it to its FPGA.  Switching FPGAs means reopening the hw_target, so the
+# requests already queued for an FPGA are served together (up to
+# `max_target_batch`) and the FPGA that is open is checked first.
+# Args:
+#     `targets`: A dictionary mapping hwcodes to {hwtarget jtagfreq}.
+# Returns the hwcodes that should no longer be monitored.
+proc ::pyvivado::check_redis_many {r hwcodes targets fake} {
+    set heartbeat [list ::pyvivado::heartbeat_many $r $hwcodes]
+    {*}$heartbeat
+    set keys {}
+    set kill_keys {}
+    foreach hwcode $hwcodes {
+        if {[lindex [dict get $targets $hwcode] 0] == $::pyvivado::open_target} {
+            set keys [linsert $keys 0 ${hwcode}_requests]
+        } else {
+            lappend keys ${hwcode}_requests
+        }
+        lappend kill_keys ${hwcode}_kill
+    }
+    set stopped {}
+    set popped [$r brpop {*}$keys 1]
+    if {$popped != ""} {
+        set hwcode [string range [lindex $popped 0] 0 end-[string length _requests]]
+        if {$fake == 0} {
+            ::pyvivado::select_target {*}[dict get $targets $hwcode]
+        }
+        set request [lindex $popped 1]
+        set n_served 0
+        while {$request != ""} {
+            if {[::pyvivado::serve_request $r $hwcode $request $fake $heartbeat]} {
+                lappend stopped $hwcode
+                break
             }
-            $r set ${hwcode}_comm $response
-        }
-        if {$typ == "R"} {
-            puts "reading from axi length is $data_length"
-            set response "R R $address"
-	          for {set i 0} {$i < $data_length} {incr i} {
-		            if {$fake == 0} {
-	            	    set results [::pyvivado::read_axi [format %08x [expr {$address+$i}]]]
-	            	    set response "$response [lindex $results 1]"
-            		} else {
-		                set response "$response 0"
-                }
-                if {$i % 100 == 0} {
-		                puts $i
-		                $r set ${hwcode}_last_A [clock format [clock seconds] -format %Y%m%d%H%M%S]
-	              }
-	          }
-            $r set ${hwcode}_comm $response
-        }
-	      if {$typ == "WW"} {
-            puts "writing to axi repeatedly"
-            set response "R WW $address"
-            for {set i 0} {$i < $data_length} {incr i} {
-	              if {$fake == 0} {
-		                set results [::pyvivado::write_axi [format %08x [expr {$address}]] [format %08x [lindex $bits [expr {4+$i}]]]]
-		                set response "$response [lindex $results 1]"
-		            } else {
-		                set response "$response 0"
-		            }
-		            $r set ${hwcode}_last_A [clock format [clock seconds] -format %Y%m%d%H%M%S]
+            incr n_served
+            if {$n_served >= $::pyvivado::max_target_batch} {
+                break
             }
-            $r set ${hwcode}_comm $response
-        }         
-	      if {$typ == "RR"} {
-            puts "reading from axi repeatedly"
-            set response "R RR $address"
-            for {set i 0} {$i < $data_length} {incr i} {
-		            if {$fake == 0} {
-	            	    set results [::pyvivado::read_axi [format %08x [expr {$address}]]]
-	            	    set response "$response [lindex $results 1]"
-            		} else {
-		                set response "$response 0"
-                }
-                if {$i % 100 == 0} {
-		                puts $i
-		                $r set ${hwcode}_last_A [clock format [clock seconds] -format %Y%m%d%H%M%S]
-	              }
+            set request [$r rpop ${hwcode}_requests]
+        }
+    }
+    foreach hwcode $hwcodes kill [$r mget {*}$kill_keys] {
+        if {$kill == 1 && [lsearch -exact $stopped $hwcode] < 0} {
+            lappend stopped $hwcode
+        }
+    }
+    return $stopped
+}
+
+# The hw_target currently opened by `select_target`.
+set ::pyvivado::open_target ""
+
+# Make an FPGA the one that AXI transactions are sent to.  Only one
+# hw_target is open at a time so the open one is closed first if it is
+# a different one.
+proc ::pyvivado::select_target {hwtarget jtagfreq} {
+    if {$::pyvivado::open_target != $hwtarget} {
+        set start [clock milliseconds]
+        if {$::pyvivado::open_target != ""} {
+            close_hw_target
+        }
+        current_hw_target [get_hw_targets $hwtarget]
+        set_property PARAM.FREQUENCY $jtagfreq [get_hw_targets $hwtarget]
+        open_hw_target
+        set device [lindex [get_hw_devices] 0]
+        current_hw_device $device
+        refresh_hw_device $device
+        set ::pyvivado::hw_axi_name [lindex [get_hw_axis] 0]
+        set ::pyvivado::open_target $hwtarget
+        puts "DEBUG: Switched to $hwtarget in [expr {[clock milliseconds] - $start}] ms"
+    }
+}
+
+# The number of AXI transactions that are queued and then run with a
+# single run_hw_axi.
+set ::pyvivado::axi_batch_size 256
+
+# The hw_axi that AXI transactions are sent to.  A monitor serving several
+# FPGAs changes it when it switches between them.
+set ::pyvivado::hw_axi_name hw_axi_1
+
+# Run single word AXI transactions, queueing up to `axi_batch_size` of them
+# for each run_hw_axi.
+# The jtag_axi IP is configured for AXI4-Lite so bursts are not possible.
+# Args:
+#     `txns`: A list of {axi_type address value} where axi_type is READ or
+#         WRITE and the value is ignored for READ.
+#     `heartbeat`: A command run after each batch (can be "").
+# Returns the data reported by each transaction.
+proc ::pyvivado::run_axi_batch {txns {heartbeat ""}} {
+    set hw_axi [get_hw_axis $::pyvivado::hw_axi_name]
+    set results {}
+    set n_txns [llength $txns]
+    for {set start 0} {$start < $n_txns} {incr start $::pyvivado::axi_batch_size} {
+        set end [expr {min($start + $::pyvivado::axi_batch_size, $n_txns)}]
+        set hw_txns {}
+        for {set i $start} {$i < $end} {incr i} {
+            lassign [lindex $txns $i] axi_type address value
+            set name "pyvivado_txn_$i"
+            set address [format %08x $address]
+            if {$axi_type == "WRITE"} {
+                create_hw_axi_txn $name $hw_axi -type WRITE -address $address -len 1 -data [format %08x $value]
+            } else {
+                create_hw_axi_txn $name $hw_axi -type READ -address $address -len 1
             }
-            $r set ${hwcode}_comm $response
+            lappend hw_txns [get_hw_axi_txns $name]
+        }
+        run_hw_axi $hw_txns
+        foreach hw_txn $hw_txns {
+            lappend results [lindex [report_hw_axi_txn $hw_txn] 1]
+        }
+        delete_hw_axi_txn $hw_txns
+        if {$heartbeat != ""} {
+            {*}$heartbeat
         }
     }
+    return $results
 }
 
 # Send an AXI read command to the FPGA.
 proc ::pyvivado::read_axi {address} {
-    create_hw_axi_txn read_txn [get_hw_axis hw_axi_1] -type READ -address $address -len 1
+    create_hw_axi_txn read_txn [get_hw_axis $::pyvivado::hw_axi_name] -type READ -address $address -len 1
     run_hw_axi [get_hw_axi_txns read_txn]
     set results [report_hw_axi_txn [get_hw_axi_txns read_txn]]
     delete_hw_axi_txn [get_hw_axi_txns read_txn]
@@ -381,7 +1059,7 @@ proc ::pyvivado::read_axi {address} {
 
 # Send an AXI write command to the FPGA.
 proc ::pyvivado::write_axi {address value} {
-    create_hw_axi_txn write_txn [get_hw_axis hw_axi_1] -type WRITE -address $address -len 1 -data $value
+    create_hw_axi_txn write_txn [get_hw_axis $::pyvivado::hw_axi_name] -type WRITE -address $address -len 1 -data $value
     run_hw_axi [get_hw_axi_txns write_txn]
     set results [report_hw_axi_txn [get_hw_axi_txns write_txn]]
     delete_hw_axi_txn [get_hw_axi_txns write_txn]
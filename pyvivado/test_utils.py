@@ -3,13 +3,15 @@ import unittest
 import logging
 import shutil
 import time
+import concurrent.futures
 import testfixtures
 
 from pyvivado import filetestbench_project, fpga_project, axi
 from pyvivado.synopsys import synopsys_project
-from pyvivado import vivado_project, test_info
+from pyvivado import vivado_project, xsim_project, test_info
 from pyvivado import config
 from pyvivado import base_test_utils
+from pyvivado import shards, validation
 
 logger = logging.getLogger(__name__)
 
@@ -55,8 +57,27 @@ def simulate(directory, data, sim_type,
              force_refresh=False,
              overwrite_ok=False,
              project_class=filetestbench_project.FileTestBenchProject,
+             result_cache=None,
+             input_layout=None,
+             output_layout=None,
+             columnar=False,
              ):
+    '''
+    Simulate a project with the given input data and return the output data.
+
+    If a `result_cache.ResultCache` is passed and it contains the output of
+    an identical simulation, that output is returned without running
+    Vivado.
 
+    `sim_type`s starting with 'xsim_' run the simulation directly with
+    xsim rather than in a Vivado project.  The input data is written as a
+    packed file with `input_layout` and the output is read with
+    `output_layout` (both `packed_data.Layout`s matching the test bench).
+
+    If `columnar` is True (only for xsim) the output file is returned as a
+    `packed_data.PackedData`, including its first line, rather than
+    parsed into a list of dictionaries.  The caller must close it.
+    '''
     if interface is None:
         if params is None:
             raise ValueError('No params passed.')
@@ -76,8 +97,23 @@ def simulate(directory, data, sim_type,
         params=params, directory=directory,
         overwrite_ok=overwrite_ok,
     )
-    logger.debug('Updating input data')
-    p.update_input_data(input_data=data, test_name=test_name)
+    runtime = '{} ns'.format((len(data) + extra_clock_periods) *
+                             clock_period)
+    if columnar and not sim_type.startswith('xsim'):
+        raise ValueError('Columnar output is only supported with xsim.')
+    if columnar and (result_cache is not None):
+        raise ValueError('Columnar output cannot be memoized.')
+    if result_cache is not None:
+        result_key = result_cache.make_key(
+            project_hash=p.get_hash(), sim_type=sim_type, runtime=runtime,
+            data=data)
+        output_data = result_cache.get_output(result_key)
+        if output_data is not None:
+            logger.debug('Using memoized simulation output.')
+            return output_data[1:]
+    if not sim_type.startswith('xsim'):
+        logger.debug('Updating input data')
+        p.update_input_data(input_data=data, test_name=test_name)
     if sim_type.startswith('vivado'):
         vivado_sim_type = sim_type[len('vivado_'):]
         logger.debug('Making a Vivado Project')
@@ -85,8 +121,6 @@ def simulate(directory, data, sim_type,
             p, overwrite_ok=overwrite_ok, wait_for_creation=True)
 
         # Run the simulation.
-        runtime = '{} ns'.format((len(data) + extra_clock_periods) *
-                                 clock_period)
         errors, output_data = v.run_simulation(
             test_name=test_name, runtime=runtime, sim_type=vivado_sim_type)
         for error in errors:
@@ -103,9 +137,30 @@ def simulate(directory, data, sim_type,
         for error in errors:
             logger.error(error)
         assert(len(errors) == 0)
+    elif sim_type.startswith('xsim'):
+        xsim_sim_type = sim_type[len('xsim_'):]
+        if (input_layout is None) or (output_layout is None):
+            raise ValueError(
+                'An input_layout and output_layout are needed to simulate '
+                'with xsim.')
+        logger.debug('Making a XSim Project')
+        with xsim_project.XSimProject(p) as x:
+            errors, output = x.run_simulation(
+                test_name=test_name, runtime=runtime, sim_type=xsim_sim_type,
+                input_data=data, input_layout=input_layout,
+                output_layout=output_layout)
+        for error in errors:
+            logger.error(error)
+        assert(len(errors) == 0)
+        if columnar:
+            return output
+        with output:
+            output_data = list(output)
     else:
         raise ValueError('Unknown sim_type: {}'.format(sim_type))
 
+    if result_cache is not None:
+        result_cache.put_output(result_key, output_data)
     return output_data[1:]
 
 
@@ -166,10 +221,20 @@ def deploy_and_test(
         test.set_handler(handler)
         test.prepare()
         test.check()
-    # Sleep for 10 seconds so that we can kill monitor
-    time.sleep(10)
-    # Destroy monitoring process
-    connection.kill_free_monitors(v_dir)
+    # Stop the monitor and release the FPGA.
+    conn.kill_monitor()
+    conn.close()
+
+
+def get_input_lengths(reset_input, wait_lines, tests):
+    '''
+    The number of lines of input data each test contributes, including the
+    reset lines before it.
+    '''
+    return [
+        len(base_test_utils.tests_to_input_data(
+            reset_input=reset_input, wait_lines=wait_lines, tests=[test]))
+        for test in tests]
 
 
 def simulate_and_test(
@@ -187,10 +252,22 @@ def simulate_and_test(
         force_refresh=False,
         overwrite_ok=False,
         project_class=filetestbench_project.FileTestBenchProject,
+        result_cache=None,
+        input_layout=None,
+        output_layout=None,
+        columnar=False,
         ):
     '''
     Run a single vivado simulation which contains many independent tests
     that are run one after another in a single simulation.
+
+    If `columnar` is True the output is read column by column from the
+    packed output file and checked with
+    `validation.validate_consecutive_tests` instead of building a
+    dictionary for every cycle.  The tests must then have an
+    `expected_columns` method.  Each test's output is expected to start
+    after the `wait_lines` cycles of reset input before it, and the tests
+    are located from the length of each test's input data.
     '''
     logger.debug('staring simulate and test')
     if interface is None:
@@ -215,8 +292,22 @@ def simulate_and_test(
         test_name=test_name,
         overwrite_ok=overwrite_ok,
         project_class=project_class,
+        result_cache=result_cache,
+        input_layout=input_layout,
+        output_layout=output_layout,
+        columnar=columnar,
     )
     logger.debug('finish simulate')
+    if columnar:
+        # The first output line precedes the first input line.  The input
+        # lengths include the reset lines before each test.
+        lengths = get_input_lengths(
+            reset_input=reset_input, wait_lines=wait_lines, tests=tests)
+        with output_data:
+            validation.validate_consecutive_tests(
+                tests=tests, output=output_data, start=1 + wait_lines,
+                lengths=lengths)
+        return
     base_test_utils.validate_output_data_with_tests(
         input_data=input_data,
         output_data=output_data,
@@ -226,6 +317,144 @@ def simulate_and_test(
     )
 
 
+def sharded_simulate_and_test(
+        directory, reset_input, tests, input_layout, output_layout,
+        test_name='test',
+        params=None,
+        n_shards=None,
+        fail_fast=True,
+        wait_lines=20,
+        sim_type='xsim_hdl',
+        clock_period=default_clock_period,
+        extra_clock_periods=default_extra_clock_periods,
+        pause=False,
+        overwrite_ok=False,
+        project_class=filetestbench_project.FileTestBenchProject,
+        ):
+    '''
+    Like `simulate_and_test` but the tests are split into `n_shards`
+    simulations that are run in parallel.
+
+    The shards are balanced using the runtimes recorded from previous
+    regressions in the directory, falling back to the length of each
+    test's input data.  The test bench is elaborated once into a xsim
+    snapshot and each shard runs its own xsim process on that snapshot
+    with its own packed input file written with `input_layout`, so only
+    xsim `sim_type`s are supported.
+    The outputs of the shards are merged and validated together.
+
+    If `fail_fast` is True the first failing shard raises immediately and
+    shards that have not started are cancelled.  Otherwise all shards are
+    run and the failures are reported together.
+    '''
+    if params is None:
+        raise ValueError('No params passed.')
+    if not sim_type.startswith('xsim'):
+        raise ValueError(
+            'Sharded simulations are only supported with xsim not {}'.format(
+                sim_type))
+    xsim_sim_type = sim_type[len('xsim_'):]
+    if n_shards is None:
+        n_shards = os.cpu_count() or 1
+    input_lengths = get_input_lengths(
+        reset_input=reset_input, wait_lines=wait_lines, tests=tests)
+    history = shards.RuntimeHistory(
+        os.path.join(directory, 'shard_runtimes.json'))
+    weights = history.weights(tests, input_lengths)
+    shard_indices = shards.partition(weights, n_shards)
+    logger.debug('Split {} tests into {} shards.'.format(
+        len(tests), len(shard_indices)))
+    p = project_class(
+        params=params, directory=directory, overwrite_ok=overwrite_ok)
+    x = xsim_project.XSimProject(p)
+    # Elaborate before the shards start so that they all find the
+    # snapshot in the cache.
+    errors, snapshot, snapshot_directory = x.elaborate()
+    for error in errors:
+        logger.error(error)
+    assert(len(errors) == 0)
+    shard_inputs = [
+        base_test_utils.tests_to_input_data(
+            reset_input=reset_input, wait_lines=wait_lines,
+            tests=[tests[i] for i in indices])
+        for indices in shard_indices]
+
+    def run_shard(shard_index):
+        shard_name = '{}_shard{}'.format(test_name, shard_index)
+        runtime = '{} ns'.format(
+            (len(shard_inputs[shard_index]) + extra_clock_periods) *
+            clock_period)
+        start_time = time.time()
+        errors, output = x.run_simulation(
+            test_name=shard_name, runtime=runtime, sim_type=xsim_sim_type,
+            input_data=shard_inputs[shard_index], input_layout=input_layout,
+            output_layout=output_layout)
+        elapsed = time.time() - start_time
+        if errors:
+            raise Exception('\n'.join(errors))
+        with output:
+            output_data = list(output)
+        return elapsed, output_data[1:]
+
+    failures = []
+    shard_outputs = {}
+    futures = {}
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=len(shard_indices))
+    try:
+        futures = dict(
+            (executor.submit(run_shard, shard_index), shard_index)
+            for shard_index in range(len(shard_indices)))
+        for future in concurrent.futures.as_completed(futures):
+            shard_index = futures[future]
+            exception = future.exception()
+            if exception is not None:
+                logger.error('Shard {} failed: {}'.format(
+                    shard_index, exception))
+                failures.append((shard_index, exception))
+                if fail_fast:
+                    break
+                continue
+            elapsed, output_data = future.result()
+            shard_outputs[shard_index] = output_data
+            indices = shard_indices[shard_index]
+            shard_length = sum(input_lengths[i] for i in indices)
+            for i in indices:
+                history.update(shards.get_test_key(tests[i], i),
+                               elapsed * input_lengths[i] / shard_length)
+    finally:
+        # Shards that have not started are not run after a failure.
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=not failures)
+        # After a failure shards may still be running on the snapshot, so
+        # it stays locked until this process exits.
+        if not failures:
+            x.close()
+    if failures:
+        raise Exception('Failing shards: {}'.format(
+            ', '.join(['{} ({})'.format(shard_index, exception)
+                       for shard_index, exception in failures])))
+    history.write()
+    # Each shard's data is complete test data for its tests, so the shards
+    # concatenated in order are validated like one simulation of the tests
+    # in that order.
+    merged_tests = []
+    merged_input = []
+    merged_output = []
+    for shard_index, indices in enumerate(shard_indices):
+        merged_tests += [tests[i] for i in indices]
+        merged_input += shard_inputs[shard_index]
+        merged_output += shard_outputs[shard_index]
+    base_test_utils.validate_output_data_with_tests(
+        input_data=merged_input,
+        output_data=merged_output,
+        wait_lines=wait_lines,
+        pause=pause,
+        tests=merged_tests,
+    )
+
+
 class AxiTest():
 
     def __init__(self):
@@ -0,0 +1,202 @@
+'''
+Parsing of the hierarchical utilization reports that Vivado generates.
+
+A deep hierarchical report (`-hierarchical_depth 10`) of a large design can
+contain tens of thousands of instances.  Rather than building a nested dict
+for each instance, the `UtilizationTable` stores the hierarchy column by
+column.  The rows are kept in the order they appear in the report which is a
+pre-order walk of the hierarchy, so the subtree of any instance is a
+contiguous range of rows.
+'''
+import array
+import heapq
+import fnmatch
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def parse_utilization_lines(lines):
+    '''
+    Parse the hierarchical section of a utilization report.
+
+    Args:
+        `lines`: An iterable of the lines in the report.
+
+    Returns a (categories, rows) tuple where:
+        `categories`: A list of the resource categories in the report.
+        `rows`: A generator of (level, instance, module, counts) tuples
+            where `counts` is a list of integers matching `categories`.
+    '''
+    lines = iter(lines)
+    categories = None
+    for line in lines:
+        bits = [s.strip() for s in line.split('|')]
+        if (len(bits) > 1) and (bits[1] == 'Instance'):
+            categories = bits[3: -1]
+            break
+    if categories is None:
+        raise ValueError('No hierarchical utilization found in report.')
+
+    def rows():
+        for line in lines:
+            bits = line.split('|')
+            if len(bits) > 2:
+                level = (len(bits[1]) - len(bits[1].lstrip()) - 1)//2
+                counts = [int(bits[index+3].strip())
+                          for index in range(len(categories))]
+                yield level, bits[1].strip(), bits[2].strip(), counts
+    return categories, rows()
+
+
+class UtilizationTable(object):
+    '''
+    A columnar representation of a hierarchical utilization report.
+
+    Instances are referred to by their row index.  Row 0 is the top of
+    the hierarchy.
+    '''
+
+    def __init__(self, categories):
+        self.categories = list(categories)
+        self.instances = []
+        self.modules = []
+        self.levels = array.array('l')
+        self.parents = array.array('l')
+        # Index one past the last row in the subtree of each row.
+        self.ends = array.array('l')
+        self.counts = dict(
+            (category, array.array('q')) for category in self.categories)
+
+    @classmethod
+    def from_lines(cls, lines):
+        categories, rows = parse_utilization_lines(lines)
+        table = cls(categories)
+        columns = [table.counts[category] for category in categories]
+        # The rows that are ancestors of the current row.
+        stack = []
+        for level, instance, module, counts in rows:
+            index = len(table.instances)
+            if (index == 0) and (level != 0):
+                raise ValueError('First instance must be at the top level.')
+            while stack and (table.levels[stack[-1]] >= level):
+                table.ends[stack.pop()] = index
+            table.instances.append(instance)
+            table.modules.append(module)
+            table.levels.append(level)
+            table.parents.append(stack[-1] if stack else -1)
+            table.ends.append(index + 1)
+            for column, count in zip(columns, counts):
+                column.append(count)
+            stack.append(index)
+        for index in stack:
+            table.ends[index] = len(table.instances)
+        if len(table.instances) == 0:
+            raise ValueError('No instances found in utilization report.')
+        return table
+
+    @classmethod
+    def from_file(cls, fn):
+        with open(fn, 'r') as f:
+            table = cls.from_lines(f)
+        return table
+
+    def __len__(self):
+        return len(self.instances)
+
+    def find(self, instance):
+        '''
+        Get the index of the first row with the given instance name.
+        '''
+        return self.instances.index(instance)
+
+    def children(self, index):
+        '''
+        Get the indices of the direct children of a row.
+        '''
+        children = []
+        child = index + 1
+        while child < self.ends[index]:
+            children.append(child)
+            child = self.ends[child]
+        return children
+
+    def subtree(self, index):
+        '''
+        Get the range of rows in the subtree rooted at `index` (including
+        `index` itself).
+        '''
+        return range(index, self.ends[index])
+
+    def subtree_sum(self, index, category, include_self=True):
+        '''
+        Sum a resource category over a subtree.
+
+        Note that Vivado reports the totals for an instance including its
+        children, so summing a subtree is only meaningful for rows that
+        do not overlap such as those selected by `filter_module`.
+        '''
+        start = index if include_self else index + 1
+        return sum(self.counts[category][start: self.ends[index]])
+
+    def top_n(self, category, n, level=None):
+        '''
+        Get the indices of the `n` rows using the most of a resource.
+
+        Args:
+            `category`: The resource category to sort by (e.g. 'Total LUTs').
+            `n`: The number of indices to return.
+            `level`: If specified only rows at this hierarchy level are
+                considered.
+        '''
+        column = self.counts[category]
+        if level is None:
+            indices = range(len(self))
+        else:
+            indices = [i for i, lvl in enumerate(self.levels) if lvl == level]
+        return heapq.nlargest(n, indices, key=column.__getitem__)
+
+    def filter_module(self, module_name):
+        '''
+        Get the indices of all rows whose module matches `module_name`.
+        Shell-style wildcards are supported.
+        '''
+        if any(c in module_name for c in '*?['):
+            indices = [i for i, m in enumerate(self.modules)
+                       if fnmatch.fnmatchcase(m, module_name)]
+        else:
+            indices = [i for i, m in enumerate(self.modules)
+                       if m == module_name]
+        return indices
+
+    def row(self, index):
+        '''
+        Get the utilization of a single row as a dictionary (without
+        children).
+        '''
+        ut = {
+            'Instance': self.instances[index],
+            'Module': self.modules[index],
+        }
+        for category in self.categories:
+            ut[category] = self.counts[category][index]
+        return ut
+
+    def to_dict_tree(self, index=0):
+        '''
+        Convert the subtree rooted at `index` to the nested dictionaries
+        returned by `VivadoProject.get_utilization`.
+        '''
+        uts = {}
+        for i in self.subtree(index):
+            this_ut = {
+                'Instance': self.instances[i],
+                'Module': self.modules[i],
+                'children': [],
+            }
+            for category in self.categories:
+                this_ut[category] = self.counts[category][i]
+            if i != index:
+                uts[self.parents[i]]['children'].append(this_ut)
+            uts[i] = this_ut
+        return uts[index]
@@ -0,0 +1,207 @@
+'''
+Validation of simulation output stored column by column.
+
+Rather than building a dictionary for every cycle, the output of a
+simulation is treated as a column of values per signal (for example from
+`packed_data.PackedData.column`).  Each test is compared against a slice
+of those columns.  When NumPy is available the comparison is vectorized.
+'''
+import logging
+from collections import namedtuple
+
+from pyvivado import packed_data
+
+logger = logging.getLogger(__name__)
+
+Mismatch = namedtuple('Mismatch', ['cycle', 'signal', 'expected', 'actual'])
+
+
+class ValidationException(Exception):
+
+    def __init__(self, message, n_mismatches, mismatches):
+        super().__init__(message)
+        self.n_mismatches = n_mismatches
+        self.mismatches = mismatches
+
+
+def get_column(output, signal):
+    if hasattr(output, 'column'):
+        column = output.column(signal)
+    else:
+        column = output[signal]
+    return column
+
+
+def compare_column(expected, actual, start=0, mask=None):
+    '''
+    Find the cycles where a column differs from the expected values.
+
+    Args:
+        `expected`: A sequence of expected values.
+        `actual`: A sequence of actual values covering
+            [start, start+len(expected)).
+        `start`: The cycle corresponding to the first expected value.
+        `mask`: An optional sequence of booleans.  Only cycles where it
+            is true are checked.
+
+    Returns a sequence of the failing cycles.
+    '''
+    stop = start + len(expected)
+    if len(actual) < stop:
+        raise ValueError('Output has {} cycles but {} are expected.'.format(
+            len(actual), stop))
+    numpy = packed_data.get_numpy()
+    if numpy is not None:
+        actual = numpy.asarray(actual[start: stop])
+        expected = numpy.asarray(expected, dtype=actual.dtype)
+        different = actual != expected
+        if mask is not None:
+            different &= numpy.asarray(mask, dtype=bool)
+        failing = numpy.flatnonzero(different) + start
+    else:
+        if mask is None:
+            mask = [True] * len(expected)
+        failing = [start + index for index, (e, a, m) in enumerate(
+            zip(expected, actual[start: stop], mask)) if m and (e != a)]
+    return failing
+
+
+def compare_columns(expected, output, start=0, masks=None, max_reported=10):
+    '''
+    Compare several signals against their expected values.
+
+    Args:
+        `expected`: A dictionary mapping signal names to expected values.
+        `output`: Either a dictionary mapping signal names to columns or
+            an object with a `column` method such as `PackedData`.
+        `start`: The cycle corresponding to the first expected value.
+        `masks`: An optional dictionary mapping signal names to sequences
+            of booleans selecting which cycles to check.
+        `max_reported`: The maximum number of mismatches to return.
+
+    Returns a (n_mismatches, mismatches) tuple where `mismatches` is a list
+    of the first `max_reported` `Mismatch`s ordered by cycle.
+    '''
+    if masks is None:
+        masks = {}
+    n_mismatches = 0
+    mismatches = []
+    for signal, expected_values in expected.items():
+        actual = get_column(output, signal)
+        failing = compare_column(
+            expected=expected_values, actual=actual, start=start,
+            mask=masks.get(signal, None))
+        n_mismatches += len(failing)
+        for cycle in failing[:max_reported]:
+            cycle = int(cycle)
+            mismatches.append(Mismatch(
+                cycle=cycle, signal=signal,
+                expected=expected_values[cycle - start],
+                actual=actual[cycle]))
+    mismatches.sort()
+    return n_mismatches, mismatches[:max_reported]
+
+
+def format_mismatches(n_mismatches, mismatches):
+    lines = ['{} mismatches.'.format(n_mismatches)]
+    for mismatch in mismatches:
+        lines.append('cycle {}: {} expected {} got {}'.format(
+            mismatch.cycle, mismatch.signal, mismatch.expected,
+            mismatch.actual))
+    return '\n'.join(lines)
+
+
+def get_offsets(lengths, start=0, gap=0):
+    '''
+    Get the first cycle of each test when tests of the given lengths
+    are run one after another with `gap` cycles between them.
+    '''
+    offsets = []
+    offset = start
+    for length in lengths:
+        offsets.append(offset)
+        offset += length + gap
+    return offsets
+
+
+def validate_output_columns_with_tests(tests, offsets, output,
+                                       max_reported=10):
+    '''
+    Check the output of a simulation against a list of tests.
+
+    Each test must have an `expected_columns` method returning a
+    dictionary mapping signal names to the expected values of that signal
+    for each cycle of the test.  It may also have an `expected_masks`
+    method returning a dictionary of masks selecting which cycles to
+    check.
+
+    Args:
+        `tests`: The tests that were run.
+        `offsets`: The first output cycle of each test.
+        `output`: The simulation output (see `compare_columns`).
+        `max_reported`: The maximum number of mismatches reported for each
+            test.
+
+    Raises a `ValidationException` if any tests fail.
+    '''
+    failures = []
+    total_mismatches = 0
+    all_mismatches = []
+    for index, (test, offset) in enumerate(zip(tests, offsets)):
+        if hasattr(test, 'expected_masks'):
+            masks = test.expected_masks()
+        else:
+            masks = None
+        n_mismatches, mismatches = compare_columns(
+            expected=test.expected_columns(), output=output, start=offset,
+            masks=masks, max_reported=max_reported)
+        if n_mismatches:
+            failures.append('Test {} ({}): {}'.format(
+                index, type(test).__name__,
+                format_mismatches(n_mismatches, mismatches)))
+            total_mismatches += n_mismatches
+            all_mismatches += mismatches
+    if failures:
+        message = '\n'.join(failures)
+        logger.error(message)
+        raise ValidationException(message, total_mismatches, all_mismatches)
+
+
+def get_test_lengths(tests):
+    '''
+    Get the number of cycles each test covers from the length of its
+    expected columns.  This is only the number of cycles the test takes if
+    it expects output on every cycle of its input.
+    '''
+    lengths = []
+    for test in tests:
+        columns = test.expected_columns()
+        lengths.append(max([len(values) for values in columns.values()] + [0]))
+    return lengths
+
+
+def validate_consecutive_tests(tests, output, start=0, gap=0,
+                               max_reported=10, lengths=None):
+    '''
+    Check the output of a simulation against a list of tests that were run
+    one after another with `gap` cycles between them.
+
+    Args:
+        `tests`: The tests that were run.
+        `output`: The simulation output (see `compare_columns`), for
+            example a `packed_data.PackedData` of the output file.
+        `start`: The output cycle of the first cycle of the first test.
+        `gap`: The number of cycles between tests.
+        `max_reported`: The maximum number of mismatches reported for each
+            test.
+        `lengths`: The number of cycles each test takes.  Defaults to the
+            lengths from `get_test_lengths`.
+
+    Raises a `ValidationException` if any tests fail.
+    '''
+    if lengths is None:
+        lengths = get_test_lengths(tests)
+    offsets = get_offsets(lengths, start=start, gap=gap)
+    validate_output_columns_with_tests(
+        tests=tests, offsets=offsets, output=output,
+        max_reported=max_reported)
@@ -1,22 +1,15 @@
 import os
+import re
+import glob
 import logging
+import hashlib
 import shutil
 import time
 
-import fusesoc_generators
-from axilent import handlers
-import slvcodec
-
-from pyvivado import jtagtestbench_generator
 from pyvivado import boards, tasks_collection, hash_helper, config
 from pyvivado import params_helper, vivado_task, task, base_project
-
-# Want to be able to use when redis not available
-try:
-    from pyvivado import redis_utils
-    from pyvivado import connection
-except ImportError:
-    redis_utils = 'Failed to import redis_utils and connection'
+from pyvivado import utilization, locks, sim_library
+from pyvivado import redis_utils, connection, leases, hw_session
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +22,40 @@ def make_clock_constraint(fn, clock_name, frequency):
         f.write(constraint)
 
 
+def get_ip_key(ip_name, ip_version, module_name, ip_properties):
+    '''
+    A key identifying an IP configuration in the shared IP cache.
+    The Vivado version and the part are added to the path of the cache
+    entry by the Vivado process since they are only known there.
+    '''
+    properties = sorted([(str(k), str(v)) for k, v in ip_properties.items()])
+    description = str((ip_name, ip_version, module_name, properties))
+    return hashlib.sha1(description.encode('ascii')).hexdigest()
+
+
+def get_ip_entry_directory(ip_cache_dir, vivado_version, part, ip_key):
+    '''
+    The directory of an IP in the shared IP cache.  Generated IP depends on
+    the Vivado version and the part as well as on its configuration.
+    '''
+    vivado_version = re.sub(r'[^\w.-]+', '_', vivado_version)
+    return os.path.join(ip_cache_dir, vivado_version, part, ip_key)
+
+
+def copy_cached_ip(entry_directory, module_name, directory):
+    '''
+    Copy an IP from the shared IP cache into a project so that the project
+    never modifies the cache entry.
+
+    Returns the copied xci file.
+    '''
+    destination = os.path.join(directory, 'cached_ip', module_name)
+    if os.path.exists(destination):
+        shutil.rmtree(destination)
+    shutil.copytree(os.path.join(entry_directory, module_name), destination)
+    return os.path.join(destination, '{}.xci'.format(module_name))
+
+
 class VivadoProject(object):
     '''
     The base class for python wrappers around Vivado Projects.
@@ -36,20 +63,10 @@ class VivadoProject(object):
     Also does some management of Vivado processes (`Task`s) that are run.
     '''
 
-    def get_creation_status(self):
-        creation_fn = os.path.join(self.directory, 'creation.txt')
-        try:
-            with open(creation_fn, 'x') as f:
-                f.write('CREATING')
-                status = 'DOCREATE'
-        except FileExistsError:
-            with open(creation_fn, 'r') as f:
-                status = f.readline()
-        return status
-
     def __init__(self, project, part=None, board=None, overwrite_ok=False,
                  use_without_refresh=False, wait_for_creation=False, out_of_context=False,
-                 frequency=None, frequency_b=None, clock_name=None):
+                 frequency=None, frequency_b=None, clock_name=None,
+                 ip_cache_dir=config.ip_cache_directory):
         '''
         Create a new Vivado project.
 
@@ -57,6 +74,9 @@ class VivadoProject(object):
             `project`: A BaseProject that we want to create a vivado project based upon.
             `part`: The 'part' to use when implementing.
             `board`: The 'board' to used when implementing.
+            `ip_cache_dir`: A directory where generated and synthesized IP
+                is shared between projects.  If None each project generates
+                its own IP.
 
         Returns:
             A python `VivadoProject` object that wraps a Vivado project.
@@ -66,84 +86,97 @@ class VivadoProject(object):
         logger.debug('Initialize vivado project.')
         self.project = project
         self.directory = self.directory_from_project(project)
-        self.out_of_context = out_of_context
-        task_0_dir = os.path.join(self.directory, 'task_0')
-        self.new = True
-        if os.path.exists(task_0_dir):
-            task_0 = task.Task(task_0_dir)
-            if task_0.is_finished():
-                self.new = False
-
-        self.filename = os.path.join(self.directory, 'TheProject.xpr')
-        if not self.new:
-            if not os.path.exists(self.filename):
-                max_waits = 30
-                n_waits = 0
-                while ((not os.path.exists(self.filename)) and
-                       (n_waits < max_waits)):
-                    time.sleep(1)
-                    n_waits += 1
-                if n_waits >= max_waits:
+        self.ip_cache_dir = ip_cache_dir
+        # Take the project lock.  If another process is creating the
+        # project this blocks until the creation has finished.
+        lock = locks.FileLock(self.lock_fn(project))
+        lock.acquire()
+        lock_handed_over = False
+        try:
+            self.out_of_context = out_of_context
+            task_0_dir = os.path.join(self.directory, 'task_0')
+            self.new = True
+            if os.path.exists(task_0_dir):
+                task_0 = task.Task(task_0_dir)
+                if task_0.is_finished():
+                    self.new = False
+
+            self.filename = os.path.join(self.directory, 'TheProject.xpr')
+            if not self.new:
+                if not os.path.exists(self.filename):
                     raise Exception('Directory exists, but project file does not.')
 
-        params_fn = os.path.join(self.directory, 'params.txt')
-        self.params_helper = params_helper.ParamsHelper(params_fn)
-        old_params = self.params_helper.read()
-        if old_params is not None:
-            if part is None:
-                part = old_params['part']
-            if board is None:
-                board = old_params['board']
-        new_params = {
-            'part': part,
-            'board': board,
-            }
-        refresh = False
-        if old_params is not None:
-            if not old_params == new_params:
+            params_fn = os.path.join(self.directory, 'params.txt')
+            self.params_helper = params_helper.ParamsHelper(params_fn)
+            old_params = self.params_helper.read()
+            if old_params is not None:
+                if part is None:
+                    part = old_params['part']
+                if board is None:
+                    board = old_params['board']
+            new_params = {
+                'part': part,
+                'board': board,
+                }
+            refresh = False
+            if old_params is not None:
+                if not old_params == new_params:
+                    if not overwrite_ok:
+                        raise Exception('Part or Board have changed. {} -> {}'.format(
+                            old_params, new_params))
+                    else:
+                        refresh = True
+            else:
+                if not self.new:
+                    import pdb
+                    pdb.set_trace()
+                    raise Exception('No Part or Board parameters found for existing vivado project.')
+            self.part = part
+            self.board = board
+            self.hash_helper = hash_helper.HashHelper(self.directory, self.project.get_hash)
+            if (not self.new) and self.hash_helper.is_changed():
                 if not overwrite_ok:
-                    raise Exception('Part or Board have changed. {} -> {}'.format(
-                        old_params, new_params))
+                    if not use_without_refresh:
+                        raise Exception('Hash has changed in project but overwrite is not allowed.')
                 else:
                     refresh = True
-        else:
-            if not self.new:
-                import pdb
-                pdb.set_trace()
-                raise Exception('No Part or Board parameters found for existing vivado project.')
-        self.part = part
-        self.board = board
-        self.hash_helper = hash_helper.HashHelper(self.directory, self.project.get_hash)
-        if (not self.new) and self.hash_helper.is_changed():
-            if not overwrite_ok:
-                if not use_without_refresh:
-                    raise Exception('Hash has changed in project but overwrite is not allowed.')
-            else:
-                refresh = True
-        if refresh:
-            shutil.rmtree(self.directory)
-            logger.debug('Deleting old vivado project directory.')
-        self.tasks_collection = tasks_collection.TasksCollection(
-            self.directory, task_type=vivado_task.VivadoTask)
-        if self.new or refresh:
-            logger.debug('Making new vivado project directory')
-            os.mkdir(self.directory)
-            self.params_helper.write(new_params)
-            self.hash_helper.write()
-
-            if self.out_of_context and frequency and clock_name:
-                fn = os.path.join(self.directory, 'clock_constraint.xdc')
-                make_clock_constraint(fn, clock_name, frequency)
-                self.additional_constraint_files = [fn]
+            if refresh:
+                shutil.rmtree(self.directory)
+                logger.debug('Deleting old vivado project directory.')
+            self.tasks_collection = tasks_collection.TasksCollection(
+                self.directory, task_type=vivado_task.VivadoTask)
+            if self.new or refresh:
+                logger.debug('Making new vivado project directory')
+                os.mkdir(self.directory)
+                self.params_helper.write(new_params)
+                self.hash_helper.write()
+
+                if self.out_of_context and frequency and clock_name:
+                    fn = os.path.join(self.directory, 'clock_constraint.xdc')
+                    make_clock_constraint(fn, clock_name, frequency)
+                    self.additional_constraint_files = [fn]
+                else:
+                    self.additional_constraint_files = []
+
+                logger.debug('launching create task')
+                self.create_task = self.launch_create_task()
+                if wait_for_creation:
+                    self.create_task.wait()
+                else:
+                    # Keep the lock until the creating Vivado process exits
+                    # so that other processes block until the project has
+                    # been created.
+                    locks.release_after([lock], self.create_task.process.wait)
+                    lock_handed_over = True
             else:
-                self.additional_constraint_files = []
+                self.create_task = None
+        finally:
+            if not lock_handed_over:
+                lock.release()
 
-            logger.debug('launching create task')
-            self.create_task = self.launch_create_task()
-            if wait_for_creation:
-                self.create_task.wait()
-        else:
-            self.create_task = None
+    @classmethod
+    def lock_fn(cls, project):
+        return project.creation_lock_fn()
 
     @classmethod
     def directory_from_project(cls, project):
@@ -152,7 +185,13 @@ class VivadoProject(object):
     @staticmethod
     def make_create_vivado_project_command(
             directory, design_files, simulation_files, ips, part, board,
-            top_module, out_of_context):
+            top_module, out_of_context, cached_xcis=None):
+        '''
+        `cached_xcis` maps the module names of IP copied from the IP cache
+        to their xci files.  Other IP is generated in the project.
+        '''
+        if cached_xcis is None:
+            cached_xcis = {}
         # Format the IP infomation into a TCL-friendly format.
         tcl_ips = []
         for ip_name, ip_properties, module_name in ips:
@@ -162,7 +201,8 @@ class VivadoProject(object):
                 module_name=module_name)
             tcl_properties = ' '.join(
                 ['{{ {} {} }}'.format(k, v) for k, v in ip_properties.items()])
-            tcl_ip = '{} {{ {} }}'.format(tcl_start, tcl_properties)
+            tcl_ip = '{} {{ {} }} {{{}}}'.format(
+                tcl_start, tcl_properties, cached_xcis.get(module_name, ''))
             tcl_ips.append(tcl_ip)
         tcl_ips = ' '.join(['{{ {} }}'.format(ip) for ip in tcl_ips])
         # Fail if a project already exists in this directory.
@@ -215,6 +255,97 @@ class VivadoProject(object):
         )
         return command
 
+    def get_part(self):
+        '''
+        The part the project is implemented on or None if only a board
+        unknown to `boards` was given.
+        '''
+        if self.board in boards.params:
+            return boards.params[self.board]['part']
+        return self.part
+
+    def generate_cached_ip(self, entry_directory, ip_name, ip_properties,
+                           module_name):
+        '''
+        Generate and synthesize an IP into an entry of the IP cache.
+        The caller must hold the exclusive lock on the entry.
+        '''
+        if os.path.exists(entry_directory):
+            shutil.rmtree(entry_directory)
+        os.makedirs(entry_directory)
+        board = boards.params.get(self.board, {}).get('xilinx_name', self.board)
+        command = '''::pyvivado::generate_cached_ip {{{entry_directory}}} {{{part}}} {{{board}}} {ip_name} {{}} {module_name} {{ {properties} }}'''.format(
+            entry_directory=entry_directory, part=self.get_part(),
+            board='' if board is None else board, ip_name=ip_name,
+            module_name=module_name,
+            properties=' '.join(['{{ {} {} }}'.format(k, v)
+                                 for k, v in ip_properties.items()]),
+        )
+        ip_tasks_dir = os.path.join(self.directory, 'ip_tasks')
+        os.makedirs(ip_tasks_dir, exist_ok=True)
+        t = vivado_task.VivadoTask.create(
+            collection=tasks_collection.TasksCollection(
+                ip_tasks_dir, task_type=vivado_task.VivadoTask),
+            description='Generating {} into the IP cache.'.format(module_name),
+            command_text=command,
+        )
+        t.run_and_wait()
+
+    def get_cached_ip(self, ip_name, ip_properties, module_name, part,
+                      vivado_version):
+        '''
+        Copy an IP from the IP cache into the project, generating it into
+        the cache first if it is missing.
+
+        Cache entries are checked under a shared lock so that projects
+        using IP that is already cached do not wait for each other.  The
+        exclusive lock is only taken for a missing IP and only while it
+        is being generated.
+
+        Returns the copied xci file.
+        '''
+        ip_key = get_ip_key(ip_name, '', module_name, ip_properties)
+        entry_directory = get_ip_entry_directory(
+            self.ip_cache_dir, vivado_version, part, ip_key)
+        done_fn = os.path.join(entry_directory, 'done.txt')
+        lock_fn = '{}.lock'.format(entry_directory)
+        os.makedirs(os.path.dirname(entry_directory), exist_ok=True)
+        with locks.FileLock(lock_fn, shared=True):
+            if os.path.exists(done_fn):
+                logger.debug('Using cached IP {} from {}.'.format(
+                    module_name, entry_directory))
+                return copy_cached_ip(
+                    entry_directory, module_name, self.directory)
+        with locks.FileLock(lock_fn):
+            # Another project may have generated it while we waited.
+            if not os.path.exists(done_fn):
+                logger.debug('Generating IP {} into {}.'.format(
+                    module_name, entry_directory))
+                self.generate_cached_ip(
+                    entry_directory, ip_name, ip_properties, module_name)
+            return copy_cached_ip(entry_directory, module_name, self.directory)
+
+    def get_cached_ips(self, ips):
+        '''
+        Copy the project's IP from the IP cache.  Returns a dictionary
+        mapping module names to xci files.  It is empty if the IP cache is
+        disabled or the part is unknown.
+        '''
+        cached_xcis = {}
+        if (self.ip_cache_dir is None) or (not ips):
+            return cached_xcis
+        part = self.get_part()
+        if part is None:
+            logger.warning('Not using the IP cache since the part is unknown.')
+            return cached_xcis
+        vivado_version = sim_library.get_vivado_version()
+        for ip_name, ip_properties, module_name in ips:
+            cached_xcis[module_name] = self.get_cached_ip(
+                ip_name=ip_name, ip_properties=ip_properties,
+                module_name=module_name, part=part,
+                vivado_version=vivado_version)
+        return cached_xcis
+
     def launch_create_task(self):
         design_files = self.project.files_and_ip['design_files']
         if self.additional_constraint_files:
@@ -222,9 +353,13 @@ class VivadoProject(object):
         simulation_files = self.project.files_and_ip['simulation_files']
         ips = self.project.files_and_ip['ips']
         top_module = self.project.files_and_ip['top_module']
+        # Missing IP is generated into the cache before the project is
+        # created.
+        cached_xcis = self.get_cached_ips(ips)
         command = self.make_create_vivado_project_command(
             self.directory, design_files, simulation_files,
-            ips, self.part, self.board, top_module, self.out_of_context)
+            ips, self.part, self.board, top_module, self.out_of_context,
+            cached_xcis=cached_xcis)
         logger.debug('Command is {}'.format(command))
         logger.debug('Directory of new project is {}.'.format(self.directory))
         # Create a task to create the project.
@@ -264,40 +399,26 @@ class VivadoProject(object):
                     pwers[bits[1]] = float(bits[2])
         return pwers
 
-    def get_utilization(self, from_synthesis=False):
+    def get_utilization(self, from_synthesis=False, columnar=False):
+        '''
+        Get the hierarchical utilization of the project.
+
+        Args:
+            `from_synthesis`: Use the synthesis rather than the implementation
+                report.
+            `columnar`: Return a `utilization.UtilizationTable` rather than
+                a tree of dictionaries.  This is much more compact for deep
+                hierarchies.
+        '''
         fn = self.utilization_file(from_synthesis=from_synthesis)
         if not os.path.exists(fn):
             t = self.generate_reports(from_synthesis=from_synthesis)
             t.wait()
             t.log_messages(t.get_messages())
-        parents = []
-        with open(fn, 'r') as f:
-            found_hier = False
-            for line in f:
-                if not found_hier:
-                    bits = [s.strip() for s in line.split('|')]
-                    if (len(bits) > 1) and (bits[1] == 'Instance'):
-                        categories = bits[3: -1]
-                        found_hier = True
-                else:
-                    bits = line.split('|')
-                    if len(bits) > 2:
-                        hier_level = (len(bits[1]) - len(bits[1].lstrip()) - 1)//2
-                        this_ut = {
-                            'Instance': bits[1].strip(),
-                            'Module': bits[2].strip(),
-                            'children': [],
-                        }
-                        for index, category in enumerate(categories):
-                            this_ut[category] = int(bits[index+3].strip())
-                        if len(parents) == 0:
-                            assert(hier_level == 0)
-                            parents = [this_ut]
-                        else:
-                            parent = parents[hier_level-1]
-                            parent['children'].append(this_ut)
-                            parents = parents[:hier_level] + [this_ut]
-        return parents[0]
+        table = utilization.UtilizationTable.from_file(fn)
+        if columnar:
+            return table
+        return table.to_dict_tree()
 
     def synthesize(self, keep_hierarchy=False):
         '''
@@ -345,6 +466,49 @@ class VivadoProject(object):
         t.run()
         return t
 
+    def get_ip_keys(self):
+        return [get_ip_key(ip_name, '', module_name, ip_properties)
+                for ip_name, ip_properties, module_name
+                in self.project.files_and_ip['ips']]
+
+    def get_sim_library(self):
+        '''
+        Get the directory of the precompiled simulation library for the
+        project's IP, compiling it if it is not already in the cache.
+
+        Returns a (errors, directory) tuple.  `directory` is None if the
+        project has no IP or the library cache is disabled.
+        '''
+        ip_keys = self.get_ip_keys()
+        if (not ip_keys) or (config.sim_library_directory is None):
+            return [], None
+        cache = sim_library.SimLibraryCache()
+        key = sim_library.get_library_key(
+            sim_library.get_vivado_version(), ip_keys)
+        directory = cache.get_library(key)
+        if directory is not None:
+            logger.debug('Reusing simulation library {}.'.format(key))
+            return [], directory
+        temp_directory = cache.make_temp_directory(key)
+        t = vivado_task.VivadoTask.create(
+            collection=self.tasks_collection,
+            description='Compiling a simulation library.',
+            command_text='::pyvivado::open_and_compile_sim_library {{{}}} {{{}}}'.format(
+                self.directory, temp_directory),
+        )
+        t.run()
+        try:
+            t.wait(raise_errors=False)
+        except Exception:
+            cache.discard(temp_directory)
+            raise
+        errors = t.get_errors()
+        if errors:
+            cache.discard(temp_directory)
+        else:
+            directory = cache.commit(key, temp_directory)
+        return errors, directory
+
     def run_simulation(self, test_name, test_bench_name, runtime, sim_type='hdl'):
         '''
         Spawns a vivado process that will run a simulation of the project.
@@ -361,9 +525,20 @@ class VivadoProject(object):
             `output_data`: A list of dictionaries of the output wire values.
         '''
         simulation_files = self.project.file_helper.read()['simulation_files']
+        errors, sim_library_dir = self.get_sim_library()
+        if errors:
+            return errors
+        if sim_library_dir is None:
+            sim_library_dir = ''
+        # Compiled simulations are only reused if they were compiled from
+        # the same sources against the same library.
+        h = hashlib.sha1(self.project.get_hash())
+        h.update(test_bench_name.encode('ascii'))
+        h.update(sim_library_dir.encode('utf-8'))
+        sources_hash = h.hexdigest()
         command_template = '''
 open_project {{{project_filename}}}
-::pyvivado::run_{sim_type}_simulation {{{directory}}} {{{test_name}}} {{{test_bench_name}}} {{{runtime}}} {{ {simulation_files} }}
+::pyvivado::run_{sim_type}_simulation {{{directory}}} {{{test_name}}} {{{test_bench_name}}} {{{runtime}}} {{ {simulation_files} }} {{{sources_hash}}} {{{sim_library_dir}}}
 '''
         command = command_template.format(
             project_filename=self.filename, runtime=runtime, sim_type=sim_type,
@@ -372,6 +547,8 @@ open_project {{{project_filename}}}
             directory=self.directory.replace('\\', '/'),
             simulation_files=' '.join([
                 '{'+f+'}' for f in simulation_files]),
+            sources_hash=sources_hash,
+            sim_library_dir=sim_library_dir,
             )
         # Create a task to run the simulation.
         t = vivado_task.VivadoTask.create(
@@ -407,27 +584,135 @@ open_project {{{project_filename}}}
             raise Exception('Failed to deploy project')
         return hwcode
 
-    def wait_for_monitor(self, hwcode, monitor_task):
-        max_waits = 120
+    def wait_for_monitor(self, hwcode, monitor_task, poll_interval=0.1):
+        max_waits = 120 / poll_interval
         n_waits = 0
         # Check to see that correct proj_dir is associated with the hwcode
         # and that it has been monitored recently.
         def checks_out():
-            projdir_correct = (self.directory == connection.get_hwcode_projdir(hwcode))
-            active = redis_utils.hwcode_A_active(hwcode)
+            status = redis_utils.hwcode_status(hwcode)
+            projdir_correct = (self.directory == status.projdir)
+            active = redis_utils.is_active(status.last_A)
             return projdir_correct and active
         while (not checks_out()) and (n_waits < max_waits) and (not monitor_task.is_finished()):
             n_waits += 1
-            time.sleep(1)
+            time.sleep(poll_interval)
         # If the task is finished something must have gone wrong
         # so log it's messages.
         if monitor_task.is_finished():
             monitor_task.log_messages(monitor_task.get_messages())
         deploy_errors = monitor_task.get_errors()
-        logger.debug('Waited {}s to see deployment'.format(n_waits))
+        logger.debug('Waited {:.1f}s to see deployment'.format(n_waits * poll_interval))
         if (len(deploy_errors) != 0):
             raise Exception('Got send_to_fpga_and_monitor errors.')
 
+    def bitstream_file(self):
+        '''
+        The implemented bitstream or None if there is none.
+        '''
+        bitstreams = glob.glob(os.path.join(
+            self.directory, 'TheProject.runs', 'impl_1', '*.bit'))
+        if bitstreams:
+            fn = sorted(bitstreams)[0]
+        else:
+            fn = None
+        return fn
+
+    def get_bitstream_hash(self):
+        '''
+        A hash of the contents of the bitstream, or None if there is no
+        bitstream.  FPGAs record the hash of the bitstream they were
+        programmed with so that it is not sent again.
+        '''
+        fn = self.bitstream_file()
+        if fn is None:
+            return None
+        h = hashlib.sha1()
+        with open(fn, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def start_hw_session(self, hwcode, poll_interval=0.1, max_wait=120):
+        '''
+        Start a hardware session for an FPGA (see `hw_session`) and wait
+        until it is serving requests.
+        '''
+        hwtarget, jtagfreq = config.hwtargets[hwcode]
+        t = vivado_task.VivadoTask.create(
+            collection=self.tasks_collection,
+            command_text='::pyvivado::hw_session {} {} {} 0'.format(
+                hwcode, hwtarget, int(jtagfreq)),
+            description='Hardware session for {}.'.format(hwcode),
+        )
+        t.run()
+        session = hw_session.HardwareSession(hwcode)
+        n_waits = 0
+        while ((not session.is_alive()) and (n_waits < max_wait / poll_interval)
+               and (not t.is_finished())):
+            n_waits += 1
+            time.sleep(poll_interval)
+        if not session.is_alive():
+            t.log_messages(t.get_messages())
+            raise Exception('Failed to start a hardware session for {}.'.format(hwcode))
+        return session
+
+    def get_hw_session(self, hwcode):
+        '''
+        Get the hardware session for an FPGA.  If there is none, one is
+        started if `config.hw_sessions` is set and otherwise we return
+        None.  A running session must be used since it holds the FPGA's
+        JTAG connection.
+        '''
+        session = hw_session.HardwareSession(hwcode)
+        if not session.is_alive():
+            if config.hw_sessions:
+                session = self.start_hw_session(hwcode)
+            else:
+                session = None
+        return session
+
+    def monitor_leased(self, lease, command_text, description, session_request=None):
+        '''
+        Start monitoring the leased FPGA and wait for the monitor to start.
+        The lease is released if it fails.
+
+        The monitor is started by `session_request` (a tuple of the
+        arguments to `HardwareSession.request`) if the FPGA has a hardware
+        session and otherwise by a Vivado task running `command_text`.
+
+        Returns a (t, conn) tuple (see `send_to_fpga_and_monitor`).
+        '''
+        lease.keep_alive()
+        try:
+            session = None
+            if session_request is not None:
+                session = self.get_hw_session(lease.hwcode)
+            if session is not None:
+                t = session.request(*session_request)
+            else:
+                t = vivado_task.VivadoTask.create(
+                    collection=self.tasks_collection,
+                    command_text=command_text,
+                    description=description,
+                )
+                t.run()
+            self.wait_for_monitor(hwcode=lease.hwcode, monitor_task=t)
+        except:
+            lease.release()
+            raise
+        # Create a Connection object for communication with the FPGA.
+        conn = connection.get_connection(lease.hwcode, lease=lease)
+        return t, conn
+
+    def monitor_command(self, hwcode):
+        '''
+        The TCL command that monitors an FPGA that is already programmed.
+        '''
+        hwtarget, jtagfreq = config.hwtargets[hwcode]
+        return '::pyvivado::monitor_redis {} {} {:0} 0 {}'.format(
+            hwcode, hwtarget, int(jtagfreq), connection.get_monitor_args(hwcode))
+
     def monitor_existing(self):
         '''
         Find an FPGA running this project that is not already monitored, and start
@@ -441,26 +726,31 @@ open_project {{{project_filename}}}
         hwcode = redis_utils.get_unmonitored_projdir_hwcode(self.directory)
         if hwcode is None:
             raise Exception('No free hardware running this project found.')
-        hwtarget, jtagfreq = config.hwtargets[hwcode]
-        description = 'Monitor Redis connection and pass command to FPGA.'
-        t = vivado_task.VivadoTask.create(
-            collection=self.tasks_collection,
-            command_text='::pyvivado::monitor_redis {} {} {:0} 0'.format(hwcode, hwtarget, int(jtagfreq)),
-            description=description,
-        )
-        t.run()
-        self.wait_for_monitor(hwcode=hwcode, monitor_task=t)
-        conn = connection.Connection(hwcode)
-        return t, conn
-
-
-    def send_to_fpga_and_monitor(self, fake=False):
+        lease = leases.Lease(hwcode)
+        if not lease.acquire():
+            raise Exception('Hardware {} is leased by another job.'.format(hwcode))
+        return self.monitor_leased(
+            lease, command_text=self.monitor_command(hwcode),
+            description='Monitor for commands and pass them to the FPGA.',
+            session_request=('M',) + connection.get_monitor_transport(hwcode))
+
+    def send_to_fpga_and_monitor(self, fake=False, timeout=None, priority=0):
         '''
         Send the bitstream of this project to an FPGA and start
         monitoring that FPGA.
 
+        If no FPGA is free we wait in line for one (see
+        `leases.acquire_board`) for up to `timeout` seconds.  Closing the
+        returned connection releases the FPGA.
+
+        A free FPGA that is already programmed with the same bitstream is
+        preferred, and is then just monitored rather than programmed
+        again.  If the FPGA has a hardware session (see `hw_session`) it
+        does the programming and monitoring.
+
         Returns a (t, conn) tuple where:
-            `t`: is the `Task` wrapping the Vivado process monitoring the FPGA, and
+            `t`: is the `Task` wrapping the Vivado process monitoring the FPGA
+                 (or the `hw_session.SessionRequest` if a session is used), and
             `conn`: is the `Connection` with which this python process can
                  communicate the monitor.
         '''
@@ -469,42 +759,60 @@ open_project {{{project_filename}}}
             connection.kill_free_monitors(self.directory)
             fake_int = 1
             description = 'Faking sending the project to fpga and monitoring.'
+            # Nothing is programmed so there is nothing to reuse.
+            bitstream_hash = None
         else:
             fake_int = 0
             description = 'Sending project to fpga and monitoring.'
+            bitstream_hash = self.get_bitstream_hash()
         # Get the hardware code for an unmonitored FPGA.
         self.params = self.params_helper.read()
-        hwcode = redis_utils.get_free_hwcode(self.params['board'])
-        if hwcode is None:
-            raise Exception('No free hardware found.')
-        hwtarget, jtagfreq = config.hwtargets[hwcode]
+        lease = leases.acquire_board(
+            self.params['board'], timeout=timeout, priority=priority,
+            bitstream=bitstream_hash)
+        hwcode = lease.hwcode
         logger.info('Using hardware: {}'.format(hwcode))
-        # Spawn a Vivado process to deploy the bitstream and
-        # start monitoring.
-        t = vivado_task.VivadoTask.create(
-            collection=self.tasks_collection,
-            command_text='::pyvivado::send_to_fpga_and_monitor {{{}}} {} {} {} {}'.format(
-                self.directory, hwcode, hwtarget, int(jtagfreq), fake_int),
-            description=description,
-        )
-        t.run()
-        # Wait for the task to start monitoring and get the
-        # hardware code of the free fpga.
-        self.wait_for_monitor(hwcode=hwcode, monitor_task=t)
-        # Create a Connection object for communication with the FPGA/
-        conn = connection.Connection(hwcode)
-        return t, conn
+        try:
+            # Now that we hold the lease nobody else can reprogram it.
+            running = (bitstream_hash is not None) and (
+                redis_utils.hwcode_status(hwcode).bitstream == bitstream_hash)
+            transport = connection.get_monitor_transport(hwcode)
+            if running:
+                logger.info('{} is already running this bitstream.'.format(hwcode))
+                redis_utils.set_hwcode_projdir(hwcode, self.directory)
+                command_text = self.monitor_command(hwcode)
+                description = 'Monitor for commands and pass them to the FPGA.'
+                session_request = ('M',) + transport
+            else:
+                # Spawn a Vivado process to deploy the bitstream and
+                # start monitoring.
+                hwtarget, jtagfreq = config.hwtargets[hwcode]
+                command_text = '::pyvivado::send_to_fpga_and_monitor {{{}}} {} {} {} {} {} {{{}}}'.format(
+                    self.directory, hwcode, hwtarget, int(jtagfreq), fake_int,
+                    connection.get_monitor_args(hwcode), bitstream_hash or '')
+                session_request = ('D', self.directory, bitstream_hash or '') + transport
+            if fake:
+                # Sessions talk to real FPGAs.
+                session_request = None
+        except:
+            lease.release()
+            raise
+        return self.monitor_leased(
+            lease, command_text=command_text, description=description,
+            session_request=session_request)
 
     def implement_deploy_and_run_tests(self, tests):
+        from axilent import handlers
         t_implement = self.implement()
         t_implement.wait()
         t_monitor, conn = self.send_to_fpga_and_monitor()
-
+        # Coalesce the tests' commands into scripts run by the monitor.
+        conn = connection.BatchingConnection(conn)
         handler = handlers.ConnCommandHandler(conn)
         for test in tests:
             test.prepare(handler)
+            conn.flush()
             test.check()
-        # Sleep for 10 seconds so that we can kill monitor
-        time.sleep(10)
-        # Destroy monitoring process
-        connection.kill_free_monitors(self.directory)
+        # Stop the monitor and release the FPGA.
+        conn.kill_monitor()
+        conn.close()
@@ -64,11 +64,9 @@ class VivadoTask(task.Task):
         '''
         Spawn the process that will run the vivado process.
         '''
-        cwd = os.getcwd()
-        os.chdir(self.directory)
-        stdout_fn = 'stdout.txt' 
-        stderr_fn = 'stderr.txt' 
-        command_fn = 'command.tcl' 
+        stdout_fn = os.path.join(self.directory, 'stdout.txt')
+        stderr_fn = os.path.join(self.directory, 'stderr.txt')
+        command_fn = os.path.join(self.directory, 'command.tcl')
         if os.name == 'nt':
             commands = [config.vivado, '-log', stdout_fn, '-mode', 'batch',
                         '-source', command_fn]
@@ -80,6 +78,7 @@ class VivadoTask(task.Task):
                 # in Windows.
                 # Commented out because doesn't seem to be working now.
                 creationflags=subprocess.CREATE_NEW_CONSOLE,
+                cwd=self.directory,
             )
             logger.debug('started process')
         else:
@@ -87,4 +86,3 @@ class VivadoTask(task.Task):
                         command_fn]
             self.launch_unix_subprocess(
                 commands, stdout_fn=stdout_fn, stderr_fn=stderr_fn)
-        os.chdir(cwd)
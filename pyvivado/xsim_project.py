@@ -0,0 +1,351 @@
+'''
+Run simulations directly with xvhdl/xvlog, xelab and xsim.
+
+Opening a Vivado project and using `launch_simulation` costs a full Vivado
+startup for every simulation.  For a behavioral simulation of plain HDL
+files that is unnecessary.  An `XSimProject` compiles and elaborates the
+files in a project's `files_and_ip.txt` once into a snapshot and then runs
+`xsim` in batch mode against that snapshot for each test.
+
+Test benches exchange data with python through packed files (see
+`packed_data`).  `packed_io.vhd` is compiled with every snapshot and
+`run_simulation` writes the input records to `INPUT_FILENAME` and reads
+the records the test bench writes to `OUTPUT_FILENAME`.
+'''
+import os
+import logging
+import hashlib
+import shlex
+import shutil
+
+from pyvivado import config, utils, params_helper, disk_cache, packed_data
+from pyvivado import tasks_collection, shell_task, vivado_task
+
+logger = logging.getLogger(__name__)
+
+VHDL_EXTENSIONS = ('.vhd', '.vhdl')
+VERILOG_EXTENSIONS = ('.v',)
+SYSTEMVERILOG_EXTENSIONS = ('.sv',)
+HEADER_EXTENSIONS = ('.vh', '.svh')
+
+# The files a file-based testbench reads from and writes to, relative to
+# the directory xsim runs in.
+INPUT_FILENAME = 'input.data'
+OUTPUT_FILENAME = 'output.data'
+
+
+class XSimTask(shell_task.ShellTask):
+    '''
+    A shell task running the standalone Vivado simulator tools.
+    Their messages are formatted the same way as Vivado's.
+    '''
+    MESSAGE_MAPPING = vivado_task.VivadoTask.MESSAGE_MAPPING
+    DEFAULT_FAILURE_MESSAGE_TYPES = (
+        vivado_task.VivadoTask.DEFAULT_FAILURE_MESSAGE_TYPES)
+
+    def get_errors(
+            self, failure_message_types=DEFAULT_FAILURE_MESSAGE_TYPES):
+        return super().get_errors(failure_message_types=failure_message_types)
+
+
+def get_compile_commands(filenames):
+    '''
+    Get the commands to compile the HDL files into the `work` library.
+    Consecutive files of the same language are compiled with a single
+    command.  Verilog headers are not compiled but their directories are
+    added to the include path.  Files that are not HDL (e.g. constraints)
+    are ignored.
+    '''
+    include_dirs = []
+    for fn in filenames:
+        if os.path.splitext(fn)[1].lower() in HEADER_EXTENSIONS:
+            include_dir = os.path.dirname(fn) or '.'
+            if include_dir not in include_dirs:
+                include_dirs.append(include_dir)
+    includes = []
+    for include_dir in include_dirs:
+        includes += ['--include', include_dir]
+    commands = []
+    last_tool = None
+    for fn in filenames:
+        extension = os.path.splitext(fn)[1].lower()
+        if extension in VHDL_EXTENSIONS:
+            tool = [config.xvhdl]
+        elif extension in VERILOG_EXTENSIONS:
+            tool = [config.xvlog] + includes
+        elif extension in SYSTEMVERILOG_EXTENSIONS:
+            tool = [config.xvlog, '--sv'] + includes
+        else:
+            logger.debug('Not compiling {} for xsim.'.format(fn))
+            continue
+        if tool != last_tool:
+            commands.append(tool + ['--work', 'work'])
+            last_tool = tool
+        commands[-1].append(fn)
+    return commands
+
+
+def get_elaborate_command(top_module, snapshot, generics=None):
+    command = [config.xelab, '--debug', 'off', '--snapshot', snapshot]
+    if generics:
+        for name, value in sorted(generics.items()):
+            command += ['--generic_top', '{}={}'.format(name, value)]
+    command.append('work.{}'.format(top_module))
+    return command
+
+
+def make_compile_script(filenames, top_module, snapshot, generics=None):
+    '''
+    Generate a bash script that compiles and elaborates a snapshot.
+    '''
+    commands = get_compile_commands(filenames)
+    commands.append(get_elaborate_command(
+        top_module=top_module, snapshot=snapshot, generics=generics))
+    lines = ['set -e']
+    lines += [' '.join([shlex.quote(c) for c in command])
+              for command in commands]
+    return '\n'.join(lines) + '\n'
+
+
+def make_simulate_script(snapshot, runtime):
+    '''
+    Generate a bash script and a TCL batch file that run a snapshot.
+    Returns a (script, tcl) tuple.
+    '''
+    command = [config.xsim, snapshot, '--tclbatch', 'run.tcl',
+               '--log', 'xsim.log']
+    script = 'set -e\n{}\n'.format(' '.join(
+        [shlex.quote(c) for c in command]))
+    tcl = 'run {}\nquit\n'.format(runtime)
+    return script, tcl
+
+
+def get_snapshot_hash(filenames, top_module, generics=None):
+    '''
+    A hash identifying a compiled snapshot.  It changes when the contents
+    of any of the files, the top module or the generics change.
+    '''
+    h = hashlib.sha1()
+    h.update(utils.files_hash(filenames))
+    h.update(top_module.encode('ascii'))
+    if generics is None:
+        generics = {}
+    h.update(str(params_helper.make_constant_hashable(generics)).encode('ascii'))
+    return h.hexdigest()
+
+
+class XSimProject(object):
+    '''
+    A python wrapper that simulates a `BaseProject` directly with xsim.
+
+    Compiled snapshots are stored in a `disk_cache.DiskCache` keyed by
+    `get_snapshot_hash` so that they are shared between tests and between
+    projects with identical sources.  The snapshots it uses are locked in
+    the cache, so they are not evicted, until `close` is called.
+
+    Only behavioral simulation of projects without IP is supported.
+    Use `VivadoProject.run_simulation` for anything else.
+    '''
+
+    def __init__(self, project, snapshot_cache=None):
+        self.project = project
+        self.directory = self.directory_from_project(project)
+        if not os.path.exists(self.directory):
+            os.mkdir(self.directory)
+        self.tasks_collection = tasks_collection.TasksCollection(
+            self.directory, task_type=XSimTask)
+        if snapshot_cache is None:
+            snapshot_cache = disk_cache.DiskCache(
+                config.sim_cache_directory,
+                max_bytes=config.sim_cache_max_bytes)
+        self.snapshot_cache = snapshot_cache
+        # Shared locks on the snapshots we use, keyed by snapshot hash.
+        self.snapshot_locks = {}
+
+    def close(self):
+        '''
+        Release the locks on the snapshots so that they can be evicted.
+        '''
+        for lock in self.snapshot_locks.values():
+            lock.release()
+        self.snapshot_locks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @classmethod
+    def directory_from_project(cls, project):
+        return os.path.join(project.directory, 'xsim')
+
+    def get_filenames(self):
+        '''
+        The files to compile.  The packed file I/O package comes first so
+        that test benches can use it.
+        '''
+        files_and_ip = self.project.files_and_ip
+        if files_and_ip['ips']:
+            raise ValueError(
+                'Projects containing IP cannot be simulated with XSimProject.')
+        filenames = (list(files_and_ip['design_files']) +
+                     list(files_and_ip['simulation_files']))
+        if packed_data.packed_io_filename not in filenames:
+            filenames.insert(0, packed_data.packed_io_filename)
+        return filenames
+
+    def compile_snapshot(self, filenames, snapshot, snapshot_hash,
+                         generics=None):
+        '''
+        Get the directory containing the compiled snapshot, compiling it
+        if it is not already in the cache.
+
+        Returns a (errors, directory) tuple.
+        '''
+        if snapshot_hash not in self.snapshot_locks:
+            self.snapshot_locks[snapshot_hash] = self.snapshot_cache.lock(
+                snapshot_hash)
+        directory = self.snapshot_cache.get(snapshot_hash)
+        if directory is not None:
+            logger.debug('Reusing compiled snapshot {}.'.format(snapshot_hash))
+            return [], directory
+        temp_directory = self.snapshot_cache.make_temp_directory(
+            snapshot_hash)
+        compile_script = make_compile_script(
+            filenames=filenames, top_module=snapshot,
+            snapshot=snapshot, generics=generics)
+        with open(os.path.join(temp_directory, 'compile.sh'), 'w') as f:
+            f.write(compile_script)
+        t = XSimTask.create(
+            collection=self.tasks_collection,
+            description='Compiling a xsim snapshot.',
+            command_text='cd {} && bash compile.sh'.format(
+                shlex.quote(temp_directory)),
+        )
+        t.run()
+        try:
+            t.wait(raise_errors=False)
+        except Exception:
+            self.snapshot_cache.discard(temp_directory)
+            raise
+        errors = t.get_errors()
+        if errors:
+            self.snapshot_cache.discard(temp_directory)
+            directory = None
+        else:
+            directory = self.snapshot_cache.commit(
+                snapshot_hash, temp_directory)
+        return errors, directory
+
+    def elaborate(self, test_bench_name=None, generics=None):
+        '''
+        Get the compiled snapshot of a test bench, compiling it if it is
+        not already in the snapshot cache.
+
+        Returns a (errors, snapshot, directory) tuple.
+        '''
+        if test_bench_name is None:
+            test_bench_name = self.project.files_and_ip['top_module']
+        filenames = self.get_filenames()
+        snapshot_hash = get_snapshot_hash(
+            filenames=filenames, top_module=test_bench_name,
+            generics=generics)
+        errors, directory = self.compile_snapshot(
+            filenames=filenames, snapshot=test_bench_name,
+            snapshot_hash=snapshot_hash, generics=generics)
+        return errors, test_bench_name, directory
+
+    def run_simulation(self, test_name, test_bench_name=None, runtime=None,
+                       sim_type='hdl', generics=None, input_filename=None,
+                       output_layout=None, input_data=None, input_layout=None):
+        '''
+        Spawns a process that runs a simulation of the project with xsim.
+        The snapshot is only compiled if an identical one is not already
+        in the snapshot cache, so simulations of the same test bench with
+        different input files share one snapshot.
+
+        Args:
+            `test_name`: A label for the test.  The simulation runs in the
+               directory of that name.
+            `test_bench_name`: The top level test bench name.  Defaults
+               to the project's top module.
+            `runtime`: A string specifying the runtime.
+            `sim_type`: Must be 'hdl'.
+            `generics`: A dictionary of generics for the top level.
+            `input_filename`: A packed file copied to `INPUT_FILENAME` in
+               the directory of the simulation before it is run.
+            `output_layout`: The `packed_data.Layout` of the
+               `OUTPUT_FILENAME` written by the test bench.
+            `input_data`: Records written to `INPUT_FILENAME` with
+               `packed_data.write_packed` instead of copying a file.
+            `input_layout`: The `packed_data.Layout` of `input_data`.
+
+        Returns a (errors, output_data) tuple where:
+            `errors`: A list of errors produced by the simulation.
+            `output_data`: A `packed_data.PackedData` of the output file,
+               or None if no `output_layout` was given or the simulation
+               failed.
+        '''
+        if sim_type != 'hdl':
+            raise ValueError(
+                'XSimProject only supports hdl simulations not {}'.format(
+                    sim_type))
+        if runtime is None:
+            raise ValueError('A runtime must be specified.')
+        if (input_data is not None) and (input_filename is not None):
+            raise ValueError('Pass input_data or input_filename, not both.')
+        if (input_data is not None) and (input_layout is None):
+            raise ValueError('An input_layout is needed to write input_data.')
+        errors, snapshot, snapshot_directory = self.elaborate(
+            test_bench_name=test_bench_name, generics=generics)
+        if errors:
+            return errors, None
+        test_directory = os.path.join(self.directory, test_name)
+        if not os.path.exists(test_directory):
+            os.mkdir(test_directory)
+        # xsim looks for the snapshot in the xsim.dir of the working
+        # directory.
+        xsim_dir = os.path.join(test_directory, 'xsim.dir')
+        if os.path.lexists(xsim_dir):
+            os.remove(xsim_dir)
+        os.symlink(os.path.join(snapshot_directory, 'xsim.dir'), xsim_dir)
+        if input_filename is not None:
+            shutil.copyfile(
+                input_filename, os.path.join(test_directory, INPUT_FILENAME))
+        elif input_data is not None:
+            packed_data.write_packed(
+                os.path.join(test_directory, INPUT_FILENAME), input_layout,
+                input_data)
+        output_filename = os.path.join(test_directory, OUTPUT_FILENAME)
+        if os.path.exists(output_filename):
+            os.remove(output_filename)
+        simulate_script, simulate_tcl = make_simulate_script(
+            snapshot=snapshot, runtime=runtime)
+        with open(os.path.join(test_directory, 'simulate.sh'), 'w') as f:
+            f.write(simulate_script)
+        with open(os.path.join(test_directory, 'run.tcl'), 'w') as f:
+            f.write(simulate_tcl)
+        t = XSimTask.create(
+            collection=self.tasks_collection,
+            description='Running a xsim simulation.',
+            command_text='cd {} && bash simulate.sh'.format(
+                shlex.quote(test_directory)),
+        )
+        try:
+            t.run_and_wait(raise_errors=False)
+        except Exception as e:
+            # The task did not finish correctly.  Report its errors rather
+            # than raising so that failures look the same as compile errors.
+            errors = t.get_errors() or [str(e)]
+        else:
+            errors = t.get_errors()
+        output_data = None
+        if (not errors) and (output_layout is not None):
+            if os.path.exists(output_filename):
+                output_data = packed_data.read_packed(
+                    output_filename, output_layout)
+            else:
+                errors = ['The simulation did not write {}.'.format(
+                    output_filename)]
+        return errors, output_data
@@ -5,7 +5,7 @@ setup(
     packages=['pyvivado'],
     package_data={
         '': ['sh/*.sh', 'sh/*.sh.t', 'tcl/*.tcl.t', 'tcl/*.tcl', 'xdc/*.xdc',
-             'templates/*.vhd'],
+             'templates/*.vhd', 'hdl/*.vhd'],
     },
     use_scm_version={
         "relative_to": __file__,
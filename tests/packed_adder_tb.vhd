@@ -0,0 +1,39 @@
+-- -*- vhdl -*- 
+
+-- A test bench for tests/test_xsim_project.py.
+-- Each input record holds two 8 bit values and each output record is
+-- their 9 bit sum.
+
+library ieee;
+use ieee.std_logic_1164.all;
+use ieee.numeric_std.all;
+
+use std.textio.all;
+
+use work.pyvivado_packed_io.all;
+
+entity packed_adder_tb is
+end packed_adder_tb;
+
+architecture arch of packed_adder_tb is
+begin
+
+  process
+    file input_file: text open read_mode is "input.data";
+    file output_file: text open write_mode is "output.data";
+    variable input_record: std_logic_vector(15 downto 0);
+    variable total: unsigned(8 downto 0);
+    variable done: boolean;
+  begin
+    loop
+      read_packed(input_file, input_record, done);
+      exit when done;
+      total := resize(unsigned(input_record(15 downto 8)), 9) +
+               resize(unsigned(input_record(7 downto 0)), 9);
+      write_packed(output_file, std_logic_vector(total));
+      wait for 10 ns;
+    end loop;
+    wait;
+  end process;
+
+end arch;
@@ -0,0 +1,671 @@
+import os
+import time
+import datetime
+import unittest
+import shutil
+import subprocess
+import threading
+import logging
+
+from pyvivado import config, packed_data, connection
+from pyvivado import redis_connection, socket_connection, leases
+
+logger = logging.getLogger(__name__)
+
+tcl_fn = os.path.join(config.tcldir, 'pyvivado.tcl')
+
+# Serve commands for a fake FPGA with a redis client that does nothing.
+SERVE_SCRIPT = '''
+source {{{tcl_fn}}}
+proc fake_redis {{args}} {{
+    return 0
+}}
+::pyvivado::serve_socket fake_redis testhw 0 1
+'''
+
+
+# Check redis once with a fake redis client holding a kill request and
+# then acknowledge the kill.
+KILL_SCRIPT = '''
+source {{{tcl_fn}}}
+proc fake_redis {{command args}} {{
+    if {{$command == "brpop"}} {{
+        return [list testhw_requests "0 0 K"]
+    }}
+    puts "REDIS $command $args"
+    return 0
+}}
+puts "KILLED [::pyvivado::check_redis fake_redis testhw 1]"
+::pyvivado::acknowledge_kill fake_redis testhw
+'''
+
+
+# Check redis with a fake redis client holding a request, an expired
+# request, a request without a deadline and one that is not a command.
+CHECK_REDIS_SCRIPT = '''
+source {{{tcl_fn}}}
+set now [clock milliseconds]
+set requests [list "10 0 X" "9 0 C R 8 1" "8 [expr {{$now - 1000}}] C R 6 1" "7 [expr {{$now + 60000}}] C R 4 2"]
+proc fake_redis {{command args}} {{
+    if {{$command == "brpop"}} {{
+        set request [lindex $::requests end]
+        set ::requests [lrange $::requests 0 end-1]
+        return [list testhw_requests $request]
+    }} elseif {{$command == "lpush"}} {{
+        puts "LPUSH [lindex $args 0] [lindex $args 1]"
+    }}
+    return 0
+}}
+for {{set i 0}} {{$i < 4}} {{incr i}} {{
+    ::pyvivado::check_redis fake_redis testhw 1
+}}
+'''
+
+
+# Run commands against fake Vivado hw_axi commands.
+# The fake reads return the last value written to the address or otherwise
+# the address plus one.
+AXI_BATCH_SCRIPT = '''
+source {{{tcl_fn}}}
+set ::pyvivado::axi_batch_size 4
+set n_runs 0
+proc get_hw_axis {{name}} {{
+    return $name
+}}
+proc create_hw_axi_txn {{name hw_axi args}} {{
+    set address [dict get $args -address]
+    if {{[dict exists $args -data]}} {{
+        set ::memory($address) [dict get $args -data]
+        set ::txns($name) [dict get $args -data]
+    }} elseif {{[info exists ::memory($address)]}} {{
+        set ::txns($name) $::memory($address)
+    }} else {{
+        set ::txns($name) [format %08x [expr {{[scan $address %x] + 1}}]]
+    }}
+}}
+proc get_hw_axi_txns {{name}} {{
+    return $name
+}}
+proc run_hw_axi {{txns}} {{
+    incr ::n_runs
+}}
+proc report_hw_axi_txn {{txn}} {{
+    return [list address $::txns($txn)]
+}}
+proc delete_hw_axi_txn {{txns}} {{
+    foreach txn $txns {{
+        unset ::txns($txn)
+    }}
+}}
+puts [::pyvivado::run_command "C R 16 10" 0]
+puts [::pyvivado::run_command "C WW 3 2 5 6" 0]
+set response [::pyvivado::run_command "B W 3 2\n[binary format i* {{5 4294967295}}]" 0]
+set header_end [string first "\n" $response]
+binary scan [string range $response [expr {{$header_end+1}}] end] iu* words
+puts "BINARY [string range $response 0 [expr {{$header_end-1}}]] $words"
+puts [::pyvivado::run_command "S W 3 2 5 6|R 16 2|RR 7 1" 0]
+puts "RUNS $n_runs"
+puts [::pyvivado::run_command "C V 100 2 7 8" 0]
+puts [::pyvivado::run_command "C M 16 240 160" 0]
+puts [::pyvivado::run_command "C P 20 255 21 1000" 0]
+puts [::pyvivado::run_command "C P 20 255 0 10" 0]
+'''
+
+
+class FakeRedis(object):
+    '''
+    Just enough of a redis client for a connection.
+    '''
+
+    def __init__(self):
+        self.data = {}
+        # Times at which keys expire.
+        self.expiries = {}
+        self.condition = threading.Condition()
+
+    def expire_keys(self):
+        now = time.time()
+        for key, expiry in list(self.expiries.items()):
+            if expiry <= now:
+                self.data.pop(key, None)
+                del self.expiries[key]
+
+    def get(self, key):
+        with self.condition:
+            self.expire_keys()
+            return self.data.get(key, None)
+
+    def set(self, key, value, nx=False, px=None):
+        if isinstance(value, (str, int)):
+            value = str(value).encode('ascii')
+        with self.condition:
+            self.expire_keys()
+            if nx and key in self.data:
+                return None
+            self.data[key] = value
+            self.expiries.pop(key, None)
+            if px is not None:
+                self.expiries[key] = time.time() + px / 1000
+        return True
+
+    def mget(self, keys):
+        self.n_mgets = getattr(self, 'n_mgets', 0) + 1
+        return [self.get(key) for key in keys]
+
+    def exists(self, key):
+        return int(self.get(key) is not None)
+
+    def delete(self, key):
+        with self.condition:
+            self.expiries.pop(key, None)
+            return int(self.data.pop(key, None) is not None)
+
+    def pexpire(self, key, milliseconds):
+        with self.condition:
+            if self.get(key) is None:
+                return 0
+            self.expiries[key] = time.time() + milliseconds / 1000
+        return 1
+
+    def eval(self, script, n_keys, key, token, *args):
+        '''
+        Run one of the lease scripts.
+        '''
+        with self.condition:
+            if self.get(key) != token.encode('ascii'):
+                return 0
+            if script == leases.RENEW_SCRIPT:
+                return self.pexpire(key, *args)
+            elif script == leases.RELEASE_SCRIPT:
+                return self.delete(key)
+            raise ValueError('Unknown script')
+
+    def incr(self, key):
+        with self.condition:
+            value = int(self.data.get(key, 0)) + 1
+            self.data[key] = value
+        return value
+
+    def expire(self, key, seconds):
+        pass
+
+    def zadd(self, key, mapping):
+        with self.condition:
+            self.data.setdefault(key, {}).update(mapping)
+
+    def zrange(self, key, start, end):
+        with self.condition:
+            members = sorted(self.data.get(key, {}).items(), key=lambda m: m[1])
+            members = [m.encode('ascii') for m, score in members]
+            return members[start: end+1 if end >= 0 else None]
+
+    def zrem(self, key, member):
+        with self.condition:
+            return int(self.data.get(key, {}).pop(member, None) is not None)
+
+    def lpush(self, key, value):
+        if isinstance(value, str):
+            value = value.encode('ascii')
+        with self.condition:
+            self.data.setdefault(key, []).insert(0, value)
+            self.condition.notify_all()
+
+    def lindex(self, key, index):
+        with self.condition:
+            values = self.data.get(key, [])
+            return values[index] if -len(values) <= index < len(values) else None
+
+    def brpop(self, key, timeout=0):
+        with self.condition:
+            self.condition.wait_for(lambda: self.data.get(key), timeout=timeout)
+            if self.data.get(key):
+                return (key.encode('ascii'), self.data[key].pop())
+        return None
+
+
+def fake_monitor(fake_redis, hwcode, n_requests):
+    '''
+    Respond to requests like a fake monitor would.  A stale reply is
+    pushed before each real one.
+    '''
+    for i in range(n_requests):
+        key, request = fake_redis.brpop('{}_requests'.format(hwcode), timeout=5)
+        sequence_id, deadline, command = request.decode('latin-1').split(
+            maxsplit=2)
+        bits = command.split()
+        reply_key = '{}_reply_{}'.format(hwcode, sequence_id)
+        fake_redis.lpush(reply_key, '{} R R 0 ff'.format(int(sequence_id) - 1))
+        if command.startswith('B'):
+            response = 'B {} {} {}\n'.format(bits[1], bits[2], bits[3]).encode(
+                'ascii') + redis_connection.to_words([10] * int(bits[3]))
+        else:
+            response = ' '.join(
+                ['R', bits[1], bits[2]] + ['0a'] * int(bits[3])).encode('ascii')
+        fake_redis.lpush(reply_key, sequence_id.encode('ascii') + b' ' + response)
+
+
+def serve_fake_redis(fake_redis, hwcode, stop, drop=(), stop_after=None):
+    '''
+    Respond to binary reads like a fake monitor until `stop` is set.
+    Each word read is its address.  Requests with sequence ids in `drop`
+    are ignored, as are all requests after `stop_after`.
+    '''
+    while not stop.is_set():
+        popped = fake_redis.brpop('{}_requests'.format(hwcode), timeout=0.1)
+        if popped is None:
+            continue
+        sequence_id, deadline, command = popped[1].split(b' ', 2)
+        sequence_id = int(sequence_id)
+        if (sequence_id in drop) or (
+                (stop_after is not None) and (sequence_id > stop_after)):
+            continue
+        bits = command.split()
+        address, length = int(bits[2]), int(bits[3])
+        response = command.split(b'\n')[0] + b'\n' + redis_connection.to_words(
+            range(address, address + length))
+        fake_redis.lpush('{}_reply_{}'.format(hwcode, sequence_id),
+                         str(sequence_id).encode('ascii') + b' ' + response)
+
+
+class ScriptRecorder(object):
+    '''
+    A connection that records the scripts it is asked to run.
+    '''
+
+    def __init__(self):
+        self.scripts = []
+
+    def run_script(self, commands, timeout=None):
+        self.scripts.append(commands)
+        return [redis_connection.Response(length=length, resp=0, data=[1]*length)
+                for typ, address, length, data in commands]
+
+    def poll(self, address, mask, expected, poll_timeout=1, timeout=None):
+        self.scripts.append('poll')
+        return expected
+
+
+class TestCommands(unittest.TestCase):
+
+    def test_compound_response(self):
+        self.assertEqual(redis_connection.parse_compound_response(
+            b'T P 20 00000015\n'), (False, [21]))
+        self.assertEqual(redis_connection.parse_compound_response(
+            'R M 16 00000011 000000a1'), (True, [17, 161]))
+
+    def test_script(self):
+        command = redis_connection.make_script_command(
+            [('W', 3, 2, [5, 6]), ('R', 16, 1, [])])
+        self.assertEqual(command, 'S W 3 2 5 6|R 16 1')
+        responses = redis_connection.parse_script_response(
+            b'S R W 3 5 6|R R 16 0a\n')
+        self.assertEqual([r.data for r in responses], [[5, 6], [10]])
+
+    def test_batching(self):
+        recorder = ScriptRecorder()
+        conn = connection.BatchingConnection(recorder, max_queued=3)
+        conn.write(address=1, data=[2])
+        conn.write_repeat(address=2, data=[3, 4])
+        self.assertEqual(recorder.scripts, [])
+        rsp = conn.read(address=5, length=2)
+        self.assertEqual(rsp.data, [1, 1])
+        self.assertEqual(recorder.scripts, [
+            [('W', 1, 1, [2]), ('WW', 2, 2, [3, 4]), ('R', 5, 2, [])]])
+        for i in range(3):
+            conn.write(address=i, data=[i])
+        self.assertEqual(len(recorder.scripts), 2)
+        self.assertEqual(conn.flush(), [])
+        # Queued writes are sent before anything else.
+        conn.write(address=1, data=[2])
+        self.assertEqual(conn.poll(address=1, mask=1, expected=1), 1)
+        self.assertEqual(recorder.scripts[2:], [[('W', 1, 1, [2])], 'poll'])
+
+    def test_make_command(self):
+        self.assertEqual(redis_connection.make_command('R', 4, 2), 'C R 4 2')
+        self.assertEqual(
+            redis_connection.make_command('W', 4, 2, [1, 10]), 'C W 4 2 1 10')
+
+    def test_words(self):
+        words = redis_connection.to_words([1, 2**32-1])
+        self.assertEqual(words, b'\x01\x00\x00\x00\xff\xff\xff\xff')
+        self.assertEqual(list(redis_connection.from_words(words)), [1, 2**32-1])
+        self.assertEqual(redis_connection.to_words(words), words)
+        numpy = packed_data.get_numpy()
+        if numpy is not None:
+            self.assertEqual(redis_connection.to_words(
+                numpy.array([1, 2**32-1], dtype=numpy.uint32)), words)
+
+    def test_binary_response(self):
+        response = b'B R 4 2\n' + redis_connection.to_words([7, 8])
+        words = redis_connection.parse_binary_response(response)
+        self.assertEqual(list(redis_connection.from_words(words)), [7, 8])
+        with self.assertRaises(ValueError):
+            redis_connection.parse_binary_response(response[:-1])
+
+    def test_parse_response(self):
+        for response in ('R R 4 0a ff', b'R R 4 0a ff\n'):
+            rsp = redis_connection.parse_response(response)
+            self.assertEqual(rsp.length, 2)
+            self.assertEqual(rsp.data, [10, 255])
+
+
+class TestRedisConnection(unittest.TestCase):
+
+    def test_get_connection(self):
+        self.assertIs(connection.Connection, redis_connection.Connection)
+        fake_redis = FakeRedis()
+        conn = connection.get_connection(
+            'testhw', transport='redis', redis_client=fake_redis)
+        self.assertIsInstance(conn, redis_connection.Connection)
+        self.assertNotIsInstance(conn, socket_connection.Connection)
+        with self.assertRaises(ValueError):
+            connection.get_connection('testhw', transport='carrier pigeon')
+
+    def test_commands(self):
+        fake_redis = FakeRedis()
+        monitor = threading.Thread(
+            target=fake_monitor, args=(fake_redis, 'testhw', 5))
+        monitor.start()
+        conn = redis_connection.Connection('testhw', redis_client=fake_redis)
+        rsp = conn.read(address=3, length=4, timeout=5)
+        self.assertEqual(rsp.data, [10, 10, 10, 10])
+        self.assertEqual(list(conn.read_array(address=3, length=3, timeout=5)),
+                         [10, 10, 10])
+        words = conn.write_buffer(address=3, data=[1, 2], timeout=5)
+        self.assertEqual(len(words), 8)
+        rsp = conn.write(address=3, data=[1, 2], timeout=5)
+        self.assertEqual(rsp.length, 2)
+        rsp = conn.read_repeat(address=3, length=1, timeout=5)
+        self.assertEqual(rsp.data, [10])
+        monitor.join()
+        self.assertIn('testhw_last_B', fake_redis.data)
+
+    def test_submit(self):
+        fake_redis = FakeRedis()
+        conn = redis_connection.Connection('testhw', redis_client=fake_redis)
+        # Nothing is processing the requests yet.
+        futures = [conn.submit_read(address=i, length=i+1, timeout=5)
+                   for i in range(5)]
+        self.assertFalse(any(future.done() for future in futures))
+        monitor = threading.Thread(
+            target=fake_monitor, args=(fake_redis, 'testhw', 5))
+        monitor.start()
+        for i, future in enumerate(futures):
+            self.assertEqual(future.result().data, [10] * (i+1))
+        conn.close()
+        monitor.join()
+
+    def test_read_into(self):
+        fake_redis = FakeRedis()
+        stop = threading.Event()
+        # The third chunk is lost and has to be retried.
+        monitor = threading.Thread(
+            target=serve_fake_redis, args=(fake_redis, 'testhw', stop),
+            kwargs={'drop': [3]})
+        monitor.start()
+        conn = redis_connection.Connection('testhw', redis_client=fake_redis)
+        buffer = bytearray(4 * 100)
+        progress = []
+        n_words = conn.read_into(
+            address=1000, buffer=buffer, chunk_length=16, timeout=1,
+            progress=lambda done, length: progress.append(done))
+        stop.set()
+        monitor.join()
+        conn.close()
+        self.assertEqual(n_words, 100)
+        self.assertEqual(progress, [16, 32, 48, 64, 80, 96, 100])
+        self.assertEqual(list(redis_connection.from_words(buffer)),
+                         list(range(1000, 1100)))
+
+    def test_resume_read_into(self):
+        fake_redis = FakeRedis()
+        stop = threading.Event()
+        monitor = threading.Thread(
+            target=serve_fake_redis, args=(fake_redis, 'testhw', stop),
+            kwargs={'stop_after': 2})
+        monitor.start()
+        conn = redis_connection.Connection('testhw', redis_client=fake_redis)
+        buffer = bytearray(4 * 40)
+        with self.assertRaises(redis_connection.StreamReadError) as cm:
+            conn.read_into(address=0, buffer=buffer, chunk_length=10,
+                           window=1, retries=0, timeout=1)
+        self.assertEqual(cm.exception.offset, 20)
+        stop.set()
+        monitor.join()
+        stop = threading.Event()
+        monitor = threading.Thread(
+            target=serve_fake_redis, args=(fake_redis, 'testhw', stop))
+        monitor.start()
+        conn.read_into(address=0, buffer=buffer, chunk_length=10,
+                       offset=cm.exception.offset, timeout=1)
+        stop.set()
+        monitor.join()
+        conn.close()
+        self.assertEqual(list(redis_connection.from_words(buffer)),
+                         list(range(40)))
+
+    def test_timeout(self):
+        fake_redis = FakeRedis()
+        conn = redis_connection.Connection('testhw', redis_client=fake_redis)
+        start = time.time()
+        with self.assertRaises(TimeoutError):
+            conn.read(address=3, length=4, timeout=1)
+        self.assertLess(time.time() - start, 3)
+
+    def test_kill_monitor(self):
+        fake_redis = FakeRedis()
+        conn = redis_connection.Connection('testhw', redis_client=fake_redis)
+        # There is nothing to kill.
+        conn.kill_monitor(time_limit=1)
+        self.assertIsNone(fake_redis.get('testhw_kill'))
+        fake_redis.set('testhw_last_A', datetime.datetime.now().strftime(
+            '%Y%m%d%H%M%S'), px=3000)
+        def fake_monitor():
+            key, request = fake_redis.brpop('testhw_requests', timeout=5)
+            self.assertEqual(request, b'0 0 K')
+            fake_redis.delete('testhw_last_A')
+            fake_redis.lpush('testhw_killed', '1')
+        monitor = threading.Thread(target=fake_monitor)
+        monitor.start()
+        self.assertTrue(conn.is_monitor_alive())
+        start = time.time()
+        conn.kill_monitor(time_limit=5)
+        self.assertLess(time.time() - start, 1)
+        monitor.join()
+        self.assertFalse(conn.is_monitor_alive())
+
+    def test_listened_expires(self):
+        fake_redis = FakeRedis()
+        conn = redis_connection.Connection('testhw', redis_client=fake_redis)
+        conn.mark_listened()
+        self.assertIn('testhw_last_B', fake_redis.expiries)
+        conn.close()
+        self.assertIsNone(fake_redis.get('testhw_last_B'))
+
+    def test_listened_kept_alive(self):
+        fake_redis = FakeRedis()
+        conn = redis_connection.Connection('testhw', redis_client=fake_redis)
+        heartbeat_ttl = config.heartbeat_ttl
+        config.heartbeat_ttl = 300
+        try:
+            conn.mark_listened()
+            # The keeper renews the mark while nothing else happens.
+            time.sleep(0.8)
+            self.assertIsNotNone(fake_redis.get('testhw_last_B'))
+            conn.close()
+        finally:
+            config.heartbeat_ttl = heartbeat_ttl
+        self.assertIsNone(conn.listened_keeper)
+        self.assertIsNone(fake_redis.get('testhw_last_B'))
+
+    @unittest.skipIf(shutil.which('tclsh') is None, 'Needs tclsh.')
+    def test_kill_request(self):
+        output = subprocess.check_output(
+            ['tclsh'], input=KILL_SCRIPT.format(tcl_fn=tcl_fn),
+            universal_newlines=True)
+        self.assertIn('KILLED 1', output)
+        self.assertIn('REDIS del testhw_last_A', output)
+        self.assertIn('REDIS lpush testhw_killed 1', output)
+
+    @unittest.skipIf(shutil.which('tclsh') is None, 'Needs tclsh.')
+    def test_check_redis(self):
+        output = subprocess.check_output(
+            ['tclsh'], input=CHECK_REDIS_SCRIPT.format(tcl_fn=tcl_fn),
+            universal_newlines=True)
+        self.assertIn('LPUSH testhw_reply_7 7 R R 4 0 0', output)
+        self.assertIn('Dropping expired request 8', output)
+        self.assertNotIn('testhw_reply_8', output)
+        self.assertIn('LPUSH testhw_reply_9 9 R R 8 0', output)
+        self.assertIn('LPUSH testhw_reply_10 10 E', output)
+
+    def test_deadline(self):
+        fake_redis = FakeRedis()
+        conn = redis_connection.Connection('testhw', redis_client=fake_redis)
+        start = time.time()
+        conn.push_request('C R 4 1', timeout=10)
+        conn.push_request('C R 4 1')
+        with_deadline = fake_redis.data['testhw_requests'][-1].split()
+        without_deadline = fake_redis.data['testhw_requests'][0].split()
+        deadline = int(with_deadline[1]) / 1000
+        self.assertTrue(start + 9.99 <= deadline <= time.time() + 10)
+        self.assertEqual(without_deadline[1], b'0')
+
+    def test_error_reply(self):
+        fake_redis = FakeRedis()
+        conn = redis_connection.Connection('testhw', redis_client=fake_redis)
+        sequence_id = conn.push_request('X')
+        fake_redis.lpush(conn.reply_key(sequence_id),
+                         '{} E'.format(sequence_id))
+        with self.assertRaises(redis_connection.MonitorError):
+            conn.wait_for_response(sequence_id, timeout=5)
+
+
+@unittest.skipIf(shutil.which('tclsh') is None, 'Needs tclsh.')
+class TestAxiBatch(unittest.TestCase):
+
+    def test_run_command(self):
+        output = subprocess.check_output(
+            ['tclsh'], input=AXI_BATCH_SCRIPT.format(tcl_fn=tcl_fn),
+            universal_newlines=True)
+        lines = [line for line in output.splitlines()
+                 if line.startswith('R') and not line.startswith('RUNS')]
+        read_response = redis_connection.parse_response(lines[0])
+        self.assertEqual(read_response.data, list(range(17, 27)))
+        write_response = redis_connection.parse_response(lines[1])
+        self.assertEqual(write_response.data, [5, 6])
+        self.assertIn('BINARY B W 3 2 5 4294967295', output)
+        script_line = [line for line in output.splitlines()
+                       if line.startswith('S ')][0]
+        responses = redis_connection.parse_script_response(script_line)
+        self.assertEqual([r.data for r in responses], [[5, 6], [17, 18], [8]])
+        # 10 reads in batches of 4, two commands with 2 writes and then
+        # the 5 transactions of the script in batches of 4.
+        self.assertIn('RUNS 7', output)
+        self.assertIn('R V 100 00000007 00000008', output)
+        self.assertIn('R M 16 00000011 000000a1', output)
+        self.assertIn('R P 20 00000015', output)
+        self.assertIn('T P 20 00000015', output)
+
+
+@unittest.skipIf(shutil.which('tclsh') is None, 'Needs tclsh.')
+class TestSocketConnection(unittest.TestCase):
+
+    def setUp(self):
+        self.process = subprocess.Popen(
+            ['tclsh'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            universal_newlines=True)
+        self.process.stdin.write(SERVE_SCRIPT.format(tcl_fn=tcl_fn))
+        self.process.stdin.flush()
+        line = self.process.stdout.readline()
+        self.assertTrue(line.startswith('DEBUG: Listening on port'))
+        self.port = int(line.split()[-1])
+
+    def tearDown(self):
+        self.process.kill()
+        self.process.wait()
+
+    def test_commands(self):
+        fake_redis = FakeRedis()
+        conn = socket_connection.Connection(
+            'testhw', port=self.port, redis_client=fake_redis)
+        rsp = conn.write(address=3, data=[1, 2, 3], timeout=5)
+        self.assertEqual(rsp.data, [0, 0, 0])
+        for i in range(10):
+            rsp = conn.read(address=3, length=4, timeout=5)
+            self.assertEqual(rsp.data, [0, 0, 0, 0])
+        rsp = conn.read_repeat(address=3, length=2, timeout=5)
+        self.assertEqual(rsp.length, 2)
+        self.assertIn('testhw_last_B', fake_redis.data)
+        self.assertEqual(conn.poll(
+            address=3, mask=1, expected=0, timeout=5), 0)
+        with self.assertRaises(TimeoutError):
+            conn.poll(address=3, mask=1, expected=1, poll_timeout=0.01,
+                      timeout=5)
+        self.assertEqual(conn.read_modify_write(
+            address=3, mask=0xf, value=5, timeout=5), (0, 5))
+        rsp = conn.write_and_read_back(address=3, data=[1, 2], timeout=5)
+        self.assertEqual(rsp.data, [0, 0])
+        values = conn.read_array(address=3, length=1000, timeout=5)
+        self.assertEqual(list(values), [0] * 1000)
+        words = conn.write_buffer(address=3, data=bytes(range(16)), timeout=5)
+        self.assertEqual(words, bytes(16))
+        buffer = bytearray(b'\xff' * 4 * 1000)
+        progress = list(conn.iter_read_into(
+            address=0, buffer=buffer, chunk_length=300, timeout=5))
+        self.assertEqual(progress, [300, 600, 900, 1000])
+        self.assertEqual(buffer, bytes(4 * 1000))
+        conn.close()
+
+    def test_kill(self):
+        conn = socket_connection.Connection(
+            'testhw', port=self.port, redis_client=FakeRedis())
+        conn.request_kill()
+        # The monitor stops serving and tclsh reaches the end of its input.
+        self.process.stdin.close()
+        self.assertEqual(self.process.wait(timeout=5), 0)
+
+    def test_kill_before_release(self):
+        '''
+        The lease is still held when the monitor is killed.
+        '''
+        fake_redis = FakeRedis()
+        lease = leases.Lease('testhw', redis_client=fake_redis)
+        self.assertTrue(lease.acquire())
+        conn = socket_connection.Connection(
+            'testhw', port=self.port, redis_client=fake_redis, lease=lease)
+        rsp = conn.read(address=3, length=1, timeout=5)
+        self.assertEqual(rsp.data, [0])
+        fake_redis.set('testhw_last_A', datetime.datetime.now().strftime(
+            '%Y%m%d%H%M%S'), px=3000)
+        def acknowledge():
+            # The fake monitor does not acknowledge so we do it once it
+            # has stopped.
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+            self.assertIsNotNone(fake_redis.get('testhw_lease'))
+            fake_redis.delete('testhw_last_A')
+            fake_redis.lpush('testhw_killed', '1')
+        acknowledger = threading.Thread(target=acknowledge)
+        acknowledger.start()
+        conn.kill_monitor(time_limit=5)
+        acknowledger.join()
+        self.assertEqual(self.process.returncode, 0)
+        self.assertIsNotNone(fake_redis.get('testhw_lease'))
+        conn.close()
+        self.assertIsNone(fake_redis.get('testhw_lease'))
+
+    def test_submit(self):
+        conn = socket_connection.Connection(
+            'testhw', port=self.port, redis_client=FakeRedis())
+        futures = [conn.submit_read(address=i, length=i+1, timeout=5)
+                   for i in range(20)]
+        rsp = conn.write(address=3, data=[1, 2], timeout=5)
+        self.assertEqual(rsp.length, 2)
+        for i, future in enumerate(futures):
+            self.assertEqual(future.result().data, [0] * (i+1))
+        conn.close()
+
+
+if __name__ == '__main__':
+    config.setup_logging(logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import unittest
+import shutil
+import logging
+
+from pyvivado import config, disk_cache, result_cache
+
+logger = logging.getLogger(__name__)
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+testdir = os.path.join(dir_path, '..', 'test_outputs')
+if not os.path.exists(testdir):
+    os.mkdir(testdir)
+
+
+def add_entry(cache, key, size):
+    temp_directory = cache.make_temp_directory(key)
+    with open(os.path.join(temp_directory, 'data'), 'wb') as f:
+        f.write(b'0' * size)
+    return cache.commit(key, temp_directory)
+
+
+class TestDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = os.path.join(testdir, 'testdiskcache')
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+
+    def test_commit(self):
+        cache = disk_cache.DiskCache(self.directory)
+        self.assertEqual(cache.get('a'), None)
+        directory = add_entry(cache, 'a', 10)
+        self.assertEqual(cache.get('a'), directory)
+        self.assertTrue(os.path.exists(os.path.join(directory, 'data')))
+        # A second commit of the same key keeps the first entry.
+        add_entry(cache, 'a', 20)
+        self.assertEqual(cache.entry_size('a'), 10)
+        self.assertEqual([key for t, s, key in cache.entries()], ['a'])
+
+    def test_evict(self):
+        cache = disk_cache.DiskCache(self.directory, min_age=0)
+        for index, key in enumerate(('a', 'b', 'c')):
+            add_entry(cache, key, 100)
+            os.utime(cache.entry_directory(key), (index, index))
+        # Using 'a' makes 'b' the least recently used entry.
+        cache.get('a')
+        cache.max_bytes = 250
+        cache.evict()
+        self.assertEqual(sorted(key for t, s, key in cache.entries()),
+                         ['a', 'c'])
+
+    def test_locked_entries_are_kept(self):
+        cache = disk_cache.DiskCache(self.directory, min_age=0)
+        for index, key in enumerate(('a', 'b', 'c')):
+            add_entry(cache, key, 100)
+            os.utime(cache.entry_directory(key), (index, index))
+        lock = cache.lock('a')
+        try:
+            cache.max_bytes = 250
+            cache.evict()
+            # 'a' is the least recently used but it is in use.
+            self.assertEqual(sorted(key for t, s, key in cache.entries()),
+                             ['a', 'c'])
+            self.assertTrue(os.path.exists(
+                os.path.join(cache.entry_directory('a'), 'data')))
+        finally:
+            lock.release()
+        self.assertTrue(cache.remove('a'))
+        self.assertIsNone(cache.get('a'))
+        # Nothing is left behind apart from the lock files.
+        self.assertEqual(
+            sorted(fn for fn in os.listdir(self.directory)
+                   if not fn.startswith(cache.LOCK_PREFIX)), ['c'])
+
+
+class TestResultCache(unittest.TestCase):
+
+    def test_memoize(self):
+        directory = os.path.join(testdir, 'testresultcache')
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        cache = result_cache.ResultCache(directory)
+        data = [{'reset': 1, 'i': 0}, {'reset': 0, 'i': 3}]
+        key = cache.make_key(b'hash', 'vivado_hdl', '100 ns', data)
+        self.assertEqual(cache.get_output(key), None)
+        cache.put_output(key, [{'o': 0}, {'o': 3}])
+        self.assertEqual(cache.get_output(key), [{'o': 0}, {'o': 3}])
+        # Any change to the inputs gives a different key.
+        other_data = [{'i': 0, 'reset': 1}, {'reset': 0, 'i': 4}]
+        self.assertNotEqual(
+            key, cache.make_key(b'hash', 'vivado_hdl', '100 ns', other_data))
+        self.assertNotEqual(
+            key, cache.make_key(b'hash', 'vivado_hdl', '200 ns', data))
+
+
+if __name__ == '__main__':
+    config.setup_logging(logging.DEBUG)
+    unittest.main()
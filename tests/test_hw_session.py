@@ -0,0 +1,145 @@
+import os
+import shutil
+import subprocess
+import unittest
+import logging
+
+from pyvivado import config, hw_session
+
+from test_connection import FakeRedis
+
+logger = logging.getLogger(__name__)
+
+tcl_fn = os.path.join(config.tcldir, 'pyvivado.tcl')
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+testdir = os.path.join(dir_path, '..', 'test_outputs')
+if not os.path.exists(testdir):
+    os.mkdir(testdir)
+
+# Run session requests with a fake redis client.
+CHECK_SESSION_SCRIPT = '''
+source {{{tcl_fn}}}
+set requests [list "3 {{Q}}" "2 {{X}} {{a}}" "1 {{P}} {{/no such/dir}} {{abc}}"]
+proc fake_redis {{command args}} {{
+    if {{$command == "brpop"}} {{
+        set request [lindex $::requests end]
+        set ::requests [lrange $::requests 0 end-1]
+        return [list testhw_session_requests $request]
+    }}
+    puts "REDIS $command $args"
+    return 0
+}}
+puts "FINISH [::pyvivado::check_session fake_redis testhw 1]"
+puts "FINISH [::pyvivado::check_session fake_redis testhw 1]"
+puts "FINISH [::pyvivado::check_session fake_redis testhw 1]"
+'''
+
+# A monitor started by the session uses the session's redis connection.
+# Opening another connection fails.
+SESSION_MONITOR_SCRIPT = '''
+source {{{tcl_fn}}}
+proc redis {{args}} {{
+    error "opened another redis connection"
+}}
+proc fake_redis {{command args}} {{
+    if {{$command == "brpop"}} {{
+        if {{[lindex $args 0] == "testhw_session_requests"}} {{
+            return [list testhw_session_requests "1 {{M}} {{redis}} {{}}"]
+        }}
+        return [list testhw_requests "2 0 K"]
+    }}
+    puts "REDIS $command $args"
+    return 0
+}}
+puts "FINISH [::pyvivado::check_session fake_redis testhw 1]"
+'''
+
+# Programming from a session also uses the session's redis connection.
+SESSION_PROGRAM_SCRIPT = '''
+source {{{tcl_fn}}}
+proc redis {{args}} {{
+    error "opened another redis connection"
+}}
+proc fake_redis {{command args}} {{
+    if {{$command == "brpop"}} {{
+        return [list testhw_session_requests "1 {{P}} {{{proj_dir}}} {{abc}}"]
+    }}
+    puts "REDIS $command $args"
+    return 0
+}}
+puts "FINISH [::pyvivado::check_session fake_redis testhw 1]"
+'''
+
+
+class TestHardwareSession(unittest.TestCase):
+
+    def test_requests(self):
+        r = FakeRedis()
+        session = hw_session.HardwareSession('testhw', redis_client=r)
+        self.assertFalse(session.is_alive())
+        r.set('testhw_session', '123', px=1000)
+        self.assertTrue(session.is_alive())
+        request = session.deploy('/a dir', 'abc', 'redis')
+        self.assertEqual(r.data['testhw_session_requests'],
+                         [b'1 {D} {/a dir} {abc} {redis} {}'])
+        self.assertFalse(request.is_finished())
+        self.assertEqual(request.get_errors(), [])
+        r.lpush('testhw_session_reply_1', 'ERROR no bitstream')
+        self.assertTrue(request.is_finished())
+        self.assertEqual(request.get_errors(), ['no bitstream'])
+        with self.assertRaises(Exception):
+            request.wait(timeout=1)
+        request = session.stop()
+        r.lpush('testhw_session_reply_2', 'OK')
+        request.wait(timeout=1)
+        with self.assertRaises(TimeoutError):
+            session.monitor('redis').wait(timeout=1)
+
+    @unittest.skipIf(shutil.which('tclsh') is None, 'Needs tclsh.')
+    def test_check_session(self):
+        output = subprocess.check_output(
+            ['tclsh'], input=CHECK_SESSION_SCRIPT.format(tcl_fn=tcl_fn),
+            universal_newlines=True)
+        lines = output.splitlines()
+        # Programming fails since there is no bitstream.
+        self.assertIn('REDIS lpush testhw_session_reply_1 {ERROR no files', output)
+        self.assertIn(
+            'REDIS lpush testhw_session_reply_2 {ERROR Unknown session request',
+            output)
+        self.assertIn('REDIS lpush testhw_session_reply_3 OK', output)
+        self.assertEqual([line for line in lines if line.startswith('FINISH')],
+                         ['FINISH 0', 'FINISH 0', 'FINISH 1'])
+        self.assertIn('REDIS set testhw_session', output)
+
+    @unittest.skipIf(shutil.which('tclsh') is None, 'Needs tclsh.')
+    def test_monitor_shares_connection(self):
+        output = subprocess.check_output(
+            ['tclsh'], input=SESSION_MONITOR_SCRIPT.format(tcl_fn=tcl_fn),
+            universal_newlines=True)
+        self.assertIn('REDIS lpush testhw_killed 1', output)
+        self.assertIn('REDIS lpush testhw_session_reply_1 OK', output)
+        self.assertNotIn('REDIS close', output)
+        self.assertIn('FINISH 0', output)
+
+    @unittest.skipIf(shutil.which('tclsh') is None, 'Needs tclsh.')
+    def test_program_shares_connection(self):
+        proj_dir = os.path.join(testdir, 'testsessionprogram')
+        impl_dir = os.path.join(proj_dir, 'TheProject.runs', 'impl_1')
+        if os.path.exists(proj_dir):
+            shutil.rmtree(proj_dir)
+        os.makedirs(impl_dir)
+        with open(os.path.join(impl_dir, 'top.bit'), 'w') as f:
+            f.write('bitstream')
+        output = subprocess.check_output(
+            ['tclsh'], input=SESSION_PROGRAM_SCRIPT.format(
+                tcl_fn=tcl_fn, proj_dir=proj_dir),
+            universal_newlines=True)
+        self.assertIn('REDIS set testhw_projdir {}'.format(proj_dir), output)
+        self.assertIn('REDIS lpush testhw_session_reply_1 OK', output)
+        self.assertNotIn('REDIS close', output)
+
+
+if __name__ == '__main__':
+    config.setup_logging(logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+import unittest
+import subprocess
+import logging
+
+from pyvivado import config
+
+logger = logging.getLogger(__name__)
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+
+# Modules that should only be imported when they are used.
+HEAVY_MODULES = ('redis', 'jinja2', 'axilent', 'slvcodec',
+                 'fusesoc_generators', 'numpy')
+
+# Seconds allowed for importing each module in a fresh interpreter.
+IMPORT_BUDGET = 0.5
+
+MEASURE = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    'elapsed': elapsed,
+    'heavy': [m for m in {heavy!r} if m in sys.modules],
+}}))
+'''
+
+
+def measure_import(module):
+    '''
+    Import a module in a new interpreter and return how long it took and
+    which heavy modules it imported.
+    '''
+    output = subprocess.check_output(
+        [sys.executable, '-c', MEASURE.format(
+            module=module, heavy=HEAVY_MODULES)],
+        cwd=os.path.join(dir_path, '..'), universal_newlines=True)
+    return json.loads(output)
+
+
+class TestImportTime(unittest.TestCase):
+
+    def test_import_time(self):
+        for module in ('pyvivado.vivado_project', 'pyvivado.connection',
+                       'pyvivado.xsim_project'):
+            result = measure_import(module)
+            logger.debug('Importing {} took {:.3f}s'.format(
+                module, result['elapsed']))
+            self.assertEqual(result['heavy'], [])
+            self.assertLess(result['elapsed'], IMPORT_BUDGET)
+
+
+if __name__ == '__main__':
+    config.setup_logging(logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import unittest
+import shutil
+import logging
+
+from pyvivado import config, vivado_project
+
+logger = logging.getLogger(__name__)
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+testdir = os.path.join(dir_path, '..', 'test_outputs')
+if not os.path.exists(testdir):
+    os.mkdir(testdir)
+
+
+class TestIPCache(unittest.TestCase):
+
+    def test_ip_key(self):
+        key = vivado_project.get_ip_key(
+            'fifo_generator', '', 'my_fifo', {'Input_Depth': 16, 'Fifo': 'x'})
+        # The order of the properties does not matter.
+        self.assertEqual(key, vivado_project.get_ip_key(
+            'fifo_generator', '', 'my_fifo', {'Fifo': 'x', 'Input_Depth': 16}))
+        # Values are compared as strings.
+        self.assertEqual(key, vivado_project.get_ip_key(
+            'fifo_generator', '', 'my_fifo', {'Fifo': 'x', 'Input_Depth': '16'}))
+        self.assertNotEqual(key, vivado_project.get_ip_key(
+            'fifo_generator', '', 'my_fifo', {'Fifo': 'x', 'Input_Depth': 32}))
+        self.assertNotEqual(key, vivado_project.get_ip_key(
+            'fifo_generator', '', 'other_fifo', {'Fifo': 'x', 'Input_Depth': 16}))
+        self.assertNotEqual(key, vivado_project.get_ip_key(
+            'fifo_generator', '13.1', 'my_fifo', {'Fifo': 'x', 'Input_Depth': 16}))
+
+    def test_entry_directory(self):
+        self.assertEqual(
+            vivado_project.get_ip_entry_directory(
+                'cache', 'Vivado Simulator 2017.4', 'xc7k70t', 'abc'),
+            os.path.join('cache', 'Vivado_Simulator_2017.4', 'xc7k70t', 'abc'))
+
+    def test_copy_cached_ip(self):
+        directory = os.path.join(testdir, 'testipcache')
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        entry_directory = os.path.join(directory, 'cache', 'abc')
+        os.makedirs(os.path.join(entry_directory, 'my_fifo'))
+        with open(os.path.join(entry_directory, 'my_fifo', 'my_fifo.xci'), 'w') as f:
+            f.write('xci')
+        project_directory = os.path.join(directory, 'project')
+        xci = vivado_project.copy_cached_ip(
+            entry_directory, 'my_fifo', project_directory)
+        self.assertEqual(xci, os.path.join(
+            project_directory, 'cached_ip', 'my_fifo', 'my_fifo.xci'))
+        # Changes to the copy do not touch the cache.
+        with open(xci, 'w') as f:
+            f.write('modified')
+        with open(os.path.join(entry_directory, 'my_fifo', 'my_fifo.xci')) as f:
+            self.assertEqual(f.read(), 'xci')
+
+
+if __name__ == '__main__':
+    config.setup_logging(logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,107 @@
+import time
+import threading
+import unittest
+import logging
+
+from pyvivado import config, leases, redis_utils
+
+from test_connection import FakeRedis
+
+logger = logging.getLogger(__name__)
+
+
+class TestLeases(unittest.TestCase):
+
+    def setUp(self):
+        self.old_hwcodes = config.hwcodes
+        config.hwcodes = {'board': ['hwA', 'hwB']}
+        self.r = FakeRedis()
+        redis_utils.set_redis(self.r)
+
+    def tearDown(self):
+        config.hwcodes = self.old_hwcodes
+        redis_utils.set_redis(None)
+
+    def test_exclusive(self):
+        lease = leases.Lease('hwA', ttl=200)
+        self.assertTrue(lease.acquire())
+        other = leases.Lease('hwA', ttl=200)
+        self.assertFalse(other.acquire())
+        self.assertTrue(lease.renew())
+        self.assertFalse(other.renew())
+        # Releasing someone else's lease does nothing.
+        other.release()
+        self.assertFalse(other.acquire())
+        lease.release()
+        self.assertTrue(other.acquire())
+        other.release()
+
+    def test_expiry(self):
+        lease = leases.Lease('hwA', ttl=100)
+        self.assertTrue(lease.acquire())
+        time.sleep(0.2)
+        self.assertFalse(lease.renew())
+        other = leases.Lease('hwA', ttl=100)
+        self.assertTrue(other.acquire())
+        # A renewed lease does not expire.
+        other.keep_alive()
+        time.sleep(0.3)
+        self.assertTrue(redis_utils.read_status(['hwA'])['hwA'].leased)
+        other.release()
+        self.assertFalse(redis_utils.read_status(['hwA'])['hwA'].leased)
+
+    def test_acquire_board(self):
+        first = leases.acquire_board('board', timeout=1, poll_interval=0.01)
+        second = leases.acquire_board('board', timeout=1, poll_interval=0.01)
+        self.assertEqual({first.hwcode, second.hwcode}, {'hwA', 'hwB'})
+        self.assertIsNone(redis_utils.get_free_hwcode('board'))
+        with self.assertRaises(TimeoutError):
+            leases.acquire_board('board', timeout=0.1, poll_interval=0.01)
+        # Waiters get the next free board in order.
+        got = []
+        def wait(name, delay):
+            time.sleep(delay)
+            lease = leases.acquire_board(
+                'board', timeout=5, poll_interval=0.01)
+            got.append((name, lease.hwcode))
+        waiters = [threading.Thread(target=wait, args=(name, delay))
+                   for name, delay in (('early', 0), ('late', 0.1))]
+        for waiter in waiters:
+            waiter.start()
+        time.sleep(0.2)
+        first.release()
+        time.sleep(0.2)
+        self.assertEqual(got, [('early', first.hwcode)])
+        second.release()
+        for waiter in waiters:
+            waiter.join()
+        self.assertEqual(got, [('early', first.hwcode), ('late', second.hwcode)])
+
+    def test_prefer_bitstream(self):
+        self.r.set('hwA_bitstream', 'abc')
+        lease = leases.acquire_board('board', timeout=1, bitstream='abc')
+        self.assertEqual(lease.hwcode, 'hwA')
+        lease.release()
+        lease = leases.acquire_board('board', timeout=1, bitstream='def')
+        self.assertEqual(lease.hwcode, 'hwA')
+        other = leases.acquire_board('board', timeout=1, bitstream='abc')
+        # The FPGA with the bitstream is leased so we get the other one.
+        self.assertEqual(other.hwcode, 'hwB')
+        self.assertEqual(
+            redis_utils.read_status(['hwA'])['hwA'].bitstream, 'abc')
+
+    def test_priority(self):
+        token_low = 'low'
+        token_high = 'high'
+        self.r.set(leases.waiting_key(token_low), 1)
+        self.r.set(leases.waiting_key(token_high), 1)
+        self.r.zadd(leases.queue_key('board'), {token_low: 1, token_high: 2 - 2**40})
+        self.assertEqual(leases.queue_head('board', self.r), 'high')
+        # Dead waiters are skipped.
+        self.r.delete(leases.waiting_key(token_high))
+        self.assertEqual(leases.queue_head('board', self.r), 'low')
+
+
+if __name__ == '__main__':
+    config.setup_logging(logging.DEBUG)
+    unittest.main()
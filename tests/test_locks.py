@@ -0,0 +1,89 @@
+import os
+import unittest
+import subprocess
+import threading
+import shutil
+import logging
+
+from pyvivado import config, locks, base_project
+
+logger = logging.getLogger(__name__)
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+testdir = os.path.join(dir_path, '..', 'test_outputs')
+if not os.path.exists(testdir):
+    os.mkdir(testdir)
+
+
+@unittest.skipIf(locks.fcntl is None, 'File locks need fcntl.')
+class TestLocks(unittest.TestCase):
+
+    def test_exclusive(self):
+        fn = os.path.join(testdir, 'test_exclusive.lock')
+        with locks.FileLock(fn):
+            other = locks.FileLock(fn)
+            self.assertFalse(other.acquire(blocking=False))
+        self.assertTrue(other.acquire(blocking=False))
+        other.release()
+
+    def test_release_after(self):
+        '''
+        A lock can be held until a child process exits.
+        '''
+        fn = os.path.join(testdir, 'test_release_after.lock')
+        lock = locks.FileLock(fn)
+        lock.acquire()
+        process = subprocess.Popen(['sleep', '0.5'])
+        locks.release_after([lock], process.wait)
+        other = locks.FileLock(fn)
+        self.assertFalse(other.acquire(blocking=False))
+        # Blocks until the child exits.
+        other.acquire()
+        self.assertIsNotNone(process.poll())
+        other.release()
+
+    def test_reader_waits_for_creator(self):
+        '''
+        A project opened without files and IP while another process holds
+        the creation lock waits for it rather than failing.
+        '''
+        directory = os.path.abspath(
+            os.path.join(testdir, 'test_reader_waits_for_creator'))
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+        files_and_ip = {
+            'design_files': [os.path.join(dir_path, 'testA.vhd')],
+            'simulation_files': [],
+            'ips': [],
+            'top_module': 'testA',
+        }
+        creation_lock = locks.FileLock(os.path.join(directory, 'vivado.lock'))
+        creation_lock.acquire()
+        try:
+            readers = []
+            reader_thread = threading.Thread(
+                target=lambda: readers.append(base_project.BaseProject(directory)),
+                daemon=True)
+            reader_thread.start()
+            reader_thread.join(0.3)
+            # The reader is blocked on the creation lock.
+            self.assertTrue(reader_thread.is_alive())
+            p = base_project.BaseProject(directory, dict(files_and_ip))
+            self.assertEqual(p.creation_lock_fn(), creation_lock.fn)
+        finally:
+            creation_lock.release()
+        reader_thread.join()
+        self.assertEqual(readers[0].files_and_ip['top_module'], 'testA')
+
+    def test_reader_without_creator(self):
+        directory = os.path.join(testdir, 'test_reader_without_creator')
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        with self.assertRaises(base_project.BaseProjectException):
+            base_project.BaseProject(directory)
+
+
+if __name__ == '__main__':
+    config.setup_logging(logging.DEBUG)
+    unittest.main()
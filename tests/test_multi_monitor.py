@@ -0,0 +1,125 @@
+import os
+import shutil
+import subprocess
+import unittest
+import logging
+
+from pyvivado import config, leases, multi_monitor
+
+from test_connection import FakeRedis
+
+logger = logging.getLogger(__name__)
+
+tcl_fn = os.path.join(config.tcldir, 'pyvivado.tcl')
+
+# Check redis for two FPGAs with a fake redis client.  There is a read
+# for hwB, then a kill request for hwA, and hwB's kill flag is set.
+CHECK_MANY_SCRIPT = '''
+source {{{tcl_fn}}}
+set requests [list "hwA_requests {{3 0 K}}" "hwB_requests {{7 0 C R 4 2}}"]
+proc fake_redis {{command args}} {{
+    if {{$command == "brpop"}} {{
+        puts "BRPOP $args"
+        set request [lindex $::requests end]
+        set ::requests [lrange $::requests 0 end-1]
+        return $request
+    }} elseif {{$command == "mget"}} {{
+        return [list 0 $::hwB_kill]
+    }} elseif {{$command == "lpush"}} {{
+        puts "LPUSH $args"
+    }} elseif {{$command == "rpop"}} {{
+        return ""
+    }}
+    return 0
+}}
+set targets [dict create hwA {{tA 1}} hwB {{tB 1}}]
+set ::hwB_kill 0
+puts "STOPPED [::pyvivado::check_redis_many fake_redis {{hwA hwB}} $targets 1]"
+puts "STOPPED [::pyvivado::check_redis_many fake_redis {{hwA hwB}} $targets 1]"
+set ::hwB_kill 1
+puts "STOPPED [::pyvivado::check_redis_many fake_redis {{hwA hwB}} $targets 1]"
+'''
+
+# The requests queued for an FPGA are served together.  hwB's target is
+# open so its requests are checked first.
+BATCH_SCRIPT = '''
+source {{{tcl_fn}}}
+set ::queued [list "9 0 K" "8 0 C R 8 1" "7 0 C R 4 1"]
+proc fake_redis {{command args}} {{
+    if {{$command == "brpop"}} {{
+        puts "BRPOP $args"
+        set request [lindex $::queued end]
+        set ::queued [lrange $::queued 0 end-1]
+        return [list hwB_requests $request]
+    }} elseif {{$command == "rpop"}} {{
+        set request [lindex $::queued end]
+        set ::queued [lrange $::queued 0 end-1]
+        return $request
+    }} elseif {{$command == "mget"}} {{
+        return [list 0 0]
+    }} elseif {{$command == "lpush"}} {{
+        puts "LPUSH $args"
+    }}
+    return 0
+}}
+set targets [dict create hwA {{tA 1}} hwB {{tB 1}}]
+set ::pyvivado::open_target tB
+puts "STOPPED [::pyvivado::check_redis_many fake_redis {{hwA hwB}} $targets 1]"
+puts "LEFT [llength $::queued]"
+'''
+
+
+class TestMultiMonitor(unittest.TestCase):
+
+    def test_make_command(self):
+        old_hwtargets = config.hwtargets
+        config.hwtargets = {'hwA': ('*/a', 6e6), 'hwB': ('*/b', 3e6)}
+        try:
+            command = multi_monitor.make_command(['hwA', 'hwB'])
+        finally:
+            config.hwtargets = old_hwtargets
+        self.assertEqual(
+            command, '::pyvivado::monitor_many {{hwA} {hwB}} '
+            '{{*/a} {*/b}} {{6000000} {3000000}} 0')
+
+    @unittest.skipIf(shutil.which('tclsh') is None, 'Needs tclsh.')
+    def test_check_redis_many(self):
+        output = subprocess.check_output(
+            ['tclsh'], input=CHECK_MANY_SCRIPT.format(tcl_fn=tcl_fn),
+            universal_newlines=True)
+        self.assertIn('BRPOP hwA_requests hwB_requests 1', output)
+        self.assertIn('LPUSH hwB_reply_7 {7 R R 4 0 0}', output)
+        stopped = [line for line in output.splitlines()
+                   if line.startswith('STOPPED')]
+        self.assertEqual(stopped, ['STOPPED ', 'STOPPED hwA', 'STOPPED hwB'])
+
+    @unittest.skipIf(shutil.which('tclsh') is None, 'Needs tclsh.')
+    def test_batch_per_target(self):
+        output = subprocess.check_output(
+            ['tclsh'], input=BATCH_SCRIPT.format(tcl_fn=tcl_fn),
+            universal_newlines=True)
+        self.assertIn('BRPOP hwB_requests hwA_requests 1', output)
+        self.assertIn('LPUSH hwB_reply_7 {7 R R 4 0}', output)
+        self.assertIn('LPUSH hwB_reply_8 {8 R R 8 0}', output)
+        self.assertIn('STOPPED hwB', output)
+        self.assertIn('LEFT 0', output)
+
+    def test_acquire_leases(self):
+        r = FakeRedis()
+        other = leases.Lease('hwB', redis_client=r)
+        self.assertTrue(other.acquire())
+        with self.assertRaises(Exception):
+            multi_monitor.acquire_leases(['hwA', 'hwB'], redis_client=r)
+        # The lease on hwA was given back.
+        self.assertIsNone(r.get('hwA_lease'))
+        other.release()
+        held = multi_monitor.acquire_leases(['hwA', 'hwB'], redis_client=r)
+        self.assertEqual(sorted(held), ['hwA', 'hwB'])
+        self.assertFalse(leases.Lease('hwA', redis_client=r).acquire())
+        for lease in held.values():
+            lease.release()
+
+
+if __name__ == '__main__':
+    config.setup_logging(logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import random
+import unittest
+import logging
+
+from pyvivado import config, packed_data
+
+logger = logging.getLogger(__name__)
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+testdir = os.path.join(dir_path, '..', 'test_outputs')
+if not os.path.exists(testdir):
+    os.mkdir(testdir)
+
+
+class TestPackedData(unittest.TestCase):
+
+    layout = packed_data.Layout([('reset', 1), ('a', 13), ('b', 64), ('c', 3)])
+
+    def make_records(self, n_records):
+        rnd = random.Random(0)
+        return [dict((name, rnd.getrandbits(width))
+                     for name, width in self.layout.fields)
+                for i in range(n_records)]
+
+    def test_round_trip(self):
+        fn = os.path.join(testdir, 'packed_round_trip.txt')
+        records = self.make_records(50)
+        packed_data.write_packed(fn, self.layout, (r for r in records))
+        with open(fn, 'r') as f:
+            lines = f.read().split('\n')
+        self.assertEqual(len(lines[0]), 21)
+        with packed_data.read_packed(fn, self.layout) as data:
+            self.assertEqual(len(data), 50)
+            self.assertEqual(list(data), records)
+            self.assertEqual(data[-1], records[-1])
+            for name, width in self.layout.fields:
+                self.assertEqual([int(v) for v in data.column(name)],
+                                 [r[name] for r in records])
+
+    def test_structured_array(self):
+        numpy = packed_data.get_numpy()
+        if numpy is None:
+            self.skipTest('NumPy is not available.')
+        fn_a = os.path.join(testdir, 'packed_dicts.txt')
+        fn_b = os.path.join(testdir, 'packed_array.txt')
+        records = self.make_records(50)
+        array = numpy.zeros(len(records), dtype=[
+            ('reset', 'u1'), ('a', 'u2'), ('b', 'u8'), ('c', 'u1')])
+        for name, width in self.layout.fields:
+            array[name] = [r[name] for r in records]
+        packed_data.write_packed(fn_a, self.layout, records)
+        packed_data.write_packed(fn_b, self.layout, array)
+        with open(fn_a, 'rb') as f_a, open(fn_b, 'rb') as f_b:
+            self.assertEqual(f_a.read(), f_b.read())
+
+    def test_too_wide(self):
+        with self.assertRaises(ValueError):
+            self.layout.pack({'reset': 2, 'a': 0, 'b': 0, 'c': 0})
+
+
+if __name__ == '__main__':
+    config.setup_logging(logging.DEBUG)
+    unittest.main()
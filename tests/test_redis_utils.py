@@ -0,0 +1,63 @@
+import datetime
+import unittest
+import logging
+
+from pyvivado import config, redis_utils
+
+from test_connection import FakeRedis
+
+logger = logging.getLogger(__name__)
+
+
+def timestamp(seconds_ago):
+    t = datetime.datetime.now() - datetime.timedelta(seconds=seconds_ago)
+    return t.strftime('%Y%m%d%H%M%S')
+
+
+class TestRedisUtils(unittest.TestCase):
+
+    def setUp(self):
+        self.old_hwcodes = config.hwcodes
+        config.hwcodes = {'board': ['hwA', 'hwB', 'hwC']}
+        self.r = FakeRedis()
+        redis_utils.set_redis(self.r)
+
+    def tearDown(self):
+        config.hwcodes = self.old_hwcodes
+        redis_utils.set_redis(None)
+
+    def test_status(self):
+        self.r.set('hwA_projdir', '/projA')
+        self.r.set('hwA_last_A', timestamp(0))
+        self.r.set('hwA_last_B', timestamp(0))
+        self.r.set('hwB_projdir', '/projB')
+        self.r.set('hwB_last_A', timestamp(0))
+        self.r.set('hwC_last_A', timestamp(60))
+        usage = redis_utils.get_hardware_usage()
+        # All the boards are read in one round trip.
+        self.assertEqual(self.r.n_mgets, 1)
+        self.assertEqual(usage['hwA'], {
+            'projdir': '/projA', 'active': True, 'monitored': True, 'leased': False,
+            'bitstream': None})
+        self.assertEqual(usage['hwB'], {
+            'projdir': '/projB', 'active': False, 'monitored': True, 'leased': False,
+            'bitstream': None})
+        self.assertEqual(usage['hwC'], {
+            'projdir': None, 'active': False, 'monitored': False, 'leased': False,
+            'bitstream': None})
+        self.assertEqual(redis_utils.get_projdir_hwcode('/projB'), 'hwB')
+        self.assertEqual(redis_utils.get_free_hwcode('board'), 'hwC')
+
+    def test_snapshot(self):
+        redis_utils.get_status(max_age=60)
+        self.r.set('hwA_projdir', '/projA')
+        # The snapshot is reused until it is older than max_age.
+        self.assertEqual(redis_utils.get_status(max_age=60)['hwA'].projdir, None)
+        self.assertEqual(self.r.n_mgets, 1)
+        self.assertEqual(redis_utils.get_status(max_age=0)['hwA'].projdir, '/projA')
+        self.assertEqual(self.r.n_mgets, 2)
+
+
+if __name__ == '__main__':
+    config.setup_logging(logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import unittest
+import logging
+
+from pyvivado import config, shards
+
+logger = logging.getLogger(__name__)
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+testdir = os.path.join(dir_path, '..', 'test_outputs')
+if not os.path.exists(testdir):
+    os.mkdir(testdir)
+
+
+class NamedTest(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class UnnamedTest(object):
+    pass
+
+
+class TestShards(unittest.TestCase):
+
+    def test_partition(self):
+        weights = [5, 1, 8, 3, 3, 2]
+        partitioned = shards.partition(weights, 3)
+        self.assertEqual(sorted(sum(partitioned, [])), list(range(6)))
+        totals = sorted(sum(weights[i] for i in shard) for shard in partitioned)
+        self.assertEqual(totals, [7, 7, 8])
+        for shard in partitioned:
+            self.assertEqual(shard, sorted(shard))
+        # Empty shards are dropped.
+        self.assertEqual(shards.partition([1, 1], 4), [[0], [1]])
+
+    def test_history(self):
+        fn = os.path.join(testdir, 'shard_runtimes.json')
+        if os.path.exists(fn):
+            os.remove(fn)
+        history = shards.RuntimeHistory(fn)
+        tests = [NamedTest('a'), NamedTest('b')]
+        self.assertEqual(history.weights(tests, [10, 30]), [10, 30])
+        history.update('a', 2.0)
+        history.write()
+        history = shards.RuntimeHistory(fn)
+        self.assertEqual(history.weights(tests, [10, 30]), [2.0, 6.0])
+
+    def test_unnamed_keys(self):
+        tests = [UnnamedTest(), UnnamedTest(), NamedTest('a')]
+        keys = [shards.get_test_key(test, index)
+                for index, test in enumerate(tests)]
+        self.assertEqual(keys, ['UnnamedTest_0', 'UnnamedTest_1', 'a'])
+
+
+if __name__ == '__main__':
+    config.setup_logging(logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import unittest
+import shutil
+import subprocess
+import logging
+
+from pyvivado import config, sim_library
+
+logger = logging.getLogger(__name__)
+
+tcl_fn = os.path.join(config.tcldir, 'pyvivado.tcl')
+
+# Compile a library for a project without IP.
+COMPILE_SCRIPT = '''
+source {{{tcl_fn}}}
+proc get_ips {{}} {{
+    return {{}}
+}}
+::pyvivado::compile_sim_library {{{lib_dir}}}
+'''
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+testdir = os.path.join(dir_path, '..', 'test_outputs')
+if not os.path.exists(testdir):
+    os.mkdir(testdir)
+
+
+class TestSimLibrary(unittest.TestCase):
+
+    def test_parse_version(self):
+        output = '\nVivado Simulator 2017.4\nCopyright 1986-2017 Xilinx, Inc.\n'
+        self.assertEqual(sim_library.parse_version(output),
+                         'Vivado Simulator 2017.4')
+
+    def test_library_key(self):
+        key = sim_library.get_library_key('2017.4', ['a', 'b'])
+        self.assertEqual(key, sim_library.get_library_key('2017.4', ['b', 'a']))
+        self.assertNotEqual(
+            key, sim_library.get_library_key('2018.1', ['a', 'b']))
+        self.assertNotEqual(key, sim_library.get_library_key('2017.4', ['a']))
+
+    def make_cache(self):
+        directory = os.path.join(testdir, 'testsimlibrary')
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        return sim_library.SimLibraryCache(directory)
+
+    def test_get_library(self):
+        cache = self.make_cache()
+        temp_directory = cache.make_temp_directory('abc')
+        os.makedirs(os.path.join(temp_directory, 'ip', 'xsim', 'xsim.dir', 'lib'))
+        cache.commit('abc', temp_directory)
+        # Not a library until it has an ini file.
+        self.assertEqual(cache.get_library('abc'), None)
+        with open(os.path.join(cache.entry_directory('abc'),
+                               sim_library.INI_FN), 'w') as f:
+            f.write('lib=ip/xsim/xsim.dir/lib\n')
+        self.assertEqual(cache.get_library('abc'), cache.entry_directory('abc'))
+        # Nor if a library is missing.
+        with open(os.path.join(cache.entry_directory('abc'),
+                               sim_library.INI_FN), 'a') as f:
+            f.write('other=ip/xsim/xsim.dir/other\n')
+        self.assertEqual(cache.get_library('abc'), None)
+
+    @unittest.skipIf(shutil.which('tclsh') is None, 'Needs tclsh.')
+    def test_committed_ini_resolves(self):
+        '''
+        The xsim.ini written while the library is compiled in a temporary
+        directory still resolves after the directory is committed.
+        '''
+        cache = self.make_cache()
+        temp_directory = cache.make_temp_directory('abc')
+        for ip, lib in (('ip0', 'lib_a'), ('ip0', 'xil_defaultlib'),
+                        ('ip1', 'lib_b')):
+            os.makedirs(os.path.join(
+                temp_directory, ip, 'xsim', 'xsim.dir', lib))
+        script = COMPILE_SCRIPT.format(
+            tcl_fn=tcl_fn, lib_dir=temp_directory)
+        subprocess.run(['tclsh'], input=script, universal_newlines=True,
+                       check=True)
+        directory = cache.commit('abc', temp_directory)
+        self.assertEqual(cache.get_library('abc'), directory)
+        self.assertEqual(sim_library.read_ini(directory), {
+            'lib_a': os.path.join(directory, 'ip0/xsim/xsim.dir/lib_a'),
+            'lib_b': os.path.join(directory, 'ip1/xsim/xsim.dir/lib_b'),
+        })
+
+if __name__ == '__main__':
+    config.setup_logging(logging.DEBUG)
+    unittest.main()
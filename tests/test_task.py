@@ -1,5 +1,6 @@
 import unittest
 import os
+import concurrent.futures
 import shutil
 import logging
 
@@ -73,6 +74,28 @@ class TestTask(unittest.TestCase):
         errors = t2.get_errors()
         self.assertTrue(len(errors) == 1)
 
+    def test_shell_tasks_in_threads(self):
+        # Tasks started from several threads at once must each run their
+        # own script in their own directory.
+        task_directory = os.path.join(testdir, 'testthreadedtasks')
+        if os.path.exists(task_directory):
+            shutil.rmtree(task_directory)
+        os.makedirs(task_directory)
+        collection = tasks_collection.TasksCollection(task_directory)
+        cwd = os.getcwd()
+        tasks = [shell_task.ShellTask.create(
+            collection=collection, description='task {}'.format(index),
+            command_text='echo task{}'.format(index))
+            for index in range(32)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(
+                lambda t: t.run_and_wait(sleep_time=0.1), tasks))
+        self.assertEqual(os.getcwd(), cwd)
+        for index, t in enumerate(tasks):
+            with open(os.path.join(t.directory, 'stdout.txt')) as f:
+                self.assertEqual(f.read(), 'task{}\n'.format(index))
+            self.assertTrue(t.is_finished())
+
 
 if __name__ == '__main__':
     config.setup_logging(logging.DEBUG)
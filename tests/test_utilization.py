@@ -0,0 +1,56 @@
+import unittest
+import logging
+
+from pyvivado import config, utilization
+
+logger = logging.getLogger(__name__)
+
+report = '''
+1. Utilization by Hierarchy
+---------------------------
+
++--------------+--------------+------------+------------+-----------+
+|   Instance   |    Module    | Total LUTs | Logic LUTs | FFs       |
++--------------+--------------+------------+------------+-----------+
+| top          |        (top) |        100 |         90 |        50 |
+|   (top)      |        (top) |         10 |         10 |         5 |
+|   adder_a    |        adder |         40 |         35 |        20 |
+|     inner    |  adder_inner |         30 |         30 |        10 |
+|   adder_b    |        adder |         45 |         40 |        25 |
+|   fifo       |         fifo |          5 |          5 |         0 |
++--------------+--------------+------------+------------+-----------+
+'''.split('\n')
+
+
+class TestUtilization(unittest.TestCase):
+
+    def test_table(self):
+        table = utilization.UtilizationTable.from_lines(report)
+        self.assertEqual(len(table), 6)
+        self.assertEqual(table.categories, ['Total LUTs', 'Logic LUTs', 'FFs'])
+        self.assertEqual(table.children(0), [1, 2, 4, 5])
+        self.assertEqual(table.children(2), [3])
+        self.assertEqual(list(table.subtree(2)), [2, 3])
+        self.assertEqual(table.parents[3], 2)
+        self.assertEqual(table.filter_module('adder'), [2, 4])
+        self.assertEqual(table.filter_module('adder*'), [2, 3, 4])
+        self.assertEqual(table.top_n('Total LUTs', 2, level=1), [4, 2])
+        self.assertEqual(table.subtree_sum(2, 'FFs', include_self=False), 10)
+        self.assertEqual(
+            sum(table.subtree_sum(i, 'FFs') for i in table.children(0)), 60)
+
+    def test_dict_tree(self):
+        table = utilization.UtilizationTable.from_lines(report)
+        tree = table.to_dict_tree()
+        self.assertEqual(tree['Instance'], 'top')
+        self.assertEqual(tree['Total LUTs'], 100)
+        self.assertEqual([c['Instance'] for c in tree['children']],
+                         ['(top)', 'adder_a', 'adder_b', 'fifo'])
+        inner = tree['children'][1]['children'][0]
+        self.assertEqual(inner['Module'], 'adder_inner')
+        self.assertEqual(inner['children'], [])
+
+
+if __name__ == '__main__':
+    config.setup_logging(logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import unittest
+import logging
+
+from pyvivado import config, validation, packed_data
+
+logger = logging.getLogger(__name__)
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+testdir = os.path.join(dir_path, '..', 'test_outputs')
+if not os.path.exists(testdir):
+    os.mkdir(testdir)
+
+
+class CountTest(object):
+    '''
+    Expects `o` to count up from `first`.
+    '''
+
+    def __init__(self, first, length):
+        self.first = first
+        self.length = length
+
+    def expected_columns(self):
+        return {'o': list(range(self.first, self.first + self.length))}
+
+
+class TestValidation(unittest.TestCase):
+
+    def test_validate(self):
+        output = {'o': list(range(0, 10)) + [0, 0] + list(range(5, 10))}
+        tests = [CountTest(0, 10), CountTest(5, 5)]
+        offsets = validation.get_offsets([10, 5], gap=2)
+        self.assertEqual(offsets, [0, 12])
+        validation.validate_output_columns_with_tests(tests, offsets, output)
+        output['o'][3] = 7
+        output['o'][14] = 0
+        output['o'][15] = 0
+        with self.assertRaises(validation.ValidationException) as cm:
+            validation.validate_output_columns_with_tests(
+                tests, offsets, output, max_reported=1)
+        self.assertEqual(cm.exception.n_mismatches, 3)
+        self.assertEqual(
+            [m.cycle for m in cm.exception.mismatches], [3, 14])
+        self.assertEqual(cm.exception.mismatches[0].expected, 3)
+        self.assertEqual(cm.exception.mismatches[0].actual, 7)
+
+    def test_mask(self):
+        output = {'o': [0, 9, 2]}
+        n_mismatches, mismatches = validation.compare_columns(
+            {'o': [0, 1, 2]}, output, masks={'o': [True, False, True]})
+        self.assertEqual(n_mismatches, 0)
+
+    def test_packed_output(self):
+        layout = packed_data.Layout([('valid', 1), ('o', 8)])
+        fn = os.path.join(testdir, 'validation_output.data')
+        # A line before the tests, then two tests separated by two cycles.
+        values = [0] + list(range(0, 10)) + [0, 0] + list(range(5, 10))
+        records = [{'valid': 1, 'o': value} for value in values]
+        packed_data.write_packed(fn, layout, records)
+        tests = [CountTest(0, 10), CountTest(5, 5)]
+        with packed_data.read_packed(fn, layout) as output:
+            validation.validate_consecutive_tests(
+                tests, output, start=1, gap=2)
+        records[4]['o'] = 7
+        packed_data.write_packed(fn, layout, records)
+        with self.assertRaises(validation.ValidationException) as cm:
+            with packed_data.read_packed(fn, layout) as output:
+                validation.validate_consecutive_tests(
+                    tests, output, start=1, gap=2)
+        self.assertEqual(cm.exception.n_mismatches, 1)
+        self.assertEqual(cm.exception.mismatches[0].cycle, 4)
+        self.assertEqual(cm.exception.mismatches[0].actual, 7)
+
+    def test_lengths(self):
+        # The first test takes 8 cycles but only checks the first 3.
+        output = {'o': [0, 1, 2, 9, 9, 9, 9, 9, 5, 6]}
+        tests = [CountTest(0, 3), CountTest(5, 2)]
+        validation.validate_consecutive_tests(tests, output, lengths=[8, 2])
+        with self.assertRaises(validation.ValidationException):
+            validation.validate_consecutive_tests(tests, output)
+
+
+if __name__ == '__main__':
+    config.setup_logging(logging.DEBUG)
+    unittest.main()
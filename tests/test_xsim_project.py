@@ -0,0 +1,125 @@
+import os
+import unittest
+import shutil
+import logging
+
+from pyvivado import config, xsim_project, packed_data, disk_cache
+
+logger = logging.getLogger(__name__)
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+testdir = os.path.join(dir_path, '..', 'test_outputs')
+if not os.path.exists(testdir):
+    os.mkdir(testdir)
+
+
+class PackedAdderProject(object):
+    '''
+    A project with just a test bench that adds the two fields of each
+    packed input record.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files_and_ip = {
+            'design_files': [],
+            'simulation_files': [os.path.join(dir_path, 'packed_adder_tb.vhd')],
+            'ips': [],
+            'top_module': 'packed_adder_tb',
+        }
+
+
+class TestXSimProject(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = os.path.join(testdir, 'testxsimproject')
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+        os.mkdir(self.directory)
+
+    def write(self, name, contents):
+        fn = os.path.join(self.directory, name)
+        with open(fn, 'w') as f:
+            f.write(contents)
+        return fn
+
+    def test_compile_commands(self):
+        commands = xsim_project.get_compile_commands([
+            'a.vhd', 'b.vhdl', 'c.v', 'd.sv', 'e.xdc', 'f.vhd'])
+        self.assertEqual(commands, [
+            [config.xvhdl, '--work', 'work', 'a.vhd', 'b.vhdl'],
+            [config.xvlog, '--work', 'work', 'c.v'],
+            [config.xvlog, '--sv', '--work', 'work', 'd.sv'],
+            [config.xvhdl, '--work', 'work', 'f.vhd'],
+        ])
+
+    def test_headers_are_included_not_compiled(self):
+        commands = xsim_project.get_compile_commands([
+            'inc/defs.vh', 'top.v', 'inc/types.svh', 'other/pkg.svh',
+            'tb.sv'])
+        includes = ['--include', 'inc', '--include', 'other']
+        self.assertEqual(commands, [
+            [config.xvlog] + includes + ['--work', 'work', 'top.v'],
+            [config.xvlog, '--sv'] + includes + ['--work', 'work', 'tb.sv'],
+        ])
+
+    def test_compile_script(self):
+        script = xsim_project.make_compile_script(
+            filenames=['my dir/a.vhd', 'b.v'], top_module='top',
+            snapshot='top', generics={'WIDTH': 4, 'DEPTH': 2})
+        lines = script.splitlines()
+        self.assertEqual(lines[0], 'set -e')
+        self.assertEqual(lines[1], "{} --work work 'my dir/a.vhd'".format(
+            config.xvhdl))
+        self.assertEqual(lines[2], '{} --work work b.v'.format(config.xvlog))
+        self.assertEqual(lines[3], (
+            '{} --debug off --snapshot top --generic_top DEPTH=2 '
+            '--generic_top WIDTH=4 work.top').format(config.xelab))
+        self.assertEqual(len(lines), 4)
+
+    def test_snapshot_hash(self):
+        a = self.write('a.vhd', 'entity a is end;')
+        b = self.write('b.vhd', 'entity b is end;')
+        h = xsim_project.get_snapshot_hash([a, b], 'a', {'WIDTH': 4})
+        self.assertEqual(
+            h, xsim_project.get_snapshot_hash([a, b], 'a', {'WIDTH': 4}))
+        self.assertNotEqual(
+            h, xsim_project.get_snapshot_hash([a, b], 'b', {'WIDTH': 4}))
+        self.assertNotEqual(
+            h, xsim_project.get_snapshot_hash([a, b], 'a', {'WIDTH': 5}))
+        self.assertNotEqual(h, xsim_project.get_snapshot_hash([a, b], 'a'))
+        self.write('b.vhd', 'entity b is begin end;')
+        self.assertNotEqual(
+            h, xsim_project.get_snapshot_hash([a, b], 'a', {'WIDTH': 4}))
+
+    def test_packed_io_is_compiled(self):
+        x = xsim_project.XSimProject(
+            PackedAdderProject(self.directory),
+            snapshot_cache=disk_cache.DiskCache(
+                os.path.join(self.directory, 'cache')))
+        filenames = x.get_filenames()
+        self.assertEqual(filenames[0], packed_data.packed_io_filename)
+        self.assertEqual(filenames.count(packed_data.packed_io_filename), 1)
+
+    @unittest.skipIf(shutil.which(config.xsim) is None, 'Needs xsim.')
+    def test_packed_simulation(self):
+        x = xsim_project.XSimProject(
+            PackedAdderProject(self.directory),
+            snapshot_cache=disk_cache.DiskCache(
+                os.path.join(self.directory, 'cache')))
+        input_layout = packed_data.Layout([('a', 8), ('b', 8)])
+        output_layout = packed_data.Layout([('total', 9)])
+        input_data = [{'a': a, 'b': 3*a % 256} for a in range(100)]
+        errors, output = x.run_simulation(
+            test_name='adder', runtime='2 us', input_data=input_data,
+            input_layout=input_layout, output_layout=output_layout)
+        self.assertEqual(errors, [])
+        with output:
+            self.assertEqual(
+                [record['total'] for record in output],
+                [d['a'] + d['b'] for d in input_data])
+
+
+if __name__ == '__main__':
+    config.setup_logging(logging.DEBUG)
+    unittest.main()